@@ -50,6 +50,12 @@ def diagnose_plant(image_path: str, user_query: str = "", location: str = "Londo
         print("\n--- Sources ---")
         for ref in report.relevant_knowledge:
             print(f"> {ref[:100]}...") # Truncate for display
+
+        timings = pipeline.timings(result)
+        if timings:
+            print("\n--- Timings ---")
+            print(f"Critical path: {' -> '.join(timings.critical_path)} ({timings.critical_path_seconds:.2f}s, "
+                  f"serial {timings.serial_seconds:.2f}s)")
     else:
         print("Diagnosis failed to generate report.")
 
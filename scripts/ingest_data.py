@@ -1,3 +1,4 @@
+import argparse
 import sys
 
 from pathlib import Path
@@ -5,73 +6,55 @@ from pathlib import Path
 # Add project root to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.vector_store.chroma_store import BotanicalKnowledgeBase
-import uuid
+from src.core.config import settings
+from src.vector_store.ingestion import BulkIngestor, IngestionManifest, find_documents
 from typing import Union
 
-def ingest_file(file_path: Union[str, Path]):
-    kb = BotanicalKnowledgeBase()
+def ingest_file(file_path: Union[str, Path], ingestor: BulkIngestor = None):
     path = Path(file_path)
     if not path.exists():
         print(f"File not found: {file_path}")
         return
 
-    if path.suffix.lower() == ".pdf":
-        try:
-            from pypdf import PdfReader
-            reader = PdfReader(path)
-            content = ""
-            for page in reader.pages:
-                content += page.extract_text() + "\n\n"
-        except ImportError:
-            print("Error: pypdf not installed. Please run: pip install pypdf")
-            return
-    else:
-        # Assume text
-        with open(path, "r") as f:
-            content = f.read()
-    
-    # Simple chunking by paragraph for Phase 1
-    chunks = [c.strip() for c in content.split("\n\n") if c.strip()]
-    
-    if not chunks:
-        print(f"Skipping {path.name}: No indexable content found.")
+    ingestor = ingestor or BulkIngestor(manifest=IngestionManifest())
+    print(f"Ingestion complete: {ingestor.ingest([path])}")
+
+def process_path(input_paths, embed_batch_size: int = settings.INGEST_EMBED_BATCH_SIZE,
+                 write_batch_size: int = settings.INGEST_WRITE_BATCH_SIZE, force: bool = False):
+    """
+    Syncs every supported file under `input_paths` into the knowledge base: new and
+    changed files are (re-)ingested, unchanged ones skipped, and files deleted from
+    an ingested directory purged. One model load, batched embedding and writes.
+    """
+    input_paths = [input_paths] if isinstance(input_paths, (str, Path)) else input_paths
+    files = []
+    for input_path in input_paths:
+        if not Path(input_path).exists():
+            print(f"Path not found: {input_path}")
+            continue
+        if Path(input_path).is_dir():
+            print(f"Scanning directory: {input_path}")
+        files.extend(find_documents(input_path))
+
+    if not files:
+        print("No suitable files (.txt, .pdf) found.")
         return
-    
-    ids = [str(uuid.uuid4()) for _ in chunks]
-    metadatas = [{"source": path.name, "chunk_index": i} for i in range(len(chunks))]
-    
-    print(f"Ingesting {len(chunks)} chunks from {path.name}...")
-    kb.add_documents(documents=chunks, metadatas=metadatas, ids=ids)
-    print("Ingestion complete.")
 
-def process_path(input_path: str):
-    path = Path(input_path)
-    if not path.exists():
-        print(f"Path not found: {input_path}")
-        return
-
-    if path.is_file():
-        ingest_file(path)
-    elif path.is_dir():
-        print(f"Scanning directory: {path}")
-        supported_extensions = {".txt", ".pdf"}
-        # Recursive search for supported files
-        files = [p for p in path.rglob("*") if p.suffix.lower() in supported_extensions]
-        
-        if not files:
-            print("No suitable files (.txt, .pdf) found in directory.")
-            return
-            
-        print(f"Found {len(files)} files. Starting batch ingestion...")
-        for p in files:
-            ingest_file(p)
-    else:
-        print("Invalid path type.")
+    print(f"Found {len(files)} files. Starting batch ingestion...")
+    ingestor = BulkIngestor(embed_batch_size=embed_batch_size, write_batch_size=write_batch_size,
+                            manifest=IngestionManifest(), force=force)
+    stats = ingestor.ingest(files, roots=[Path(p) for p in input_paths])
+    print(f"Ingestion complete: {stats}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/ingest_data.py <file_or_directory_path>")
-        sys.exit(1)
-    
-    process_path(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Ingest .txt/.pdf documents into the FloraCare knowledge base.")
+    parser.add_argument("paths", nargs="+", help="Files or directories (searched recursively)")
+    parser.add_argument("--embed-batch-size", type=int, default=settings.INGEST_EMBED_BATCH_SIZE,
+                        help="Chunks per embedding forward pass")
+    parser.add_argument("--write-batch-size", type=int, default=settings.INGEST_WRITE_BATCH_SIZE,
+                        help="Chunks per Chroma write")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-read every file instead of trusting the manifest's mtimes and hashes")
+    args = parser.parse_args()
+
+    process_path(args.paths, args.embed_batch_size, args.write_batch_size, args.force)
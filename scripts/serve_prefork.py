@@ -0,0 +1,125 @@
+"""
+Pre-fork server for the FloraCare API.
+
+The master process loads the embedding model (and torch) and the knowledge base
+files once, then forks the uvicorn workers, so the model weights are shared
+copy-on-write instead of being loaded N times. Each worker logs its RSS/PSS after
+warm-up; with shared pages PSS per worker stays well below RSS.
+
+Usage:
+    python scripts/serve_prefork.py --workers 4 --port 8000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add project root to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+# Metrics from every worker are written here and merged by /metrics.
+# Must be set before prometheus_client is imported.
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="floracare_metrics_")
+
+import uvicorn
+from prometheus_client import multiprocess
+
+from src.core.process_stats import memory_usage, format_memory_usage
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str):
+    # Default signal handling back for uvicorn's own graceful shutdown
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn(app, sock: socket.socket, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, log_level)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    print(f"Started worker {pid}")
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the FloraCare API with pre-forked workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from src.vector_store.chroma_store import preload_for_fork
+    preload_for_fork()
+    # Importing the app pulls in LangGraph, Gemini and the rest of the stack once
+    from src.api.main import app
+    print(f"Master preloaded models in {time.perf_counter() - start:.1f}s "
+          f"({format_memory_usage(memory_usage())})")
+
+    sock = bind_socket(args.host, args.port)
+    # Keep the preloaded objects out of the GC's reach: collections in the workers
+    # would otherwise touch their headers and un-share the pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {spawn(app, sock, args.log_level) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            workers.add(spawn(app, sock, args.log_level))
+
+    sock.close()
+    print("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,51 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request, Response, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
-import shutil
 import os
+import json
 import uuid
-from typing import List
+import asyncio
+import mimetypes
+import threading
+import time
+from typing import List, Optional, Tuple
 
-from src.models.schemas import DiagnosisReport, ChatRequest, ChatResponse
-from src.services.vision_enhancer import enhance_image_for_ai
+from src.core.config import settings
+from src.core.metrics import REQUEST_LATENCY, ENHANCEMENT_SECONDS, IMAGE_PAYLOAD_BYTES, ERRORS, render_metrics
+from src.core.process_stats import memory_usage, format_memory_usage
+from src.models.schemas import (
+    DiagnosisReport, ChatRequest, ChatResponse,
+    BatchDiagnosisItem, BatchDiagnosisResponse, JobStatus,
+)
+from src.services.vision_enhancer import prepare_image_for_ai
+from src.services.job_queue import JobQueue
+from src.services.result_cache import DiagnosisCache
+from src.services.chat import ChatService
+from src.services.admission import AdmissionController, OverloadedError
+from src.services.checkpoints import CheckpointStore
+from src.services.near_duplicates import NearDuplicateIndex
+from src.services.weather import WeatherService
 
 # --- Lifecycle & App ---
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Ensure Directories
-    os.makedirs("temp_uploads", exist_ok=True)
+    if settings.PERSIST_UPLOADS:
+        os.makedirs("temp_uploads", exist_ok=True)
+    # One pooled HTTP client for all weather fetches of this process
+    weather_service.open()
+    # Warm-up runs in the background so /health and /ready answer while models load
+    warmup_task = asyncio.create_task(_warm_up()) if settings.WARMUP_ON_STARTUP else None
+    # Job mode: drain queued diagnoses in the background
+    await job_queue.start(_run_job)
     yield
     # Shutdown: Clean temp if needed
-    pass
+    await job_queue.stop()
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await weather_service.aclose()
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -30,21 +59,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (e.g. /jobs/{job_id}) to keep cardinality bounded
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint, status=str(status)).observe(
+            time.perf_counter() - start
+        )
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 # --- Init Components (Global for now for persistent caching if needed) ---
 # In a real app we might use Dependency Injection, but for MVP this is fine.
 # We init pipeline per request or global? Pipeline loads heavy models 
 # (SentenceTransformer, GenAI). Global is better.
-pipeline_instance = None
+rag_pipeline_instance = None
+weather_service = WeatherService() # handed to the RAGPipeline; its HTTP client lives with the app
+pipeline_instances = {} # mode -> compiled graph
+_pipeline_lock = threading.Lock()
+
+# Readiness: flipped once warm-up has finished (or immediately when warm-up is disabled)
+pipeline_ready = not settings.WARMUP_ON_STARTUP
+warmup_error = None
+
+def get_rag_pipeline():
+    """The shared RAGPipeline (models, KB, weather service) behind the compiled graph."""
+    global rag_pipeline_instance
+    if rag_pipeline_instance is None:
+        # Warm-up builds this from a worker thread; don't construct it twice
+        with _pipeline_lock:
+            if rag_pipeline_instance is None:
+                print("Initializing Global RAG Pipeline...")
+                from src.rag.pipeline import RAGPipeline
+                rag_pipeline_instance = RAGPipeline(weather_service=weather_service)
+    return rag_pipeline_instance
+
+def get_pipeline(mode: str = "full"):
+    if mode not in pipeline_instances:
+        pipeline_instances[mode] = get_rag_pipeline().build_graph(mode)
+    return pipeline_instances[mode]
+
+def _build_and_warm():
+    start = time.perf_counter()
+    get_pipeline()
+    get_pipeline("lite")
+    get_rag_pipeline().warm_up()
+    print(f"RAG Pipeline warm-up finished in {time.perf_counter() - start:.1f}s "
+          f"({format_memory_usage(memory_usage())})")
 
-def get_pipeline():
-    global pipeline_instance
-    if pipeline_instance is None:
-        print("Initializing Global RAG Pipeline...")
-        from src.rag.pipeline import RAGPipeline
-        p = RAGPipeline()
-        pipeline_instance = p.build_graph()
-    return pipeline_instance
+async def _warm_up():
+    global pipeline_ready, warmup_error
+    try:
+        await asyncio.to_thread(_build_and_warm)
+        pipeline_ready = True
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        warmup_error = str(e)
 
 # --- Endpoints ---
 
@@ -52,93 +138,600 @@ def get_pipeline():
 def health_check():
     return {"status": "ok", "service": "FloraCare AI"}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/ready")
+def readiness_check():
+    """503 until the pipeline is built and warm, so load balancers only route to hot instances."""
+    if pipeline_ready:
+        return {"status": "ready"}
+    if warmup_error:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": warmup_error})
+    return JSONResponse(status_code=503, content={"status": "warming_up"})
+
+async def _read_upload(file: UploadFile) -> Tuple[bytes, str]:
+    """Reads the upload and enhances it for the vision model. Returns (image bytes, mime type)."""
+    raw_bytes = await file.read()
+    return await _prepare_image(raw_bytes, file.filename, file.content_type)
+
+async def _prepare_image(raw_bytes: bytes, filename: str, content_type: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Downsizes and enhances an uploaded image. The result travels through the pipeline
+    state in memory; writing a copy to temp_uploads/ is an optional background side effect.
+    """
+    try:
+        with ENHANCEMENT_SECONDS.time():
+            enhanced_bytes, mime_type = await asyncio.to_thread(prepare_image_for_ai, raw_bytes)
+    except Exception as e:
+        ERRORS.labels(stage="enhancement").inc()
+        print(f"Enhancement failed, using raw image: {e}")
+        enhanced_bytes, mime_type = raw_bytes, None
+
+    if mime_type is None:
+        # Enhancement fell back to the original upload
+        mime_type = content_type or mimetypes.guess_type(filename)[0] or "image/jpeg"
+    IMAGE_PAYLOAD_BYTES.labels(stage="uploaded").observe(len(raw_bytes))
+    IMAGE_PAYLOAD_BYTES.labels(stage="sent").observe(len(enhanced_bytes))
+
+    if settings.PERSIST_UPLOADS:
+        _run_in_background(asyncio.to_thread(_write_upload, enhanced_bytes, filename))
+    return enhanced_bytes, mime_type
+
+_background_tasks = set()
+
+def _run_in_background(coro):
+    # Keep a reference so the task isn't garbage collected before it finishes
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _write_upload(image_bytes: bytes, filename: str):
+    file_ext = filename.split('.')[-1]
+    unique_name = f"{uuid.uuid4()}.{file_ext}"
+    try:
+        with open(os.path.join("temp_uploads", unique_name), "wb") as buffer:
+            buffer.write(image_bytes)
+    except Exception as e:
+        print(f"Persisting upload failed: {e}")
+
+def _initial_state(image_bytes: bytes, image_mime: str, location: str, user_query: str = None) -> dict:
+    return {
+        "image_path": None,
+        "image_bytes": image_bytes,
+        "image_mime": image_mime,
+        "user_query": user_query if user_query else "",
+        "location": location,
+        # plant_name/id removed
+        "analysis": None,
+        "retrieved_context": [],
+        "speculative_context": None,
+        "weather": None,
+        "weather_fetched": False,
+        # history_summary removed
+        "final_report": None
+    }
+
+# --- Checkpoints ---
+
+checkpoints = CheckpointStore() if settings.CHECKPOINTS_ENABLED else None
+
+async def _run_diagnosis(initial_state: dict, mode: str = "full", request_id: Optional[str] = None) -> DiagnosisReport:
+    """
+    Runs the `mode` graph and returns the final report, with the node timings of the run.
+    With a `request_id`, a failed run is checkpointed with the node outputs it had so far.
+    """
+    if request_id is None or checkpoints is None:
+        result = await get_pipeline(mode).ainvoke(initial_state)
+    else:
+        # Outputs are only accumulated in memory; the happy path writes nothing
+        result = {**initial_state, "node_timings": {}}
+        try:
+            async for update in get_pipeline(mode).astream(initial_state, stream_mode="updates"):
+                for node_output in update.values():
+                    node_output = dict(node_output or {})
+                    result["node_timings"].update(node_output.pop("node_timings", {}))
+                    result.update(node_output)
+        except Exception:
+            await asyncio.to_thread(checkpoints.save, request_id, result, mode)
+            raise
+    report = result.get('final_report')
+    if not report:
+        raise ValueError("Diagnosis failed to generate report")
+    return report.model_copy(update={"timings": get_rag_pipeline().timings(result, mode)})
+
+# --- Admission Control ---
+
+admission = AdmissionController()
+
+# --- Result Cache ---
+
+result_cache = DiagnosisCache() if settings.RESULT_CACHE_ENABLED else None
+
+# --- Near-Duplicate Uploads ---
+
+near_duplicates = NearDuplicateIndex() if settings.NEAR_DUPLICATE_ENABLED else None
+
+async def _reuse_near_duplicate(state: dict, image_bytes: bytes, bypass_cache: bool = False) -> Optional[int]:
+    """
+    Pre-fills state["analysis"] with the analysis of a recent near-identical upload.
+    Returns the image's perceptual hash if the analysis still has to be computed
+    (pass it to _remember_analysis afterwards), None otherwise.
+    """
+    if near_duplicates is None or state.get("analysis") is not None:
+        return None
+    image_hash = await asyncio.to_thread(near_duplicates.image_hash, image_bytes)
+    if image_hash is None or bypass_cache:
+        return image_hash
+    analysis = near_duplicates.lookup(image_hash)
+    if analysis is None:
+        return image_hash
+    # Reused analyses are not re-indexed, so matches can't drift from photo to photo
+    state["analysis"] = analysis
+    return None
+
+def _remember_analysis(image_hash: Optional[int], report: DiagnosisReport):
+    if near_duplicates is not None and image_hash is not None:
+        near_duplicates.add(image_hash, report.analysis)
+
+def _cache_bypass_requested(x_cache_bypass: Optional[str], cache_control: Optional[str]) -> bool:
+    """`X-Cache-Bypass: 1` or `Cache-Control: no-cache` forces a fresh diagnosis."""
+    if x_cache_bypass and x_cache_bypass.strip().lower() in ("1", "true", "yes"):
+        return True
+    return bool(cache_control and "no-cache" in cache_control.lower())
+
+async def _admitted_diagnosis(initial_state: dict, admit: bool = True, mode: str = "full",
+                              request_id: Optional[str] = None) -> DiagnosisReport:
+    if not admit:
+        return await _run_diagnosis(initial_state, mode, request_id)
+    async with admission.admit():
+        return await _run_diagnosis(initial_state, mode, request_id)
+
+async def _cached_diagnosis(initial_state: dict, image_bytes: bytes, bypass_cache: bool = False,
+                            admit: bool = True, mode: str = "full",
+                            request_id: Optional[str] = None) -> Tuple[DiagnosisReport, str]:
+    """
+    Runs the pipeline behind the result cache; cache hits skip admission control.
+    Returns the report and the cache status: "HIT", "MISS" or "BYPASS".
+    """
+    if result_cache is None:
+        image_hash = await _reuse_near_duplicate(initial_state, image_bytes, bypass_cache) if mode == "full" else None
+        report = await _admitted_diagnosis(initial_state, admit, mode, request_id)
+        _remember_analysis(image_hash, report)
+        return await asyncio.to_thread(_attach_chat_session, report), "BYPASS"
+
+    key = result_cache.make_key(image_bytes, initial_state["user_query"], initial_state["location"], mode)
+    if not bypass_cache:
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            return await asyncio.to_thread(_attach_chat_session, cached), "HIT"
+
+    # Cached without a diagnosis_id: every response gets its own chat session
+    image_hash = await _reuse_near_duplicate(initial_state, image_bytes, bypass_cache) if mode == "full" else None
+    report = await _admitted_diagnosis(initial_state, admit, mode, request_id)
+    _remember_analysis(image_hash, report)
+    await asyncio.to_thread(result_cache.set, key, report)
+    report = await asyncio.to_thread(_attach_chat_session, report)
+    return report, "BYPASS" if bypass_cache else "MISS"
+
+# --- Chat Sessions ---
+
+chat_service = ChatService()
+
+def _attach_chat_session(report: DiagnosisReport) -> DiagnosisReport:
+    """Opens a chat session for the report and returns a copy carrying its diagnosis_id."""
+    diagnosis_id = chat_service.start_session(report)
+    return report.model_copy(update={"diagnosis_id": diagnosis_id})
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(jsonable_encoder(event)) + "\n"
+
 @app.post("/diagnose", response_model=DiagnosisReport)
 async def diagnose_plant(
-    file: UploadFile = File(...),
+    response: Response,
+    file: UploadFile = File(None),
     location: str = Form("London,UK"),
-    user_query: str = Form(None)
+    user_query: str = Form(None),
+    mode: str = Form("full"),
+    request_id: str = Form(None),
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None)
 ):
+    """
+    `mode=full` (default): vision analysis, retrieval and a separate reasoning call.
+    `mode=lite`: one multimodal call with the weather and knowledge prefetched from
+    the user's question; about half the latency and cost, less grounded.
+
+    Every response carries an X-Request-Id header. If a diagnosis fails, sending that
+    id back as `request_id` (the file can be omitted) resumes after the pipeline
+    nodes that already finished, using the image and inputs of the first attempt.
+    """
+    if mode not in ("full", "lite"):
+        raise HTTPException(status_code=400, detail="mode must be 'full' or 'lite'")
+
+    checkpoint = None
+    if request_id and checkpoints is not None:
+        checkpoint = await asyncio.to_thread(checkpoints.load, request_id)
+    if checkpoint is None and file is None:
+        if request_id:
+            raise HTTPException(status_code=404, detail="Unknown or expired request_id, please upload the image again")
+        raise HTTPException(status_code=422, detail="file is required")
+    request_id = request_id or str(uuid.uuid4())
+    response.headers["X-Request-Id"] = request_id
+
     try:
-        # 1. Save File to Disk (Temp) - WITH ENHANCEMENT
-        file_ext = file.filename.split('.')[-1]
-        unique_name = f"{uuid.uuid4()}.{file_ext}"
-        temp_path = os.path.join("temp_uploads", unique_name)
-        
-        # Read and Enhance
-        raw_bytes = await file.read()
-        try:
-            enhanced_bytes = enhance_image_for_ai(raw_bytes)
-        except Exception as e:
-            print(f"Enhancement failed, using raw image: {e}")
-            enhanced_bytes = raw_bytes
-
-        with open(temp_path, "wb") as buffer:
-            buffer.write(enhanced_bytes)
-            
-        # 2. Invoke Pipeline
-        workflow = get_pipeline()
-        
-        initial_state = {
-            "image_path": temp_path,
-            "user_query": user_query if user_query else "",
-            "location": location,
-            # plant_name/id removed
-            "analysis": None,
-            "retrieved_context": [],
-            "weather": None,
-            # history_summary removed
-            "final_report": None
-        }
-        
-        result = await workflow.ainvoke(initial_state)
-        report = result.get('final_report')
-        
-        if not report:
-             raise HTTPException(status_code=500, detail="Diagnosis failed to generate report")
-             
-        # Cleanup (Optional: Keep for debug?)
-        # os.remove(temp_path) 
+        if checkpoint is not None:
+            # Resume: inputs of the first attempt, finished nodes pre-filled
+            print(f"Resuming diagnosis {request_id} after: {', '.join(checkpoint.outputs) or 'nothing'}")
+            enhanced_bytes, mode = checkpoint.image_bytes, checkpoint.mode
+            initial_state = _initial_state(enhanced_bytes, checkpoint.image_mime, checkpoint.location, checkpoint.user_query)
+            initial_state.update(checkpoint.outputs)
+        else:
+            # 1. Read + Enhance (kept in memory)
+            enhanced_bytes, mime_type = await _read_upload(file)
+            initial_state = _initial_state(enhanced_bytes, mime_type, location, user_query)
+
+        # 2. Invoke Pipeline (behind the result cache)
+        report, cache_status = await _cached_diagnosis(
+            initial_state, enhanced_bytes, _cache_bypass_requested(x_cache_bypass, cache_control),
+            mode=mode, request_id=request_id
+        )
+        response.headers["X-Cache"] = cache_status
+        if checkpoint is not None:
+            await asyncio.to_thread(checkpoints.delete, request_id)
         
         return report
 
+    except OverloadedError:
+        raise
     except Exception as e:
+        ERRORS.labels(stage="diagnose").inc()
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Request-Id": request_id})
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_with_context(request: ChatRequest):
-    import google.generativeai as genai
-    from src.core.config import settings
+@app.post("/diagnose/stream")
+async def diagnose_plant_stream(
+    file: UploadFile = File(...),
+    location: str = Form("London,UK"),
+    user_query: str = Form(None),
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None)
+):
+    """
+    Same as /diagnose, but streams newline-delimited JSON events as each
+    LangGraph node completes (image analysis and weather run in parallel, so
+    their events can arrive in either order):
 
+        {"event": "node", "node": "fetch_context", "seconds": 0.3, "data": {"weather": {...}}}
+        {"event": "node", "node": "analyze_image", "seconds": 4.1, "data": {"analysis": {...}}}
+        {"event": "node", "node": "retrieve_context", "seconds": 0.1, "data": {"retrieved_context": [...]}}
+        {"event": "report", "data": {...DiagnosisReport...}}
+
+    When the analysis of a near-identical recent upload is reused, analyze_image
+    does no work but its event still carries that analysis.
+    Failures after the stream has started are reported as {"event": "error", "detail": "..."}.
+    A cache hit streams the report event only.
+    """
+    # Read the upload before the response starts; the UploadFile is closed afterwards.
+    enhanced_bytes, mime_type = await _read_upload(file)
+    workflow = get_pipeline()
+    initial_state = _initial_state(enhanced_bytes, mime_type, location, user_query)
+    bypass_cache = _cache_bypass_requested(x_cache_bypass, cache_control)
+
+    cache_key = None
+    cache_status = "BYPASS"
+    if result_cache is not None:
+        cache_key = result_cache.make_key(enhanced_bytes, initial_state["user_query"], location)
+        if not bypass_cache:
+            cached = await asyncio.to_thread(result_cache.get, cache_key)
+            if cached is not None:
+                cached = await asyncio.to_thread(_attach_chat_session, cached)
+                return StreamingResponse(
+                    iter([_ndjson({"event": "report", "data": cached})]),
+                    media_type="application/x-ndjson",
+                    headers={"X-Cache": "HIT"}
+                )
+            cache_status = "MISS"
+
+    # Shed load before the 200 is sent; the slot itself is held inside the stream
+    admission.ensure_capacity()
+    image_hash = await _reuse_near_duplicate(initial_state, enhanced_bytes, bypass_cache)
+
+    async def event_stream():
+        report = None
+        node_timings = {}
+        try:
+            async with admission.admit():
+                async for update in workflow.astream(initial_state, stream_mode="updates"):
+                    for node_name, node_output in update.items():
+                        node_output = dict(node_output or {})
+                        report = node_output.pop("final_report", None) or report
+                        timing = node_output.pop("node_timings", {})
+                        node_timings.update(timing)
+                        start, end = timing.get(node_name, (0.0, 0.0))
+                        if node_name == "analyze_image" and "analysis" not in node_output:
+                            # Skipped because the analysis was pre-filled; the client still needs it
+                            node_output["analysis"] = initial_state.get("analysis")
+                        yield _ndjson({"event": "node", "node": node_name,
+                                       "seconds": round(end - start, 4), "data": node_output})
+
+            if not report:
+                yield _ndjson({"event": "error", "detail": "Diagnosis failed to generate report"})
+                return
+            report = report.model_copy(update={"timings": get_rag_pipeline().timings({"node_timings": node_timings})})
+            _remember_analysis(image_hash, report)
+            if cache_key is not None:
+                await asyncio.to_thread(result_cache.set, cache_key, report)
+            report = await asyncio.to_thread(_attach_chat_session, report)
+            yield _ndjson({"event": "report", "data": report})
+
+        except Exception as e:
+            ERRORS.labels(stage="diagnose_stream").inc()
+            import traceback
+            traceback.print_exc()
+            yield _ndjson({"event": "error", "detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(), media_type="application/x-ndjson", headers={"X-Cache": cache_status}
+    )
+
+@app.post("/diagnose/batch", response_model=BatchDiagnosisResponse)
+async def diagnose_batch(
+    files: List[UploadFile] = File(...),
+    location: str = Form("London,UK"),
+    user_query: str = Form(None),
+    locations: List[str] = Form(None),
+    concurrency: int = Form(None),
+    x_cache_bypass: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None)
+):
+    """
+    Diagnoses many images in one request.
+
+    Weather is fetched once per distinct location and the retrieval queries of
+    all images are embedded in a single call; the remaining work runs through the
+    compiled graph with at most `concurrency` images in flight. A failing image
+    is reported in its own result and does not fail the batch. Images already in
+    the result cache are answered without running the pipeline. Batch reports
+    carry no `timings`: the images share their weather and retrieval steps.
+    """
+    if locations and len(locations) != len(files):
+        raise HTTPException(status_code=422, detail="'locations' must have one entry per file")
+
+    # The whole batch holds one admission slot; its own semaphore bounds the fan-out
+    async with admission.admit():
+        return await _diagnose_batch(files, location, user_query, locations, concurrency,
+                                     _cache_bypass_requested(x_cache_bypass, cache_control))
+
+async def _diagnose_batch(files, location, user_query, locations, concurrency, bypass_cache) -> BatchDiagnosisResponse:
+    limit = max(1, min(concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+    pipeline = get_rag_pipeline()
+    workflow = get_pipeline()
+
+    results = [BatchDiagnosisItem(filename=f.filename) for f in files]
+    states = [None] * len(files)
+    cache_keys = [None] * len(files)
+    image_hashes = [None] * len(files)
+
+    # 1. Read + enhance every upload (bounded), answer cache hits (and near-duplicate analyses) directly
+    async def prepare(i, f):
+        async with semaphore:
+            try:
+                enhanced_bytes, mime_type = await _read_upload(f)
+                states[i] = _initial_state(enhanced_bytes, mime_type, locations[i] if locations else location, user_query)
+            except Exception as e:
+                results[i].error = f"Upload failed: {e}"
+                return
+
+            if result_cache is not None:
+                cache_keys[i] = result_cache.make_key(enhanced_bytes, states[i]["user_query"], states[i]["location"])
+                if not bypass_cache:
+                    cached = await asyncio.to_thread(result_cache.get, cache_keys[i])
+                    if cached is not None:
+                        results[i].report = await asyncio.to_thread(_attach_chat_session, cached)
+                        states[i] = None
+            if states[i] is not None:
+                image_hashes[i] = await _reuse_near_duplicate(states[i], enhanced_bytes, bypass_cache)
+
+    await asyncio.gather(*[prepare(i, f) for i, f in enumerate(files)])
+
+    # The shared question is looked up once, while weather and vision run
+    speculative_query = pipeline.speculative_query(user_query) if any(states) else None
+    speculative_task = (
+        asyncio.create_task(pipeline.kb.query_async(
+            speculative_query, pipeline.RETRIEVAL_RESULTS, settings.SPECULATIVE_RETRIEVAL_MODE
+        ))
+        if speculative_query else None
+    )
+
+    # 2. Weather once per distinct location
+    distinct_locations = {s["location"] for s in states if s}
+    weather_by_location = dict(zip(
+        distinct_locations,
+        await asyncio.gather(*[
+            pipeline.weather_service.get_current_weather_async(loc)
+            for loc in distinct_locations
+        ])
+    ))
+    for state in states:
+        if state:
+            # Marked as fetched even if the lookup failed, so the graph doesn't retry it per image
+            state["weather"] = weather_by_location.get(state["location"])
+            state["weather_fetched"] = True
+
+    # 3. Vision analysis, bounded
+    async def analyze(i):
+        async with semaphore:
+            try:
+                update = await pipeline.analyze_node_async(states[i])
+                states[i].update(update)
+            except Exception as e:
+                ERRORS.labels(stage="diagnose_batch").inc()
+                results[i].error = str(e)
+                states[i] = None
+
+    await asyncio.gather(*[analyze(i) for i, s in enumerate(states) if s])
+
+    # 4. All retrieval queries in one embedding call
+    pending = [i for i, s in enumerate(states) if s]
+    if pending:
+        queries = [pipeline.retrieval_query(states[i]["analysis"]) for i in pending]
+        try:
+            speculative = await speculative_task if speculative_task else []
+            contexts = await pipeline.kb.query_batch_async(queries, pipeline.RETRIEVAL_RESULTS, settings.RETRIEVAL_MODE)
+            for i, context in zip(pending, contexts):
+                states[i]["retrieved_context"] = pipeline.merge_context(context, speculative)
+        except Exception as e:
+            # Fall back to per-image retrieval inside the graph
+            print(f"Batch retrieval failed, retrieving per image: {e}")
+    elif speculative_task:
+        speculative_task.cancel()
+
+    # 5. Finish each image through the compiled graph (pre-filled nodes are skipped)
+    async def finish(i):
+        async with semaphore:
+            try:
+                result = await workflow.ainvoke(states[i])
+                report = result.get('final_report')
+                if not report:
+                    raise ValueError("Diagnosis failed to generate report")
+                _remember_analysis(image_hashes[i], report)
+                if cache_keys[i] is not None:
+                    await asyncio.to_thread(result_cache.set, cache_keys[i], report)
+                results[i].report = await asyncio.to_thread(_attach_chat_session, report)
+            except Exception as e:
+                ERRORS.labels(stage="diagnose_batch").inc()
+                results[i].error = str(e)
+
+    await asyncio.gather(*[finish(i) for i in pending])
+
+    return BatchDiagnosisResponse(results=results)
+
+# --- Job Mode ---
+
+job_queue = JobQueue()
+
+async def _run_job(job: dict) -> DiagnosisReport:
+    enhanced_bytes, mime_type = await _prepare_image(job["image"], job["filename"])
+    initial_state = _initial_state(enhanced_bytes, mime_type, job["location"], job["user_query"])
+    # Job workers are already a bounded pool; they don't compete for request slots
+    report, _ = await _cached_diagnosis(initial_state, enhanced_bytes, admit=False)
+    return report
+
+def _job_status(job: dict) -> JobStatus:
+    return JobStatus(
+        job_id=job["id"],
+        status=job["status"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        result=job["result"],
+        error=job["error"]
+    )
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    location: str = Form("London,UK"),
+    user_query: str = Form(None),
+    webhook_url: str = Form(None)
+):
+    """
+    Queues a diagnosis and returns immediately. Poll GET /jobs/{job_id} for the
+    result, or pass `webhook_url` to have the final JobStatus POSTed to you.
+    """
+    raw_bytes = await file.read()
+    job_id = await asyncio.to_thread(
+        job_queue.submit, raw_bytes, file.filename, location, user_query, webhook_url
+    )
+    return _job_status(await asyncio.to_thread(job_queue.get, job_id))
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
+
+@app.get("/cache/stats")
+def cache_stats():
+    extra = {
+        "near_duplicate": near_duplicates.stats() if near_duplicates is not None else {"enabled": False},
+        # Not built until warm-up or the first diagnosis
+        "retrieval": rag_pipeline_instance.kb.cache_stats() if rag_pipeline_instance is not None else None,
+    }
+    if result_cache is None:
+        return {"enabled": False, **extra}
+    return {"enabled": True, **result_cache.stats(), **extra}
+
+def _resolve_chat_session(request: ChatRequest):
+    """
+    Loads the session for request.diagnosis_id. Clients that still send the full
+    report (or whose session expired) get a session seeded from context + history.
+    """
+    if request.diagnosis_id:
+        session = chat_service.store.get(request.diagnosis_id)
+        if session is not None:
+            return session
+        if request.context is None:
+            raise HTTPException(status_code=404, detail="Chat session not found or expired")
+
+    if request.context is None:
+        raise HTTPException(status_code=422, detail="Either 'diagnosis_id' or 'context' is required")
+
+    diagnosis_id = chat_service.start_session(request.context, request.history, request.diagnosis_id)
+    return chat_service.store.get(diagnosis_id)
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_with_context(request: ChatRequest, background_tasks: BackgroundTasks):
     try:
-        # Construct Prompt
-        # Convert previous messages to string
-        history_text = ""
-        for msg in request.history:
-            history_text += f"{msg.role.upper()}: {msg.content}\n"
-            
-        context_str = str(request.context) # JSON dump of the diagnosis
-        
-        prompt = f"""
-        You are an expert botanist assistant.
-        
-        CONTEXT (Diagnosis Report):
-        {context_str}
-        
-        CONVERSATION HISTORY:
-        {history_text}
-        
-        USER: {request.message}
-        
-        ASSISTANT:
-        """
-        
-        # We use a lightweight model for chat to be snappy
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
-        
-        return {"response": response.text}
-        
+        session = await asyncio.to_thread(_resolve_chat_session, request)
+        answer = await chat_service.reply(session, request.message)
+        await asyncio.to_thread(chat_service.record_turn, session, request.message, answer)
+
+        # Summarize old turns after responding, once the history outgrows its budget
+        if chat_service.needs_compaction(session):
+            background_tasks.add_task(chat_service.compact, session.diagnosis_id)
+
+        return {"response": answer, "diagnosis_id": session.diagnosis_id}
+
+    except HTTPException:
+        raise
     except Exception as e:
+        ERRORS.labels(stage="chat").inc()
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/stream")
+async def chat_with_context_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat. Emits newline-delimited JSON:
+
+        {"event": "token", "text": "..."}   (repeated, as Gemini produces text)
+        {"event": "done", "diagnosis_id": "..."}
+
+    or {"event": "error", "detail": "..."} if generation fails mid-stream.
+    """
+    # Session errors (404/422) are returned before the stream starts
+    session = await asyncio.to_thread(_resolve_chat_session, request)
+
+    async def event_stream():
+        parts = []
+        try:
+            async for text in chat_service.reply_stream(session, request.message):
+                parts.append(text)
+                yield _ndjson({"event": "token", "text": text})
+        except Exception as e:
+            ERRORS.labels(stage="chat_stream").inc()
+            yield _ndjson({"event": "error", "detail": str(e)})
+            return
+
+        await asyncio.to_thread(chat_service.record_turn, session, request.message, "".join(parts))
+        if chat_service.needs_compaction(session):
+            _run_in_background(chat_service.compact(session.diagnosis_id))
+        yield _ndjson({"event": "done", "diagnosis_id": session.diagnosis_id})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
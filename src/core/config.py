@@ -9,6 +9,100 @@ class Settings:
     OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
     CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
     EMBEDDING_MODEL = "models/embedding-001" # Using Gemini embeddings for consistency
+    # Knowledge retrieval: "dense" (embeddings + Chroma), "lexical" (BM25 only, no embedding
+    # pass) or "hybrid" (both, fused), for the symptom query and for the prefetch from the
+    # user's question
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+    SPECULATIVE_RETRIEVAL_MODE = os.getenv("SPECULATIVE_RETRIEVAL_MODE", "dense")
+    LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.normpath(CHROMA_DB_PATH) + ".bm25.npz")
+    # In-process retrieval caches: query text -> embedding, and (embedding, n_results) -> chunks.
+    # Results are dropped whenever this process adds documents, and after the TTL otherwise
+    # (covers writes from other processes, e.g. scripts/ingest_data.py)
+    RETRIEVAL_EMBEDDING_CACHE_SIZE = int(os.getenv("RETRIEVAL_EMBEDDING_CACHE_SIZE", "1024"))
+    RETRIEVAL_RESULT_CACHE_SIZE = int(os.getenv("RETRIEVAL_RESULT_CACHE_SIZE", "512"))
+    RETRIEVAL_RESULT_CACHE_TTL = float(os.getenv("RETRIEVAL_RESULT_CACHE_TTL", "600"))
+    # Bulk ingestion (scripts/ingest_data.py): chunks per embedding forward pass and per Chroma write
+    INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "128"))
+    INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "1024"))
+    # Per-file hashes and chunk ids of everything ingested; re-runs only apply the delta
+    INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", os.path.normpath(CHROMA_DB_PATH) + ".manifest.json")
+    # Ingested files are identified by their path relative to this directory (absolute if outside it);
+    # defaults to the project root, so keys don't depend on the working directory
+    INGEST_CORPUS_ROOT = os.getenv("INGEST_CORPUS_ROOT", os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    # Threads reserved for SentenceTransformer encoding in the async pipeline
+    EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+    # Build and warm the RAG pipeline in the lifespan hook instead of on the first request
+    WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+    # Keep a copy of every enhanced upload in temp_uploads/ (written off the request path)
+    PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "false").lower() == "true"
+    # Vision payloads: uploads are downsized to IMAGE_MAX_EDGE px on the long side and
+    # encoded (jpeg or webp) at the highest quality in [IMAGE_MIN_QUALITY, IMAGE_MAX_QUALITY]
+    # that fits IMAGE_TARGET_BYTES
+    IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+    IMAGE_TARGET_BYTES = int(os.getenv("IMAGE_TARGET_BYTES", "350000"))
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg")
+    IMAGE_MIN_QUALITY = int(os.getenv("IMAGE_MIN_QUALITY", "60"))
+    IMAGE_MAX_QUALITY = int(os.getenv("IMAGE_MAX_QUALITY", "90"))
+    # Admission control: pipeline runs at once, requests allowed to wait, and how long they may wait
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+    # LLM backend: "live" calls Gemini, "record" also saves every call to LLM_CASSETTE_DIR,
+    # "replay" serves the saved calls offline (for benchmarks and CI)
+    LLM_BACKEND_MODE = os.getenv("LLM_BACKEND_MODE", "live")
+    LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "./cassettes")
+    # Simulated replay latency: none, recorded, fixed:S, uniform:A,B, normal:MEAN,STD, lognormal:MU,SIGMA
+    LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "none")
+    LLM_REPLAY_SEED = int(os.getenv("LLM_REPLAY_SEED")) if os.getenv("LLM_REPLAY_SEED") else None
+    # Resilience of every Gemini call: per-attempt timeout (s), retries with jittered
+    # exponential backoff, and hedging (a duplicate request once the first is slower than
+    # LLM_HEDGE_AFTER seconds, or than the observed p95 if unset). LLM_MODEL_POLICIES
+    # overrides these per model as JSON, e.g. {"gemini-2.5-flash": {"timeout": 30, "hedge": true}}
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER")) if os.getenv("LLM_HEDGE_AFTER") else None
+    LLM_MODEL_POLICIES = os.getenv("LLM_MODEL_POLICIES", "{}")
+    # Token budget for the knowledge snippets in the diagnosis prompt
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+    # Smaller budget for the single-call lite mode (POST /diagnose with mode=lite)
+    LITE_CONTEXT_TOKEN_BUDGET = int(os.getenv("LITE_CONTEXT_TOKEN_BUDGET", "300"))
+    # Max images of a /diagnose/batch request processed at the same time
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+    # Asynchronous job mode (POST /jobs)
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./jobs.db")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+    JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10.0"))
+    # A claimed job is leased to its worker and the lease renewed while it runs; jobs whose
+    # lease expired (worker process died) are picked up again by any worker
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+    # Server-side chat sessions (/chat with diagnosis_id)
+    CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "./chat_sessions.db")
+    CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "86400"))
+    CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500")) # older turns get summarized beyond this
+    CHAT_KEEP_RECENT_TURNS = int(os.getenv("CHAT_KEEP_RECENT_TURNS", "4"))
+    # Node-level checkpoints: a failed /diagnose can be retried with its X-Request-Id
+    # and resumes after the nodes that already finished
+    CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "true").lower() == "true"
+    CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", "./checkpoints.db")
+    CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "900"))
+    # Near-duplicate uploads (same leaf shot twice, re-encoded photo) reuse a recent
+    # vision analysis when their perceptual hashes (phash or dhash, 64 bit) differ
+    # in at most NEAR_DUPLICATE_MAX_DISTANCE bits
+    NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+    NEAR_DUPLICATE_HASH = os.getenv("NEAR_DUPLICATE_HASH", "phash")
+    NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+    NEAR_DUPLICATE_TTL = float(os.getenv("NEAR_DUPLICATE_TTL", "600"))
+    NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "10000"))
+    # Content-addressed DiagnosisReport cache (memory LRU + SQLite tier)
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", "./result_cache.db")
+    RESULT_CACHE_MEMORY_SIZE = int(os.getenv("RESULT_CACHE_MEMORY_SIZE", "256"))
+    RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "5000"))
+    RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600")) # seconds; also bounds weather staleness
 
 settings = Settings()
 
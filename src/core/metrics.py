@@ -0,0 +1,86 @@
+# Prometheus metrics for the API and the RAG pipeline, exposed on GET /metrics.
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Upstream calls (Gemini, full requests) take seconds, not milliseconds
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120, 300)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUEST_LATENCY = Histogram(
+    "floracare_request_seconds", "HTTP request latency (until response headers are sent)",
+    ["method", "endpoint", "status"], buckets=SLOW_BUCKETS
+)
+NODE_LATENCY = Histogram(
+    "floracare_pipeline_node_seconds", "Latency of each RAGPipeline graph node",
+    ["node"], buckets=SLOW_BUCKETS
+)
+GEMINI_LATENCY = Histogram(
+    "floracare_gemini_call_seconds", "Latency of Gemini generate_content calls",
+    ["model", "operation"], buckets=SLOW_BUCKETS
+)
+EMBEDDING_SECONDS = Histogram(
+    "floracare_embedding_seconds", "SentenceTransformer encode time", buckets=FAST_BUCKETS
+)
+CHROMA_QUERY_SECONDS = Histogram(
+    "floracare_chroma_query_seconds", "Chroma collection.query time", buckets=FAST_BUCKETS
+)
+LEXICAL_QUERY_SECONDS = Histogram(
+    "floracare_lexical_query_seconds", "BM25 index lookup time",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+)
+WEATHER_FETCH_SECONDS = Histogram(
+    "floracare_weather_fetch_seconds", "OpenWeatherMap round-trip time", buckets=SLOW_BUCKETS
+)
+ENHANCEMENT_SECONDS = Histogram(
+    "floracare_image_enhancement_seconds", "Image enhancement time before the vision call", buckets=FAST_BUCKETS
+)
+IMAGE_PAYLOAD_BYTES = Histogram(
+    "floracare_image_payload_bytes", "Image size as uploaded and as sent to the vision model",
+    ["stage"], buckets=(25e3, 50e3, 100e3, 200e3, 350e3, 500e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+)
+
+ERRORS = Counter("floracare_errors_total", "Errors by stage", ["stage"])
+CACHE_REQUESTS = Counter("floracare_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+UPSTREAM_RETRIES = Counter("floracare_upstream_retries_total", "Retried upstream calls", ["upstream"])
+CONTEXT_TOKENS = Histogram(
+    "floracare_context_tokens", "Estimated tokens of retrieved knowledge before and after packing",
+    ["stage"], buckets=(50, 100, 200, 400, 800, 1600, 3200, 6400, 12800)
+)
+NEAR_DUPLICATE_DISTANCE = Histogram(
+    "floracare_near_duplicate_distance_bits",
+    "Hamming distance from an upload's perceptual hash to its nearest recent upload (within 2x the threshold)",
+    buckets=(0, 1, 2, 3, 4, 6, 8, 10, 12, 16, 24, 32)
+)
+LLM_TIMEOUTS = Counter("floracare_llm_timeouts_total", "Gemini call attempts that hit the per-call timeout", ["model"])
+LLM_HEDGES = Counter(
+    "floracare_llm_hedges_total",
+    "Hedged Gemini calls by outcome (fired, hedge_won, primary_won)", ["model", "outcome"]
+)
+SPECULATIVE_RETRIEVALS = Counter(
+    "floracare_speculative_retrievals_total",
+    "Retrievals from the user's question run alongside image analysis, by outcome "
+    "(skipped: no useful terms, contributed: added chunks the symptom query missed, no_gain)",
+    ["outcome"]
+)
+
+# Admission control (diagnosis endpoints)
+# livesum: in pre-fork mode the scrape adds up the live workers
+ADMISSION_IN_FLIGHT = Gauge("floracare_admission_in_flight", "Diagnoses currently running", multiprocess_mode="livesum")
+ADMISSION_QUEUE_DEPTH = Gauge("floracare_admission_queue_depth", "Diagnoses waiting for a slot", multiprocess_mode="livesum")
+ADMISSION_WAIT_SECONDS = Histogram(
+    "floracare_admission_wait_seconds", "Time spent waiting for a diagnosis slot", buckets=SLOW_BUCKETS
+)
+ADMISSION_REJECTED = Counter("floracare_admission_rejected_total", "Requests shed by admission control", ["reason"])
+
+
+def render_metrics():
+    """
+    Returns (body, content_type) for the /metrics endpoint.
+    Under the pre-fork server (PROMETHEUS_MULTIPROC_DIR set) all workers are aggregated.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
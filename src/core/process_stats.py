@@ -0,0 +1,32 @@
+import os
+import resource
+
+
+def memory_usage() -> dict:
+    """
+    Memory of the current process in MB.
+
+    On Linux, /proc/self/smaps_rollup also gives PSS (RSS with shared pages split
+    between the processes sharing them) and the shared part of RSS, which is what
+    shows the copy-on-write saving of pre-fork serving.
+    """
+    usage = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) # kB
+        usage["rss_mb"] = round(fields.get("Rss", 0) / 1024, 1)
+        usage["pss_mb"] = round(fields.get("Pss", 0) / 1024, 1)
+        usage["shared_mb"] = round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1)
+    except OSError:
+        # Not Linux: peak RSS only (kB on Linux, bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["rss_mb"] = round(max_rss / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+    return usage
+
+
+def format_memory_usage(usage: dict) -> str:
+    return " ".join(f"{key}={value}" for key, value in usage.items())
@@ -0,0 +1,26 @@
+import re
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English with Gemini's tokenizer).
+    Good enough for budgeting prompts without a round-trip to count_tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+# Function words and question filler that carry no retrieval signal
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has
+have having he her here hers him his how i if in into is it its itself just me more most my no
+nor not now of off on once only or other our ours out over own same she should so some such
+than that the their them then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your yours
+anything something thing things get got go going know please help tell think want wrong ok okay
+""".split())
+
+
+def content_terms(text: str) -> list:
+    """Lower-cased words of `text` minus stopwords and very short tokens, in order of appearance."""
+    return [w for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if len(w) > 2 and w not in STOPWORDS]
@@ -13,8 +13,7 @@ from src.services.voice import VoiceService
 from src.services.pdf_generator import generate_pdf_report
 from src.models.schemas import PlantImageAnalysis
 import tempfile
-from concurrent.futures import ThreadPoolExecutor
-import time
+import json
 
 # --- Configuration ---
 API_URL = os.getenv("API_URL", "http://localhost:8000")
@@ -62,21 +61,54 @@ def check_backend_status():
     except:
         return False
 
-def call_backend_api(files, data):
-    """Blocking call to be run in a thread."""
-    with httpx.Client(timeout=300.0) as client:
-        response = client.post(f"{API_URL}/diagnose", files=files, data=data)
-        return response
-
-STATUS_STEPS = [
-    "Scanning leaf texture and discoloration...",
-    "Identifying plant species...",
-    "Analyzing visual symptoms (necrosis, chlorosis)...",
-    "Cross-referencing with Knowledge Base...",
-    "Fetching localized weather data...",
-    "Calculating confidence scores...",
-    "Generating treatment plan..."
-]
+def stream_backend_diagnosis(files, data):
+    """
+    Streams diagnosis progress from /diagnose/stream.
+    Yields (event, payload) tuples as each pipeline node completes.
+    """
+    with httpx.Client(timeout=httpx.Timeout(300.0, connect=10.0)) as client:
+        with client.stream("POST", f"{API_URL}/diagnose/stream", files=files, data=data) as response:
+            if response.status_code != 200:
+                response.read()
+                yield "error", f"Error {response.status_code}: {response.text}"
+                return
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["event"] == "node":
+                    yield event["node"], event["data"]
+                elif event["event"] == "report":
+                    yield "report", event["data"]
+                else:
+                    yield "error", event.get("detail", "Unknown error")
+
+class ChatSessionExpired(Exception):
+    pass
+
+def stream_chat_reply(payload):
+    """Yields answer text from /chat/stream as it is generated."""
+    with httpx.Client(timeout=httpx.Timeout(60.0, connect=10.0)) as client:
+        with client.stream("POST", f"{API_URL}/chat/stream", json=payload) as response:
+            if response.status_code == 404:
+                raise ChatSessionExpired()
+            if response.status_code != 200:
+                response.read()
+                raise RuntimeError(f"Error {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["event"] == "token":
+                    yield event["text"]
+                elif event["event"] == "error":
+                    raise RuntimeError(event.get("detail", "Unknown error"))
+
+# Image analysis and the weather fetch run in parallel; retrieval waits for the analysis
+NODE_STATUS = {
+    "analyze_image": "Cross-referencing with Knowledge Base...",
+    "retrieve_context": "Generating treatment plan...",
+}
 
 # --- Sidebar ---
 st.sidebar.title("Settings ⚙️")
@@ -134,29 +166,38 @@ if uploaded_file is not None:
                 "user_query": final_query
             }
             
-            # Call Backend with Dynamic Status
-            with st.status("🚀 Starting FloraCare Agent...", expanded=True) as status:
-                with ThreadPoolExecutor() as executor:
-                    future = executor.submit(call_backend_api, files, data)
-                    
-                    step_index = 0
-                    while not future.done():
-                        # Cycle through updates
-                        msg = STATUS_STEPS[step_index % len(STATUS_STEPS)]
-                        status.update(label=msg, state="running")
-                        time.sleep(1.5)
-                        step_index += 1
-                    
-                    # Get Result
-                    response = future.result()
-                    
-                    if response.status_code == 200:
-                        status.update(label="✅ Diagnosis Complete!", state="complete", expanded=False)
-                    else:
-                        status.update(label="❌ Connection Failed", state="error")
-                
-            if response.status_code == 200:
-                report = response.json()
+            # Call Backend with Live Progress
+            report = None
+            error_message = None
+            with st.status("🔬 Scanning leaf texture and identifying plant species...", expanded=True) as status:
+                for event, payload in stream_backend_diagnosis(files, data):
+                    if event == "analyze_image":
+                        # Partial result: show species and symptoms before the full report is ready
+                        analysis = payload.get("analysis") or {}
+                        st.write(f"🌱 **Plant:** {analysis.get('plant_type', 'Unknown')}")
+                        symptoms = analysis.get("visual_symptoms") or []
+                        if symptoms:
+                            st.write("**Symptoms:** " + ", ".join(symptoms))
+                    elif event == "fetch_context":
+                        weather = payload.get("weather")
+                        if weather:
+                            st.write(f"🌥️ **Weather:** {weather['condition']}, {weather['temperature']}°C")
+                    elif event == "report":
+                        report = payload
+                        continue
+                    elif event == "error":
+                        error_message = payload
+                        continue
+
+                    if event in NODE_STATUS:
+                        status.update(label=NODE_STATUS[event], state="running")
+
+                if report is not None:
+                    status.update(label="✅ Diagnosis Complete!", state="complete", expanded=False)
+                else:
+                    status.update(label="❌ Diagnosis Failed", state="error")
+
+            if report is not None:
                 st.session_state['diagnosis_result'] = report
                 st.session_state['last_file'] = uploaded_file.name
                 
@@ -171,7 +212,7 @@ if uploaded_file is not None:
                 
 
             else:
-                st.error(f"Error {response.status_code}: {response.text}")
+                st.error(error_message or "Diagnosis failed to generate report")
 
         except httpx.ConnectError:
             st.error("Cannot connect to Backend API. Is it running? (http://localhost:8000)")
@@ -339,23 +380,26 @@ if 'diagnosis_result' in st.session_state and st.session_state.get('last_file')
         with st.chat_message("user"):
             st.write(user_input)
             
-        # Call Backend
+        # Call Backend (tokens are rendered as they arrive)
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
+            try:
+                # The server keeps the diagnosis context and history; send only the new message
+                payload = {
+                    "message": user_input,
+                    "diagnosis_id": report.get('diagnosis_id')
+                }
+                seed = {
+                    "context": report,
+                    "history": st.session_state['chat_history'][:-1]
+                }
+                if not payload["diagnosis_id"]:
+                    payload.update(seed)
                 try:
-                    payload = {
-                        "message": user_input,
-                        "context": report,
-                        "history": st.session_state['chat_history'][:-1] # Exclude current message? Or include? API expects history BEFORE current msg usually, or we handle it. Simple protocol: pass history including recent? Schema says 'history' is previous.
-                    }
-                    # Schema adjustment: API expects 'history' list of objects.
-                    
-                    res = httpx.post(f"{API_URL}/chat", json=payload, timeout=30.0)
-                    if res.status_code == 200:
-                        bot_response = res.json()['response']
-                        st.write(bot_response)
-                        st.session_state['chat_history'].append({"role": "assistant", "content": bot_response})
-                    else:
-                         st.error(f"Error: {res.text}")
-                except Exception as e:
-                    st.error(f"Chat Error: {e}")
+                    bot_response = st.write_stream(stream_chat_reply(payload))
+                except ChatSessionExpired:
+                    # Session expired: re-seed it with the full context
+                    payload.update(seed)
+                    bot_response = st.write_stream(stream_chat_reply(payload))
+                st.session_state['chat_history'].append({"role": "assistant", "content": bot_response})
+            except Exception as e:
+                st.error(f"Chat Error: {e}")
@@ -0,0 +1,505 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import google.generativeai as genai
+import PIL.Image
+from google.api_core import exceptions as google_exceptions
+
+from src.core.config import settings
+from src.core.metrics import GEMINI_LATENCY, UPSTREAM_RETRIES, LLM_TIMEOUTS, LLM_HEDGES
+
+# Configure the SDK
+if settings.GOOGLE_API_KEY:
+    genai.configure(api_key=settings.GOOGLE_API_KEY)
+
+
+class CassetteMissError(RuntimeError):
+    """Replay mode got a request that was never recorded."""
+
+
+def _normalize_part(part: Any) -> Any:
+    """JSON-able, stable stand-in for one element of a generate_content request."""
+    if isinstance(part, str):
+        # Prompt indentation changes should not invalidate recordings
+        return re.sub(r"\s+", " ", part).strip()
+    if isinstance(part, dict) and "data" in part:
+        return {"mime_type": part.get("mime_type"), "sha256": hashlib.sha256(part["data"]).hexdigest()}
+    if isinstance(part, PIL.Image.Image):
+        return {"image": [part.mode, *part.size], "sha256": hashlib.sha256(part.tobytes()).hexdigest()}
+    return repr(part)
+
+
+def fingerprint(model_name: str, contents: Any, generation_config: Optional[dict] = None) -> str:
+    """Hash identifying a request: model, generation config and normalized contents (images by hash)."""
+    parts = contents if isinstance(contents, list) else [contents]
+    payload = {
+        "model": model_name,
+        "config": generation_config or {},
+        "contents": [_normalize_part(p) for p in parts],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMBackend:
+    """
+    How the app talks to Gemini. All calls go through `generate`, `generate_async`
+    or `stream_async`, which return plain text, so live calls can be recorded and
+    replayed. `operation` labels the latency metric.
+    """
+
+    def generate(self, model_name: str, contents: Any, operation: str,
+                 generation_config: Optional[dict] = None) -> str:
+        raise NotImplementedError
+
+    async def generate_async(self, model_name: str, contents: Any, operation: str,
+                             generation_config: Optional[dict] = None) -> str:
+        raise NotImplementedError
+
+    def stream_async(self, model_name: str, contents: Any, operation: str,
+                     generation_config: Optional[dict] = None) -> AsyncIterator[str]:
+        """Yields the response in text chunks. Latency is observed until the first chunk."""
+        raise NotImplementedError
+
+
+class LiveBackend(LLMBackend):
+    """The Gemini SDK, as before."""
+
+    def __init__(self):
+        self._models: Dict[str, genai.GenerativeModel] = {}
+
+    def _model(self, model_name: str) -> genai.GenerativeModel:
+        # Models are stateless; one per name is shared by all requests
+        if model_name not in self._models:
+            self._models[model_name] = genai.GenerativeModel(model_name)
+        return self._models[model_name]
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            response = self._model(model_name).generate_content(contents, generation_config=generation_config)
+        return response.text
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            response = await self._model(model_name).generate_content_async(
+                contents, generation_config=generation_config
+            )
+        return response.text
+
+    async def stream_async(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            response = await self._model(model_name).generate_content_async(
+                contents, generation_config=generation_config, stream=True
+            )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. only finish/safety metadata)
+                continue
+            if text:
+                yield text
+
+
+class Cassette:
+    """
+    Directory of recorded calls, one JSON file per request fingerprint:
+    {"model", "operation", "text", "chunks" (streams only), "latency"}.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def load(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, key: str, entry: dict):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+class RecordingBackend(LLMBackend):
+    """Calls the live backend and saves every response, with its latency, to the cassette."""
+
+    def __init__(self, cassette: Cassette, live: Optional[LLMBackend] = None):
+        self.cassette = cassette
+        self.live = live or LiveBackend()
+
+    def _save(self, model_name, contents, operation, generation_config, text, latency, chunks=None):
+        entry = {"model": model_name, "operation": operation, "text": text, "latency": round(latency, 4)}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        self.cassette.save(fingerprint(model_name, contents, generation_config), entry)
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        start = time.perf_counter()
+        text = self.live.generate(model_name, contents, operation, generation_config)
+        self._save(model_name, contents, operation, generation_config, text, time.perf_counter() - start)
+        return text
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        start = time.perf_counter()
+        text = await self.live.generate_async(model_name, contents, operation, generation_config)
+        self._save(model_name, contents, operation, generation_config, text, time.perf_counter() - start)
+        return text
+
+    async def stream_async(self, model_name, contents, operation, generation_config=None):
+        start = time.perf_counter()
+        first_chunk_latency = None
+        chunks: List[str] = []
+        async for text in self.live.stream_async(model_name, contents, operation, generation_config):
+            if first_chunk_latency is None:
+                first_chunk_latency = time.perf_counter() - start
+            chunks.append(text)
+            yield text
+        # Only complete streams are recorded
+        self._save(model_name, contents, operation, generation_config, "".join(chunks),
+                   first_chunk_latency or time.perf_counter() - start, chunks)
+
+
+class LatencyModel:
+    """
+    Simulated latency for replayed calls, from a spec string:
+
+        none              no delay
+        recorded          the latency measured when the call was recorded
+        fixed:0.8         always 0.8s
+        uniform:0.5,1.5   uniform between 0.5s and 1.5s
+        normal:1.2,0.3    normal(mean, stddev), clipped at 0
+        lognormal:0,0.5   lognormal(mu, sigma) of the underlying normal
+    """
+
+    def __init__(self, spec: str = "none", seed: Optional[int] = None):
+        name, _, args = (spec or "none").partition(":")
+        self.kind = name.strip().lower()
+        self.args = [float(a) for a in args.split(",") if a.strip()]
+        expected_args = {"none": 0, "recorded": 0, "fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if expected_args.get(self.kind) != len(self.args):
+            raise ValueError(f"Invalid replay latency spec: {spec!r}")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, recorded: float) -> float:
+        with self._lock:
+            if self.kind == "recorded":
+                return recorded
+            if self.kind == "fixed":
+                return self.args[0]
+            if self.kind == "uniform":
+                return self._random.uniform(*self.args)
+            if self.kind == "normal":
+                return max(0.0, self._random.gauss(*self.args))
+            if self.kind == "lognormal":
+                return self._random.lognormvariate(*self.args)
+            return 0.0
+
+
+class ReplayBackend(LLMBackend):
+    """Serves recorded responses without network access, optionally with simulated latency."""
+
+    def __init__(self, cassette: Cassette, latency: Optional[LatencyModel] = None):
+        self.cassette = cassette
+        self.latency = latency or LatencyModel()
+
+    def _lookup(self, model_name, contents, operation, generation_config) -> dict:
+        key = fingerprint(model_name, contents, generation_config)
+        entry = self.cassette.load(key)
+        if entry is None:
+            raise CassetteMissError(
+                f"No recording for {operation} on {model_name} ({key[:12]}) in {self.cassette.directory}"
+            )
+        return entry
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            entry = self._lookup(model_name, contents, operation, generation_config)
+            time.sleep(self.latency.sample(entry.get("latency", 0.0)))
+        return entry["text"]
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            entry = self._lookup(model_name, contents, operation, generation_config)
+            await asyncio.sleep(self.latency.sample(entry.get("latency", 0.0)))
+        return entry["text"]
+
+    async def stream_async(self, model_name, contents, operation, generation_config=None):
+        with GEMINI_LATENCY.labels(model=model_name, operation=operation).time():
+            entry = self._lookup(model_name, contents, operation, generation_config)
+            await asyncio.sleep(self.latency.sample(entry.get("latency", 0.0)))
+        for text in entry.get("chunks") or [entry["text"]]:
+            yield text
+
+
+# Transient upstream failures worth another attempt
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+@dataclass(frozen=True)
+class CallPolicy:
+    """Timeout/retry/hedging settings for the calls to one model."""
+    timeout: float = settings.LLM_TIMEOUT
+    max_retries: int = settings.LLM_MAX_RETRIES
+    backoff_base: float = settings.LLM_BACKOFF_BASE
+    backoff_max: float = settings.LLM_BACKOFF_MAX
+    hedge: bool = settings.LLM_HEDGE_ENABLED
+    # Fixed hedge delay in seconds; None = the observed p95 of the operation
+    hedge_after: Optional[float] = settings.LLM_HEDGE_AFTER
+    # Successful calls needed before the observed p95 is trusted
+    hedge_min_samples: int = 20
+
+    @classmethod
+    def per_model(cls, overrides_json: str = settings.LLM_MODEL_POLICIES) -> Dict[str, "CallPolicy"]:
+        overrides = json.loads(overrides_json or "{}")
+        known = {f.name for f in fields(cls)}
+        policies = {}
+        for model_name, values in overrides.items():
+            unknown = set(values) - known
+            if unknown:
+                raise ValueError(f"Unknown LLM policy fields for {model_name}: {sorted(unknown)}")
+            policies[model_name] = replace(cls(), **values)
+        return policies
+
+    def backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform in [0, capped exponential]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Recent successful call latencies per (model, operation), for the hedge threshold."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Dict[tuple, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def observe(self, key: tuple, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, key: tuple, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Wraps another backend with a per-attempt timeout, jittered exponential retries
+    of transient errors and, for async calls, request hedging: if the first attempt
+    has not answered by the hedge delay a duplicate is sent and the first answer wins.
+    Streams are retried only until their first chunk and are not hedged.
+
+    A sync attempt runs on a thread of its own so it can be timed out. Python cannot
+    stop a thread, so a timed-out attempt keeps running (and holding its thread)
+    until the underlying call returns; giving each attempt a fresh thread instead
+    of a shared pool means hung attempts never delay the ones after them.
+    """
+
+    def __init__(self, inner: LLMBackend, default_policy: Optional[CallPolicy] = None,
+                 policies: Optional[Dict[str, CallPolicy]] = None):
+        self.inner = inner
+        self.default_policy = default_policy or CallPolicy()
+        self.policies = policies if policies is not None else CallPolicy.per_model()
+        self.latencies = LatencyTracker()
+
+    def policy(self, model_name: str) -> CallPolicy:
+        return self.policies.get(model_name, self.default_policy)
+
+    def _hedge_delay(self, policy: CallPolicy, key: tuple) -> Optional[float]:
+        if not policy.hedge:
+            return None
+        if policy.hedge_after is not None:
+            return policy.hedge_after
+        return self.latencies.percentile(key, 0.95, policy.hedge_min_samples)
+
+    def _should_retry(self, error: Exception, attempt: int, policy: CallPolicy, model_name: str) -> bool:
+        if attempt >= policy.max_retries or not isinstance(error, RETRYABLE_ERRORS):
+            return False
+        UPSTREAM_RETRIES.labels(upstream=f"gemini:{model_name}").inc()
+        print(f"Gemini call to {model_name} failed ({type(error).__name__}: {error}), retrying")
+        return True
+
+    # --- Sync ---
+
+    def _attempt(self, call: Callable[[], str], policy: CallPolicy, model_name: str) -> str:
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(call())
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="llm-call", daemon=True).start()
+        try:
+            return future.result(timeout=policy.timeout)
+        except concurrent.futures.TimeoutError:
+            # The thread finishes on its own; its result is dropped
+            LLM_TIMEOUTS.labels(model=model_name).inc()
+            raise TimeoutError(f"Gemini call to {model_name} timed out after {policy.timeout}s")
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        policy = self.policy(model_name)
+        call = lambda: self.inner.generate(model_name, contents, operation, generation_config)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                text = self._attempt(call, policy, model_name)
+            except Exception as e:
+                if not self._should_retry(e, attempt, policy, model_name):
+                    raise
+                time.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+            self.latencies.observe((model_name, operation), time.perf_counter() - start)
+            return text
+
+    # --- Async ---
+
+    async def _attempt_async(self, call: Callable[[], Any], policy: CallPolicy,
+                             model_name: str, hedge_delay: Optional[float]) -> str:
+        async def timed(coro):
+            try:
+                return await asyncio.wait_for(coro, timeout=policy.timeout)
+            except asyncio.TimeoutError:
+                LLM_TIMEOUTS.labels(model=model_name).inc()
+                raise TimeoutError(f"Gemini call to {model_name} timed out after {policy.timeout}s")
+
+        primary = asyncio.ensure_future(timed(call()))
+        if hedge_delay is None or hedge_delay >= policy.timeout:
+            return await primary
+
+        pending = {primary}
+        try:
+            # Also covers the caller being cancelled while waiting: nothing is left running
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            LLM_HEDGES.labels(model=model_name, outcome="fired").inc()
+            hedge = asyncio.ensure_future(timed(call()))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        outcome = "primary_won" if task is primary else "hedge_won"
+                        LLM_HEDGES.labels(model=model_name, outcome=outcome).inc()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        policy = self.policy(model_name)
+        key = (model_name, operation)
+        call = lambda: self.inner.generate_async(model_name, contents, operation, generation_config)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                text = await self._attempt_async(call, policy, model_name, self._hedge_delay(policy, key))
+            except Exception as e:
+                if not self._should_retry(e, attempt, policy, model_name):
+                    raise
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+            self.latencies.observe(key, time.perf_counter() - start)
+            return text
+
+    async def stream_async(self, model_name, contents, operation, generation_config=None):
+        policy = self.policy(model_name)
+        attempt = 0
+        while True:
+            stream = self.inner.stream_async(model_name, contents, operation, generation_config)
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), timeout=policy.timeout)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await stream.aclose()
+                if isinstance(e, asyncio.TimeoutError):
+                    LLM_TIMEOUTS.labels(model=model_name).inc()
+                    e = TimeoutError(f"Gemini stream from {model_name} timed out after {policy.timeout}s")
+                if not self._should_retry(e, attempt, policy, model_name):
+                    raise e
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+            break
+        # Chunks already went out to the client: no retries from here on
+        yield first
+        async for text in stream:
+            yield text
+
+
+def create_llm_backend(mode: str = settings.LLM_BACKEND_MODE) -> LLMBackend:
+    """
+    Backend for LLM_BACKEND_MODE: "live" (default), "record" or "replay", wrapped
+    with the timeout/retry/hedging policies (also in replay, so their effect can be
+    measured against simulated latency).
+    """
+    mode = mode.lower()
+    if mode == "live":
+        backend = LiveBackend()
+    elif mode == "record":
+        backend = RecordingBackend(Cassette(settings.LLM_CASSETTE_DIR))
+    elif mode == "replay":
+        backend = ReplayBackend(
+            Cassette(settings.LLM_CASSETTE_DIR),
+            LatencyModel(settings.LLM_REPLAY_LATENCY, settings.LLM_REPLAY_SEED)
+        )
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND_MODE: {mode!r} (expected live, record or replay)")
+    return ResilientBackend(backend)
+
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+def get_llm_backend() -> LLMBackend:
+    """The process-wide backend shared by GeminiClient, the pipeline and chat."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_llm_backend()
+    return _backend
@@ -1,44 +1,19 @@
-import google.generativeai as genai
-
 import json
 from pathlib import Path
-from src.core.config import settings
+from typing import Optional
+from src.llm.backends import LLMBackend, get_llm_backend
 from src.models.schemas import PlantImageAnalysis
 import PIL.Image
 
-# Configure the SDK
-if settings.GOOGLE_API_KEY:
-    genai.configure(api_key=settings.GOOGLE_API_KEY)
-
 class GeminiClient:
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
-        self.model = genai.GenerativeModel(
-            model_name=model_name,
-            generation_config={"response_mime_type": "application/json", "temperature": 0.0}
-        )
+    # All calls of this client ask for deterministic JSON
+    GENERATION_CONFIG = {"response_mime_type": "application/json", "temperature": 0.0}
 
-    def analyze_image(self, image_input) -> PlantImageAnalysis:
-        """
-        Analyzes an image using Gemini Vision capabilities and returns structured data.
-        image_input: Can be a file path (str) or a PIL.Image object.
-        """
-        if isinstance(image_input, str):
-            path = Path(image_input)
-            if not path.exists():
-                raise FileNotFoundError(f"Image not found at {image_input}")
-            img = PIL.Image.open(path)
-        else:
-            # Assume it's a PIL Image
-            img = image_input
+    def __init__(self, model_name: str = "gemini-2.5-flash", backend: Optional[LLMBackend] = None):
+        self.model_name = model_name
+        self.backend = backend or get_llm_backend()
 
-        # Upload the file to Gemini
-        # Note: For production, we might want to handle file cleanup or use inline data if small.
-        # For this phase, we'll try uploading or using the PIL image approach if supported by the updated SDK.
-        # But 'upload_file' is the standard way for the File API.
-        
-        try:
-            
-            prompt = """
+    ANALYSIS_PROMPT = """
             Analyze this plant image. Identify the plant type, "visual_symptoms" (list of strings), 
             provide a "confidence" score (0.0-1.0), and a "description".
             
@@ -65,20 +40,84 @@ class GeminiClient:
             }
             """
 
-            response = self.model.generate_content(
-                [img, prompt],
-                generation_config={"response_mime_type": "application/json", "temperature": 0.0}
+    def _load_image(self, image_input, mime_type: str = "image/jpeg"):
+        """
+        image_input: Can be raw encoded bytes, a file path (str) or a PIL.Image object.
+        Bytes are sent inline as-is, without decoding or re-encoding.
+        """
+        if isinstance(image_input, (bytes, bytearray, memoryview)):
+            return {"mime_type": mime_type, "data": bytes(image_input)}
+        if isinstance(image_input, str):
+            path = Path(image_input)
+            if not path.exists():
+                raise FileNotFoundError(f"Image not found at {image_input}")
+            return PIL.Image.open(path)
+        # Assume it's a PIL Image
+        return image_input
+
+    def _parse_analysis(self, response_text: str) -> PlantImageAnalysis:
+        # Parse the JSON response
+        cleaned_text = self._clean_json_response(response_text)
+        response_json = json.loads(cleaned_text)
+        return PlantImageAnalysis(**response_json)
+
+    def analyze_image(self, image_input, mime_type: str = "image/jpeg") -> PlantImageAnalysis:
+        """
+        Analyzes an image using Gemini Vision capabilities and returns structured data.
+        image_input: Can be encoded bytes (with mime_type), a file path (str) or a PIL.Image object.
+        """
+        img = self._load_image(image_input, mime_type)
+
+        # Note: For production, we might want to use the File API ('upload_file') for large images.
+        # For this phase, we pass the image inline.
+        try:
+            text = self.backend.generate(
+                self.model_name, [img, self.ANALYSIS_PROMPT], "analyze_image", self.GENERATION_CONFIG
             )
-            
-            # Parse the JSON response
-            cleaned_text = self._clean_json_response(response.text)
-            response_json = json.loads(cleaned_text)
-            return PlantImageAnalysis(**response_json)
+            return self._parse_analysis(text)
             
         except Exception as e:
             # Wrap errors or log them
             raise RuntimeError(f"Gemini analysis failed: {e}")
 
+    async def analyze_image_async(self, image_input, mime_type: str = "image/jpeg") -> PlantImageAnalysis:
+        """Non-blocking variant of analyze_image using the SDK's async generation."""
+        img = self._load_image(image_input, mime_type)
+
+        try:
+            text = await self.backend.generate_async(
+                self.model_name, [img, self.ANALYSIS_PROMPT], "analyze_image", self.GENERATION_CONFIG
+            )
+            return self._parse_analysis(text)
+
+        except Exception as e:
+            raise RuntimeError(f"Gemini analysis failed: {e}")
+
+    def diagnose_image(self, image_input, instructions: str, mime_type: str = "image/jpeg") -> dict:
+        """
+        Single multimodal call: the image plus caller-built instructions (context and
+        output schema) in, the parsed JSON object out. Used by the lite diagnosis mode.
+        """
+        img = self._load_image(image_input, mime_type)
+        try:
+            text = self.backend.generate(
+                self.model_name, [img, instructions], "lite_diagnosis", self.GENERATION_CONFIG
+            )
+            return json.loads(self._clean_json_response(text))
+        except Exception as e:
+            raise RuntimeError(f"Gemini lite diagnosis failed: {e}")
+
+    async def diagnose_image_async(self, image_input, instructions: str, mime_type: str = "image/jpeg") -> dict:
+        """Non-blocking variant of diagnose_image."""
+        img = self._load_image(image_input, mime_type)
+        try:
+            text = await self.backend.generate_async(
+                self.model_name, [img, instructions], "lite_diagnosis", self.GENERATION_CONFIG
+            )
+            return json.loads(self._clean_json_response(text))
+        except Exception as e:
+            raise RuntimeError(f"Gemini lite diagnosis failed: {e}")
+
     def _clean_json_response(self, text: str) -> str:
         """Removes markdown code blocks if present."""
         text = text.strip()
@@ -116,8 +155,8 @@ class GeminiClient:
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            cleaned_text = self._clean_json_response(response.text)
+            text = self.backend.generate(self.model_name, prompt, "evaluate_prediction", self.GENERATION_CONFIG)
+            cleaned_text = self._clean_json_response(text)
             result = json.loads(cleaned_text)
             return result.get("is_correct", False)
         except Exception as e:
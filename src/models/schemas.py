@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class DetectedObject(BaseModel):
     name: str
@@ -36,6 +36,14 @@ class DiagnosisRequest(BaseModel):
     location: Optional[str] = "London,UK" # Default logic location
 
 
+class PipelineTimings(BaseModel):
+    """Where the time of a pipeline run went."""
+    nodes: Dict[str, float] = Field(..., description="Seconds spent in each graph node")
+    critical_path: List[str] = Field(..., description="Slowest chain of dependent nodes")
+    critical_path_seconds: float = Field(..., description="Sum of the node times along the critical path")
+    serial_seconds: float = Field(..., description="Sum of all node times, i.e. the cost of running them one by one")
+    wall_seconds: float = Field(..., description="First node start to last node end")
+
 class DiagnosisReport(BaseModel):
     """Final output to the user."""
     analysis: PlantImageAnalysis
@@ -44,6 +52,26 @@ class DiagnosisReport(BaseModel):
     user_query_answer: Optional[str] = Field(None, description="Direct answer to the user's specific question")
     relevant_knowledge: List[str] = Field(..., description="Snippets from RAG used for reasoning")
     weather_context: Optional[WeatherData] = None
+    diagnosis_id: Optional[str] = Field(None, description="Id of the server-side chat session for this diagnosis")
+    timings: Optional[PipelineTimings] = Field(None, description="Node timings of the run that produced this report (not set on cache hits or in batch results)")
+
+class BatchDiagnosisItem(BaseModel):
+    """Result for a single image of a batch diagnosis."""
+    filename: str
+    report: Optional[DiagnosisReport] = None
+    error: Optional[str] = None
+
+class BatchDiagnosisResponse(BaseModel):
+    results: List[BatchDiagnosisItem]
+
+class JobStatus(BaseModel):
+    """State of an asynchronous diagnosis job (POST /jobs)."""
+    job_id: str
+    status: str # "queued", "running", "completed" or "failed"
+    created_at: float
+    updated_at: float
+    result: Optional[DiagnosisReport] = None
+    error: Optional[str] = None
 
 class ChatMessage(BaseModel):
     role: str # "user" or "assistant"
@@ -51,8 +79,12 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
-    context: dict # The previous DiagnosisReport
-    history: List[ChatMessage]
+    # Preferred: the server-side session of a diagnosis; only the new message is sent
+    diagnosis_id: Optional[str] = None
+    # Legacy/fallback: the full DiagnosisReport and previous messages
+    context: Optional[dict] = None
+    history: List[ChatMessage] = []
 
 class ChatResponse(BaseModel):
     response: str
+    diagnosis_id: Optional[str] = None
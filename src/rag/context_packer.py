@@ -0,0 +1,110 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Set
+
+from src.core.config import settings
+from src.core.text import content_terms, estimate_tokens
+from src.models.schemas import KnowledgeChunk
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+@dataclass
+class PackedChunk:
+    chunk: KnowledgeChunk
+    text: str # the selected sentences, in their original order
+
+
+@dataclass
+class PackedContext:
+    chunks: List[PackedChunk] = field(default_factory=list)
+    tokens: int = 0 # estimated tokens of the packed snippets
+    raw_tokens: int = 0 # estimated tokens of the retrieved chunks as they came in
+
+    def render(self) -> str:
+        return "\n".join(f"- {p.text} (Source: {p.chunk.source})" for p in self.chunks)
+
+
+class ContextPacker:
+    """
+    Fits retrieved knowledge chunks into a fixed token budget for the diagnosis prompt.
+
+    Chunks are taken in retrieval order. Duplicates and chunks that mostly repeat an
+    earlier one (overlapping ingestion windows, the same passage in two PDFs) are
+    dropped, and each remaining chunk is cut down to the sentences sharing the most
+    terms with the query. Every chunk keeps at least its best sentence.
+    """
+
+    # Chunks sharing this fraction of their terms with an earlier chunk are dropped
+    DUPLICATE_OVERLAP = 0.8
+
+    def __init__(self, token_budget: int = settings.CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+    def deduplicate(self, chunks: List[KnowledgeChunk]) -> List[KnowledgeChunk]:
+        kept, kept_terms = [], []
+        for chunk in chunks:
+            terms = set(content_terms(chunk.content))
+            if any(self._overlap(terms, other) >= self.DUPLICATE_OVERLAP for other in kept_terms):
+                continue
+            kept.append(chunk)
+            kept_terms.append(terms)
+        return kept
+
+    @staticmethod
+    def _overlap(a: Set[str], b: Set[str]) -> float:
+        # Share of the smaller chunk's terms found in the other: catches containment too
+        if not a or not b:
+            return float(a == b)
+        return len(a & b) / min(len(a), len(b))
+
+    def pack(self, chunks: List[KnowledgeChunk], query: str) -> PackedContext:
+        packed = PackedContext(raw_tokens=sum(estimate_tokens(c.content) for c in chunks))
+        chunks = self.deduplicate(chunks)
+        query_terms = set(content_terms(query))
+
+        for position, chunk in enumerate(chunks):
+            remaining = self.token_budget - packed.tokens
+            if remaining <= 0:
+                break
+            # Even share of what is left; unused tokens roll over to later chunks
+            share = remaining // (len(chunks) - position)
+            text = self._select_sentences(chunk.content, query_terms, max(share, 1))
+            packed.chunks.append(PackedChunk(chunk=chunk, text=text))
+            packed.tokens += estimate_tokens(text)
+        return packed
+
+    def _select_sentences(self, content: str, query_terms: Set[str], budget: int) -> str:
+        sentences = self.split_sentences(content)
+        if not sentences:
+            return ""
+
+        def score(sentence: str) -> float:
+            terms = content_terms(sentence)
+            if not terms:
+                return 0.0
+            hits = sum(1 for t in terms if t in query_terms)
+            # Favour dense matches over long sentences that mention a term once
+            return hits / len(terms) ** 0.5
+
+        ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]), reverse=True)
+        chosen, used = [], 0
+        for i in ranked:
+            cost = estimate_tokens(sentences[i])
+            if chosen and used + cost > budget:
+                continue
+            chosen.append(i)
+            used += cost
+            if used >= budget:
+                break
+
+        text = " ".join(sentences[i] for i in sorted(chosen))
+        max_chars = budget * 4 # estimate_tokens' ratio
+        if len(text) > max_chars:
+            # A single best sentence longer than the share
+            text = text[:max_chars].rsplit(" ", 1)[0] + "..."
+        return text
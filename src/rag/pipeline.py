@@ -1,42 +1,188 @@
-from typing import TypedDict, List, Optional
-from langgraph.graph import StateGraph, END
+from typing import Annotated, Dict, TypedDict, List, Optional, Tuple
+import functools
+import time
+from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 import json
-import google.generativeai as genai
+import asyncio
 
-from src.models.schemas import PlantImageAnalysis, DiagnosisReport, KnowledgeChunk, WeatherData
+from src.models.schemas import PlantImageAnalysis, DiagnosisReport, KnowledgeChunk, WeatherData, PipelineTimings
 from src.llm.gemini_client import GeminiClient
+from src.llm.backends import get_llm_backend
 from src.vector_store.chroma_store import BotanicalKnowledgeBase
+from src.vector_store.fusion import reciprocal_rank_fusion
+from src.rag.context_packer import ContextPacker, PackedContext
 from src.services.weather import WeatherService
+from src.core.config import settings
+from src.core.metrics import NODE_LATENCY, ERRORS, SPECULATIVE_RETRIEVALS, CONTEXT_TOKENS
+from src.core.text import content_terms
+
+def _merge_timings(left: Optional[dict], right: Optional[dict]) -> dict:
+    # Parallel branches report their timings in the same step
+    return {**(left or {}), **(right or {})}
 
 # Define the state
 class DiagnosisState(TypedDict):
-    image_path: str
+    # The API hands the enhanced image over in memory (image_bytes + image_mime);
+    # image_path is used by scripts that diagnose files on disk.
+    image_path: Optional[str]
+    image_bytes: Optional[bytes]
+    image_mime: Optional[str]
     user_query: str
     location: str
     # plant_name/id removed
     analysis: PlantImageAnalysis
     retrieved_context: List[KnowledgeChunk]
+    # Retrieved from the user's question while the image is analyzed (None = not run yet)
+    speculative_context: Optional[List[KnowledgeChunk]]
     weather: Optional[WeatherData]
+    # True once the weather lookup ran; `weather` stays None if it failed or no API key is set
+    weather_fetched: bool
     # history_summary removed
     final_report: DiagnosisReport
+    # Estimated tokens of knowledge that went into the diagnosis prompt
+    packed_context_tokens: int
+    # node -> (start, end) in time.perf_counter() seconds, filled in by _timed_node
+    node_timings: Annotated[Dict[str, Tuple[float, float]], _merge_timings]
+
+def _timed_node(name: str, fn):
+    """
+    Records latency and errors of a graph node (sync or async) under `name`,
+    and adds the node's (start, end) to `node_timings` in the state.
+    """
+    def observe(start: float, failed: bool):
+        end = time.perf_counter()
+        NODE_LATENCY.labels(node=name).observe(end - start)
+        if failed:
+            ERRORS.labels(stage=name).inc()
+        return end
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(state):
+            start = time.perf_counter()
+            try:
+                result = await fn(state)
+            except Exception:
+                observe(start, True)
+                raise
+            end = observe(start, False)
+            return {**(result or {}), "node_timings": {name: (start, end)}}
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        start = time.perf_counter()
+        try:
+            result = fn(state)
+        except Exception:
+            observe(start, True)
+            raise
+        end = observe(start, False)
+        return {**(result or {}), "node_timings": {name: (start, end)}}
+    return wrapper
+
+def summarize_timings(node_timings: Dict[str, Tuple[float, float]],
+                      dependencies: Dict[str, List[str]]) -> Optional[PipelineTimings]:
+    """
+    Turns the raw node timings of a run into per-node durations plus the critical
+    path through the graph (`dependencies` maps each node to the nodes it waits for).
+    """
+    if not node_timings:
+        return None
+    durations = {node: end - start for node, (start, end) in node_timings.items()}
+
+    # Longest chain of dependent nodes; `dependencies` is in topological order
+    path_cost: Dict[str, float] = {}
+    path: Dict[str, List[str]] = {}
+    for node, deps in dependencies.items():
+        if node not in durations:
+            continue
+        ran = [dep for dep in deps if dep in path_cost]
+        slowest = max(ran, key=path_cost.get) if ran else None
+        path_cost[node] = durations[node] + (path_cost[slowest] if slowest else 0.0)
+        path[node] = (path[slowest] if slowest else []) + [node]
+    last = max(path_cost, key=path_cost.get)
+
+    starts = [start for start, _ in node_timings.values()]
+    ends = [end for _, end in node_timings.values()]
+    return PipelineTimings(
+        nodes={node: round(seconds, 4) for node, seconds in durations.items()},
+        critical_path=path[last],
+        critical_path_seconds=round(path_cost[last], 4),
+        serial_seconds=round(sum(durations.values()), 4),
+        wall_seconds=round(max(ends) - min(starts), 4),
+    )
 
 class RAGPipeline:
-    def __init__(self):
+    RETRIEVAL_RESULTS = 5
+    REASONING_MODEL = "gemini-2.5-flash"
+    # A user question needs this many content words to be worth a speculative lookup
+    MIN_SPECULATIVE_TERMS = 2
+
+    # Graph shape: each node -> the nodes it waits for (in topological order).
+    # Weather and the speculative lookup from the user's question only need the
+    # request inputs, so they run alongside the vision call; the branches join
+    # at retrieval and before the diagnosis.
+    GRAPH_DEPENDENCIES = {
+        "analyze_image": [],
+        "fetch_context": [],
+        "prefetch_context": [],
+        "retrieve_context": ["analyze_image", "prefetch_context"],
+        "generate_diagnosis": ["retrieve_context", "fetch_context"],
+    }
+    # Lite mode: one multimodal call with weather and the knowledge prefetched from
+    # the user's question, instead of vision call -> retrieval -> reasoning call
+    LITE_GRAPH_DEPENDENCIES = {
+        "fetch_context": [],
+        "prefetch_context": [],
+        "lite_diagnosis": ["fetch_context", "prefetch_context"],
+    }
+    MODES = {"full": GRAPH_DEPENDENCIES, "lite": LITE_GRAPH_DEPENDENCIES}
+
+    def __init__(self, weather_service: Optional[WeatherService] = None):
         self.gemini = GeminiClient()
         self.kb = BotanicalKnowledgeBase()
-        self.weather_service = WeatherService()
-        self.reasoning_model = genai.GenerativeModel("gemini-2.5-flash") 
+        self.weather_service = weather_service or WeatherService()
+        self.llm = get_llm_backend()
+        self.context_packer = ContextPacker()
+        self.lite_context_packer = ContextPacker(token_budget=settings.LITE_CONTEXT_TOKEN_BUDGET)
+
+    def warm_up(self):
+        """Pages in the embedding model and vector index before serving traffic."""
+        self.kb.warm_up()
+
+    # Nodes skip work whose output is already present in the state, so callers
+    # (e.g. the batch endpoint) can pre-fill shared results before invoking the graph.
 
     def analyze_node(self, state: DiagnosisState):
         print("--- Node: Analyze Image ---")
+        if state.get('analysis') is not None:
+            return {}
         # [OPTIMIZATION] The image is sent to Gemini here ONCE. 
         # The result (analysis) is text. 
         # Subsequent nodes will ONLY use the text analysis, saving tokens.
-        analysis = self.gemini.analyze_image(state['image_path'])
+        analysis = self.gemini.analyze_image(*self._image_input(state))
         return {"analysis": analysis}
 
+    async def analyze_node_async(self, state: DiagnosisState):
+        print("--- Node: Analyze Image (async) ---")
+        if state.get('analysis') is not None:
+            return {}
+        analysis = await self.gemini.analyze_image_async(*self._image_input(state))
+        return {"analysis": analysis}
+
+    @staticmethod
+    def _image_input(state: DiagnosisState):
+        """(image, mime_type) for the vision call: in-memory bytes if present, else the file path."""
+        if state.get('image_bytes'):
+            return state['image_bytes'], state.get('image_mime') or "image/jpeg"
+        return state['image_path'], "image/jpeg"
+
     def fetch_context_node(self, state: DiagnosisState):
         print("--- Node: Fetch Context (Weather Only) ---")
+        if state.get('weather') is not None or state.get('weather_fetched'):
+            return {}
         location = state.get('location', 'London,UK')
         
         # Fetch Weather
@@ -44,30 +190,118 @@ class RAGPipeline:
         
         # History Removed
             
-        return {"weather": weather}
+        return {"weather": weather, "weather_fetched": True}
+
+    async def fetch_context_node_async(self, state: DiagnosisState):
+        print("--- Node: Fetch Context (Weather Only, async) ---")
+        if state.get('weather') is not None or state.get('weather_fetched'):
+            return {}
+        location = state.get('location', 'London,UK')
+        weather = await self.weather_service.get_current_weather_async(location)
+        return {"weather": weather, "weather_fetched": True}
+
+    def prefetch_node(self, state: DiagnosisState):
+        print("--- Node: Prefetch Knowledge (User Query) ---")
+        if state.get('speculative_context') is not None or state.get('retrieved_context'):
+            return {}
+        query = self.speculative_query(state.get('user_query'))
+        if query is None:
+            return {"speculative_context": []}
+        return {"speculative_context": self.kb.query(
+            query, self.RETRIEVAL_RESULTS, settings.SPECULATIVE_RETRIEVAL_MODE
+        )}
+
+    async def prefetch_node_async(self, state: DiagnosisState):
+        print("--- Node: Prefetch Knowledge (User Query, async) ---")
+        if state.get('speculative_context') is not None or state.get('retrieved_context'):
+            return {}
+        query = self.speculative_query(state.get('user_query'))
+        if query is None:
+            return {"speculative_context": []}
+        return {"speculative_context": await self.kb.query_async(
+            query, self.RETRIEVAL_RESULTS, settings.SPECULATIVE_RETRIEVAL_MODE
+        )}
+
+    @classmethod
+    def speculative_query(cls, user_query: Optional[str]) -> Optional[str]:
+        """The user's question as a KB query, or None if it has too few content words to help."""
+        if len(set(content_terms(user_query))) < cls.MIN_SPECULATIVE_TERMS:
+            SPECULATIVE_RETRIEVALS.labels(outcome="skipped").inc()
+            return None
+        return user_query.strip()
 
     def retrieve_node(self, state: DiagnosisState):
         print("--- Node: Retrieve Knowledge ---")
-        analysis: PlantImageAnalysis = state['analysis']
-        query = f"{analysis.plant_type} with {', '.join(sorted(analysis.visual_symptoms))}"
+        if state.get('retrieved_context'):
+            return {}
+        query = self.retrieval_query(state['analysis'])
         # Optimized: Fetch 5 candidates to allow comparison between multiple sources
-        context = self.kb.query(query, n_results=5)
-        return {"retrieved_context": context}
+        context = self.kb.query(query, self.RETRIEVAL_RESULTS, settings.RETRIEVAL_MODE)
+        return {"retrieved_context": self.merge_context(context, state.get('speculative_context'))}
+
+    async def retrieve_node_async(self, state: DiagnosisState):
+        print("--- Node: Retrieve Knowledge (async) ---")
+        if state.get('retrieved_context'):
+            return {}
+        query = self.retrieval_query(state['analysis'])
+        context = await self.kb.query_async(query, self.RETRIEVAL_RESULTS, settings.RETRIEVAL_MODE)
+        return {"retrieved_context": self.merge_context(context, state.get('speculative_context'))}
+
+    def merge_context(self, symptom_context: List[KnowledgeChunk],
+                      speculative_context: Optional[List[KnowledgeChunk]]) -> List[KnowledgeChunk]:
+        """
+        Re-ranks symptom-based results together with the speculative ones from the
+        user's question (reciprocal rank fusion); symptom results win ties.
+        """
+        if not speculative_context:
+            return symptom_context
+        merged = reciprocal_rank_fusion([symptom_context, speculative_context], limit=self.RETRIEVAL_RESULTS)
+        symptom_ids = {chunk.id for chunk in symptom_context}
+        gained = any(chunk.id not in symptom_ids for chunk in merged)
+        SPECULATIVE_RETRIEVALS.labels(outcome="contributed" if gained else "no_gain").inc()
+        return merged
+
+    @staticmethod
+    def retrieval_query(analysis: PlantImageAnalysis) -> str:
+        """Deterministic knowledge-base query built from the vision analysis."""
+        return f"{analysis.plant_type} with {', '.join(sorted(analysis.visual_symptoms))}"
 
     def diagnose_node(self, state: DiagnosisState):
         print("--- Node: Diagnose ---")
-        analysis = state['analysis']
-        context = state['retrieved_context']
-        weather = state.get('weather')
-        user_query = state.get("user_query", "")
+        packed = self.pack_context(state)
+        text = self.llm.generate(
+            self.REASONING_MODEL, self._diagnosis_prompt(state, packed), "diagnose",
+            {"response_mime_type": "application/json", "temperature": 0.0}
+        )
+        return {**self._parse_diagnosis(state, text), "packed_context_tokens": packed.tokens}
 
-        context_text = "\n".join([f"- {c.content} (Source: {c.source})" for c in context])
-        
-        weather_text = "Not available"
-        if weather:
-            # [OPTIMIZATION] Passing only key metrics, not raw JSON
-            weather_text = f"{weather.temperature}°C, {weather.humidity}% hum, {weather.condition}"
+    async def diagnose_node_async(self, state: DiagnosisState):
+        print("--- Node: Diagnose (async) ---")
+        packed = self.pack_context(state)
+        text = await self.llm.generate_async(
+            self.REASONING_MODEL, self._diagnosis_prompt(state, packed), "diagnose",
+            {"response_mime_type": "application/json", "temperature": 0.0}
+        )
+        return {**self._parse_diagnosis(state, text), "packed_context_tokens": packed.tokens}
+
+    def pack_context(self, state: DiagnosisState) -> PackedContext:
+        """Retrieved chunks cut down to CONTEXT_TOKEN_BUDGET, favouring sentences about the symptoms."""
+        query = f"{self.retrieval_query(state['analysis'])} {state.get('user_query') or ''}"
+        packed = self.context_packer.pack(state.get('retrieved_context') or [], query)
+        CONTEXT_TOKENS.labels(stage="raw").observe(packed.raw_tokens)
+        CONTEXT_TOKENS.labels(stage="packed").observe(packed.tokens)
+        return packed
 
+    @staticmethod
+    def _weather_text(weather: Optional[WeatherData]) -> str:
+        if not weather:
+            return "Not available"
+        # [OPTIMIZATION] Passing only key metrics, not raw JSON
+        return f"{weather.temperature}°C, {weather.humidity}% hum, {weather.condition}"
+
+    @staticmethod
+    def _query_instructions(user_query: Optional[str]) -> Tuple[str, str]:
+        """(query section, instructions for "user_query_answer") of the diagnosis prompts."""
         if user_query and user_query.strip():
             query_section = f"User Query: {user_query}"
             query_instructions = f"""
@@ -83,6 +317,13 @@ class RAGPipeline:
         - Set "user_query_answer" to null.
         - Do NOT hallucinate a question.
             """
+        return query_section, query_instructions
+
+    def _diagnosis_prompt(self, state: DiagnosisState, packed: PackedContext) -> str:
+        analysis = state['analysis']
+        context_text = packed.render()
+        weather_text = self._weather_text(state.get('weather'))
+        query_section, query_instructions = self._query_instructions(state.get("user_query", ""))
 
         prompt = f"""
         Act as a master botanist.
@@ -106,7 +347,7 @@ class RAGPipeline:
         {query_instructions}
         
         INSTRUCTIONS FOR KNOWLEDGE BASE (Source Selection):
-        1. You have been provided with 5 candidate chunks from different sources.
+        1. You have been provided with {len(packed.chunks)} candidate chunks from different sources.
         2. COMPARE them. One source might be more accurate or relevant than another for this specific visual case.
         3. If sources conflict (e.g. Source A says 'Rust', Source B says 'Blight'), prioritize the source whose description BEST matches the "Patient Plant Analysis" symptoms.
         4. If a chunk is NOT relevant (discusses wrong plant/disease), IGNORE IT.
@@ -124,14 +365,96 @@ class RAGPipeline:
             "relevant_knowledge": ["str"]
         }}
         """
-        
-        response = self.reasoning_model.generate_content(
-            prompt, 
-            generation_config={"response_mime_type": "application/json", "temperature": 0.0}
-        )
-        
+        return prompt
+
+    # --- Lite mode ---
+
+    def lite_diagnose_node(self, state: DiagnosisState):
+        print("--- Node: Lite Diagnosis ---")
+        packed = self.pack_lite_context(state)
+        image, mime_type = self._image_input(state)
+        data = self.gemini.diagnose_image(image, self._lite_prompt(state, packed), mime_type)
+        return self._parse_lite_diagnosis(state, data, packed)
+
+    async def lite_diagnose_node_async(self, state: DiagnosisState):
+        print("--- Node: Lite Diagnosis (async) ---")
+        packed = self.pack_lite_context(state)
+        image, mime_type = self._image_input(state)
+        data = await self.gemini.diagnose_image_async(image, self._lite_prompt(state, packed), mime_type)
+        return self._parse_lite_diagnosis(state, data, packed)
+
+    def pack_lite_context(self, state: DiagnosisState) -> PackedContext:
+        # No vision analysis yet: the user's question is the only query
+        packed = self.lite_context_packer.pack(state.get('speculative_context') or [], state.get('user_query') or "")
+        CONTEXT_TOKENS.labels(stage="raw").observe(packed.raw_tokens)
+        CONTEXT_TOKENS.labels(stage="packed").observe(packed.tokens)
+        return packed
+
+    def _lite_prompt(self, state: DiagnosisState, packed: PackedContext) -> str:
+        weather_text = self._weather_text(state.get('weather'))
+        query_section, query_instructions = self._query_instructions(state.get("user_query", ""))
+        context_text = packed.render() or "None retrieved"
+
+        return f"""
+        Act as a master botanist. Analyze this plant image and diagnose it in one pass.
+
+        Context Awareness:
+        - Current Weather: {weather_text}
+
+        Relevant Knowledge Base (Candidates, may be incomplete or unrelated):
+        {context_text}
+
+        {query_section}
+
+        Task: Identify the plant type, the visual symptoms and the disease, then provide a diagnosis
+        and treatment plan. Explicitly reference the Weather if relevant to the diagnosis.
+        Estimate "severity_score" (1-10, where 10 is dead) and "affected_area" (e.g. "15%").
+        Return up to 10 "detected_objects" for localized symptoms, with "box_2d" as
+        [ymin, xmin, ymax, xmax] normalized to 1000.
+        Only use knowledge candidates that match the image; in "relevant_knowledge" append the
+        source to every item, e.g. "Fungal spots... (Source: guidelines.pdf)".
+
+        {query_instructions}
+
+        Return strictly JSON:
+        {{
+            "analysis": {{
+                "plant_type": "str",
+                "diagnosed_disease": "str",
+                "visual_symptoms": ["str"],
+                "confidence": float,
+                "severity_score": float,
+                "affected_area": "str",
+                "description": "str",
+                "detected_objects": [{{"name": "str", "box_2d": [int, int, int, int]}}]
+            }},
+            "diagnosis": "str",
+            "treatment_plan": ["str"],
+            "user_query_answer": "str or null",
+            "relevant_knowledge": ["str"]
+        }}
+        """
+
+    def _parse_lite_diagnosis(self, state: DiagnosisState, data: dict, packed: PackedContext):
+        weather = state.get('weather')
+        try:
+            if weather:
+                data['weather_context'] = weather.model_dump()
+            report = DiagnosisReport(**data)
+        except Exception as e:
+            raise ValueError(f"Lite diagnosis generation failed: {e}")
+        return {
+            "analysis": report.analysis,
+            "retrieved_context": [p.chunk for p in packed.chunks],
+            "final_report": report,
+            "packed_context_tokens": packed.tokens,
+        }
+
+    def _parse_diagnosis(self, state: DiagnosisState, response_text: str):
+        analysis = state['analysis']
+        weather = state.get('weather')
         try:
-            data = json.loads(response.text)
+            data = json.loads(response_text)
             data['analysis'] = analysis.model_dump() 
             # Inject weather context into report for frontend/user visibility
             if weather:
@@ -145,18 +468,38 @@ class RAGPipeline:
         except Exception as e:
              raise ValueError(f"Diagnosis generation failed: {e}")
 
-    def build_graph(self):
-        workflow = StateGraph(DiagnosisState)
+    def _node(self, name: str, sync_fn, async_fn) -> RunnableLambda:
+        # Each node has a sync and an async implementation: `ainvoke`/`astream` (the API)
+        # use the non-blocking versions, plain `invoke` (scripts) the sync ones.
+        return RunnableLambda(_timed_node(name, sync_fn), afunc=_timed_node(name, async_fn))
 
-        workflow.add_node("analyze_image", self.analyze_node)
-        workflow.add_node("fetch_context", self.fetch_context_node)
-        workflow.add_node("retrieve_context", self.retrieve_node)
-        workflow.add_node("generate_diagnosis", self.diagnose_node)
+    def build_graph(self, mode: str = "full"):
+        """Compiles the graph for `mode`: "full" (two-stage, default) or "lite" (single call)."""
+        nodes = {
+            "analyze_image": (self.analyze_node, self.analyze_node_async),
+            "fetch_context": (self.fetch_context_node, self.fetch_context_node_async),
+            "prefetch_context": (self.prefetch_node, self.prefetch_node_async),
+            "retrieve_context": (self.retrieve_node, self.retrieve_node_async),
+            "generate_diagnosis": (self.diagnose_node, self.diagnose_node_async),
+            "lite_diagnosis": (self.lite_diagnose_node, self.lite_diagnose_node_async),
+        }
+        dependencies = self.MODES[mode]
+        workflow = StateGraph(DiagnosisState)
 
-        workflow.set_entry_point("analyze_image")
-        workflow.add_edge("analyze_image", "fetch_context")
-        workflow.add_edge("fetch_context", "retrieve_context")
-        workflow.add_edge("retrieve_context", "generate_diagnosis")
-        workflow.add_edge("generate_diagnosis", END)
+        for node, deps in dependencies.items():
+            workflow.add_node(node, self._node(node, *nodes[node]))
+            if not deps:
+                workflow.add_edge(START, node)
+            elif len(deps) == 1:
+                workflow.add_edge(deps[0], node)
+            else:
+                # Join: runs once all branches have finished
+                workflow.add_edge(deps, node)
+        # The last node in topological order produces the report
+        workflow.add_edge(list(dependencies)[-1], END)
 
         return workflow.compile()
+
+    def timings(self, state: DiagnosisState, mode: str = "full") -> Optional[PipelineTimings]:
+        """Timing summary of a finished run of this pipeline's `mode` graph."""
+        return summarize_timings(state.get("node_timings") or {}, self.MODES[mode])
@@ -0,0 +1,93 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from src.core.config import settings
+from src.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+
+class OverloadedError(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    In-process concurrency limiter with a bounded wait queue.
+
+    At most `max_concurrent` requests run the pipeline at once; up to `max_queue`
+    more wait for a slot for at most `queue_timeout` seconds. Anything beyond that
+    is rejected immediately, so overload shows up as fast 503s instead of every
+    request slowing down together.
+    """
+
+    # Weight of the latest request in the moving average of service time
+    EWMA_ALPHA = 0.2
+
+    def __init__(self,
+                 max_concurrent: int = settings.ADMISSION_MAX_CONCURRENT,
+                 max_queue: int = settings.ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = settings.ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._avg_service_time = 10.0 # seconds; refined as requests complete
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def retry_after(self) -> int:
+        """Rough time until a slot frees up for a request arriving now."""
+        backlog = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(self._avg_service_time * backlog))
+
+    def _reject(self, reason: str):
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        raise OverloadedError(reason, self.retry_after())
+
+    def ensure_capacity(self):
+        """Fails fast if a new request would not even fit in the wait queue."""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self._reject("queue_full")
+
+    @asynccontextmanager
+    async def admit(self):
+        self.ensure_capacity()
+
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.set(self.waiting)
+        wait_start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.set(self.waiting)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - wait_start)
+
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._avg_service_time += self.EWMA_ALPHA * (elapsed - self._avg_service_time)
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_service_seconds": round(self._avg_service_time, 3),
+        }
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, List, Optional, Union
+
+from src.core.config import settings
+from src.core.text import estimate_tokens
+from src.llm.backends import LLMBackend, get_llm_backend
+from src.models.schemas import ChatMessage, DiagnosisReport
+
+# Knowledge snippets are cut to this many characters in the chat context
+MAX_SNIPPET_CHARS = 200
+
+
+def render_compact_context(report: Union[DiagnosisReport, dict]) -> str:
+    """
+    Renders the parts of a diagnosis the chat model needs as short plain text.
+    Bounding boxes and raw dict dumps are left out.
+    """
+    if isinstance(report, DiagnosisReport):
+        report = report.model_dump()
+    analysis = report.get("analysis") or {}
+
+    lines = [
+        f"Plant: {analysis.get('plant_type', 'unknown')}",
+        f"Diagnosis: {report.get('diagnosis', 'unknown')}",
+    ]
+    if analysis.get("diagnosed_disease"):
+        lines.append(f"Visual diagnosis: {analysis['diagnosed_disease']}")
+    if analysis.get("visual_symptoms"):
+        lines.append(f"Symptoms: {', '.join(analysis['visual_symptoms'])}")
+    if analysis.get("severity_score") is not None:
+        lines.append(f"Severity: {analysis['severity_score']}/10")
+    if analysis.get("affected_area"):
+        lines.append(f"Affected area: {analysis['affected_area']}")
+    if analysis.get("description"):
+        lines.append(f"Description: {analysis['description']}")
+
+    weather = report.get("weather_context")
+    if weather:
+        lines.append(f"Weather: {weather['temperature']}°C, {weather['humidity']}% hum, {weather['condition']}")
+
+    if report.get("treatment_plan"):
+        lines.append("Treatment plan:")
+        lines.extend(f"- {step}" for step in report["treatment_plan"])
+    if report.get("user_query_answer"):
+        lines.append(f"Answer given to the user's question: {report['user_query_answer']}")
+    if report.get("relevant_knowledge"):
+        lines.append("Knowledge used:")
+        for snippet in report["relevant_knowledge"]:
+            if len(snippet) > MAX_SNIPPET_CHARS:
+                snippet = snippet[:MAX_SNIPPET_CHARS].rstrip() + "..."
+            lines.append(f"- {snippet}")
+    return "\n".join(lines)
+
+
+def render_history(turns: List[ChatMessage]) -> str:
+    return "".join(f"{msg.role.upper()}: {msg.content}\n" for msg in turns)
+
+
+@dataclass
+class ChatSession:
+    diagnosis_id: str
+    context: str
+    summary: str = ""
+    turns: List[ChatMessage] = field(default_factory=list)
+
+
+class ChatSessionStore:
+    """
+    Chat sessions keyed by diagnosis id, kept in a local SQLite file so every
+    API worker sees the same conversation. Sessions expire after `ttl` seconds
+    of inactivity.
+    """
+
+    def __init__(self, db_path: str = settings.CHAT_DB_PATH, ttl: float = settings.CHAT_SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    id TEXT PRIMARY KEY,
+                    context TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    turns TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30.0)
+
+    def _write(self, conn: sqlite3.Connection, session: ChatSession):
+        now = time.time()
+        turns = json.dumps([t.model_dump() for t in session.turns])
+        conn.execute(
+            "INSERT OR REPLACE INTO chat_sessions (id, context, summary, turns, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session.diagnosis_id, session.context, session.summary, turns, now)
+        )
+        conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (now - self.ttl,))
+
+    def _read(self, conn: sqlite3.Connection, diagnosis_id: str) -> Optional[ChatSession]:
+        row = conn.execute(
+            "SELECT context, summary, turns, updated_at FROM chat_sessions WHERE id = ?", (diagnosis_id,)
+        ).fetchone()
+        if row is None or row[3] + self.ttl < time.time():
+            return None
+        return ChatSession(
+            diagnosis_id=diagnosis_id,
+            context=row[0],
+            summary=row[1],
+            turns=[ChatMessage(**t) for t in json.loads(row[2])]
+        )
+
+    def save(self, session: ChatSession):
+        with self._connect() as conn:
+            self._write(conn, session)
+
+    def get(self, diagnosis_id: str) -> Optional[ChatSession]:
+        with self._connect() as conn:
+            return self._read(conn, diagnosis_id)
+
+    def update(self, diagnosis_id: str, change: Callable[[ChatSession], bool]) -> Optional[ChatSession]:
+        """
+        Read-modify-write of a session in one transaction, so concurrent updates
+        (a new turn, a compaction) are not lost. `change` edits the session in place
+        and returns False to leave it unchanged. Returns the session, None if unknown.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            session = self._read(conn, diagnosis_id)
+            if session is not None and change(session) is not False:
+                self._write(conn, session)
+            return session
+
+
+class ChatService:
+    """Follow-up chat about a diagnosis, with compact context and rolling history summaries."""
+
+    def __init__(self, store: Optional[ChatSessionStore] = None, backend: Optional[LLMBackend] = None):
+        self.store = store or ChatSessionStore()
+        self.model_name = "gemini-2.5-flash"
+        self.backend = backend or get_llm_backend()
+
+    def start_session(self, report: Union[DiagnosisReport, dict], history: Optional[List[ChatMessage]] = None,
+                      diagnosis_id: Optional[str] = None) -> str:
+        session = ChatSession(
+            diagnosis_id=diagnosis_id or str(uuid.uuid4()),
+            context=render_compact_context(report),
+            turns=list(history or [])
+        )
+        self.store.save(session)
+        return session.diagnosis_id
+
+    def build_prompt(self, session: ChatSession, message: str) -> str:
+        summary_section = ""
+        if session.summary:
+            summary_section = f"""
+        EARLIER CONVERSATION (Summary):
+        {session.summary}
+        """
+        return f"""
+        You are an expert botanist assistant.
+
+        CONTEXT (Diagnosis Report):
+        {session.context}
+        {summary_section}
+        CONVERSATION HISTORY:
+        {render_history(session.turns)}
+
+        USER: {message}
+
+        ASSISTANT:
+        """
+
+    async def reply(self, session: ChatSession, message: str) -> str:
+        return await self.backend.generate_async(self.model_name, self.build_prompt(session, message), "chat")
+
+    async def reply_stream(self, session: ChatSession, message: str) -> AsyncIterator[str]:
+        """Yields the answer in text chunks as Gemini produces them."""
+        # Observed latency is time to first chunk, the number users feel in chat
+        async for text in self.backend.stream_async(self.model_name, self.build_prompt(session, message), "chat_stream"):
+            yield text
+
+    def record_turn(self, session: ChatSession, message: str, answer: str):
+        """
+        Appends the exchange to the stored session (which a compaction may have
+        changed since `session` was loaded) and refreshes `session` from it.
+        """
+        new_turns = [ChatMessage(role="user", content=message), ChatMessage(role="assistant", content=answer)]
+        latest = self.store.update(session.diagnosis_id, lambda latest: latest.turns.extend(new_turns))
+        if latest is None:
+            # Expired while the answer was generated: keep the conversation going
+            session.turns.extend(new_turns)
+            self.store.save(session)
+            return
+        session.summary, session.turns = latest.summary, latest.turns
+
+    def needs_compaction(self, session: ChatSession) -> bool:
+        return (estimate_tokens(render_history(session.turns)) > settings.CHAT_HISTORY_TOKEN_BUDGET
+                and len(session.turns) > settings.CHAT_KEEP_RECENT_TURNS)
+
+    async def compact(self, diagnosis_id: str):
+        """
+        Folds all but the most recent turns into the rolling summary once the
+        history exceeds the token budget. Turns appended while the summary is
+        being generated are kept. The sqlite reads and writes run in a worker
+        thread, off the event loop.
+        """
+        session = await asyncio.to_thread(self.store.get, diagnosis_id)
+        if session is None or not self.needs_compaction(session):
+            return
+
+        old_turns = session.turns[:-settings.CHAT_KEEP_RECENT_TURNS]
+        prompt = f"""
+        Summarize this conversation between a user and a botanist assistant about a plant diagnosis.
+        Keep facts about the plant, advice already given and open questions. Maximum 150 words.
+
+        PREVIOUS SUMMARY:
+        {session.summary or "None"}
+
+        CONVERSATION:
+        {render_history(old_turns)}
+        """
+        try:
+            summary = await self.backend.generate_async(self.model_name, prompt, "chat_summary")
+        except Exception as e:
+            print(f"Chat summarization failed for {diagnosis_id}: {e}")
+            return
+
+        def fold(latest: ChatSession) -> bool:
+            if latest.turns[:len(old_turns)] != old_turns:
+                # Another compaction got there first
+                return False
+            latest.summary = summary.strip()
+            latest.turns = latest.turns[len(old_turns):]
+            return True
+
+        await asyncio.to_thread(self.store.update, diagnosis_id, fold)
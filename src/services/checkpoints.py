@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.core.config import settings
+from src.models.schemas import KnowledgeChunk, PlantImageAnalysis, WeatherData
+
+
+@dataclass
+class Checkpoint:
+    image_bytes: bytes
+    image_mime: str
+    location: str
+    user_query: str
+    mode: str
+    # Finished node outputs, ready to pre-fill the pipeline state
+    outputs: dict = field(default_factory=dict)
+
+
+class CheckpointStore:
+    """
+    Per-request pipeline checkpoints in a local SQLite file.
+
+    A checkpoint holds the request inputs (enhanced image, location, query, mode)
+    and the outputs of the graph nodes that had finished when a diagnosis failed.
+    Re-running the graph from a checkpoint skips those nodes (they find their output
+    pre-filled), so a retry does not pay for the vision call again. Successful runs
+    write nothing. Checkpoints expire after `ttl` seconds.
+    """
+
+    # Node outputs worth keeping, with how to rebuild them from JSON
+    FIELDS = {
+        "analysis": lambda v: PlantImageAnalysis(**v),
+        "weather": lambda v: WeatherData(**v),
+        "retrieved_context": lambda v: [KnowledgeChunk(**c) for c in v],
+        "speculative_context": lambda v: [KnowledgeChunk(**c) for c in v],
+    }
+
+    def __init__(self, db_path: str = settings.CHECKPOINT_DB_PATH, ttl: float = settings.CHECKPOINT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    request_id TEXT PRIMARY KEY,
+                    image BLOB NOT NULL,
+                    image_mime TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    user_query TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    outputs TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30.0)
+
+    @staticmethod
+    def _dump(value):
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [item.model_dump() for item in value]
+        return value.model_dump()
+
+    def save(self, request_id: str, state: dict, mode: str):
+        """Stores the inputs and the finished node outputs of a failed run's `state`."""
+        outputs = {key: self._dump(state.get(key)) for key in self.FIELDS if state.get(key) is not None}
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(request_id, image, image_mime, location, user_query, mode, outputs, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (request_id, state["image_bytes"], state["image_mime"], state["location"],
+                 state["user_query"], mode, json.dumps(outputs), now)
+            )
+            conn.execute("DELETE FROM checkpoints WHERE updated_at < ?", (now - self.ttl,))
+
+    def load(self, request_id: str) -> Optional[Checkpoint]:
+        """The checkpoint of `request_id`, or None if unknown or expired."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT image, image_mime, location, user_query, mode, outputs, updated_at "
+                "FROM checkpoints WHERE request_id = ?", (request_id,)
+            ).fetchone()
+        if row is None or row[6] + self.ttl < time.time():
+            return None
+        outputs = {
+            key: self.FIELDS[key](value)
+            for key, value in json.loads(row[5]).items() if value is not None
+        }
+        return Checkpoint(image_bytes=row[0], image_mime=row[1], location=row[2],
+                          user_query=row[3], mode=row[4], outputs=outputs)
+
+    def delete(self, request_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE request_id = ?", (request_id,))
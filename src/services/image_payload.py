@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from src.core.config import settings
+
+
+# format -> (cv2 extension, quality flag, mime type)
+FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+}
+
+
+@dataclass
+class ImagePayload:
+    data: bytes
+    mime_type: str
+    quality: int
+    width: int
+    height: int
+
+
+class PayloadOptimizer:
+    """
+    Shrinks images before they are sent to the Gemini vision model.
+
+    Gemini downsamples large images itself and returns box_2d normalized to 0-1000,
+    so a 12MP phone photo costs upload time without adding detail. The optimizer
+    resizes to at most `max_edge` pixels on the long side (keeping the aspect ratio,
+    so normalized boxes still line up with the original photo) and encodes at the
+    highest quality in [min_quality, max_quality] that fits `target_bytes`.
+    OpenCV's encoders write no EXIF/XMP/ICC blocks, so metadata is stripped too.
+    """
+
+    def __init__(self,
+                 max_edge: int = settings.IMAGE_MAX_EDGE,
+                 target_bytes: int = settings.IMAGE_TARGET_BYTES,
+                 image_format: str = settings.IMAGE_FORMAT,
+                 min_quality: int = settings.IMAGE_MIN_QUALITY,
+                 max_quality: int = settings.IMAGE_MAX_QUALITY):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unknown image format '{image_format}', expected one of {sorted(FORMATS)}")
+        self.max_edge = max_edge
+        self.target_bytes = target_bytes
+        self.image_format = image_format
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+
+    def resize(self, img: np.ndarray) -> np.ndarray:
+        rows, cols = img.shape[:2]
+        long_edge = max(rows, cols)
+        if not self.max_edge or long_edge <= self.max_edge:
+            return img
+        scale = self.max_edge / long_edge
+        size = (max(1, round(cols * scale)), max(1, round(rows * scale)))
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+    def _encode(self, img: np.ndarray, quality: int) -> bytes:
+        extension, flag, _ = FORMATS[self.image_format]
+        ok, encoded = cv2.imencode(extension, img, [flag, quality])
+        if not ok:
+            raise ValueError(f"Could not encode image as {self.image_format}")
+        return encoded.tobytes()
+
+    def encode(self, img: np.ndarray) -> ImagePayload:
+        """Encodes `img` at the highest quality that fits the byte target (min_quality if none does)."""
+        best_quality = self.max_quality
+        best = self._encode(img, best_quality)
+        if self.target_bytes and len(best) > self.target_bytes:
+            # Size grows with quality: binary search the largest quality under the target
+            low, high = self.min_quality, self.max_quality - 1
+            best_quality, best = None, None
+            while low <= high:
+                quality = (low + high) // 2
+                data = self._encode(img, quality)
+                if len(data) <= self.target_bytes:
+                    best_quality, best = quality, data
+                    low = quality + 1
+                else:
+                    high = quality - 1
+            if best is None:
+                best_quality = self.min_quality
+                best = self._encode(img, best_quality)
+
+        rows, cols = img.shape[:2]
+        return ImagePayload(data=best, mime_type=FORMATS[self.image_format][2], quality=best_quality,
+                            width=cols, height=rows)
+
+    def optimize(self, img: np.ndarray) -> ImagePayload:
+        return self.encode(self.resize(img))
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from src.core.config import settings
+
+# Job lifecycle: queued -> running -> completed | failed
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# handler(job) -> result model; `job` is a dict with the columns of the jobs table
+JobHandler = Callable[[dict], Awaitable[BaseModel]]
+
+
+class JobQueue:
+    """
+    Durable diagnosis job queue backed by a local SQLite file, drained by a pool
+    of in-process asyncio workers.
+
+    Several processes (uvicorn --workers, the pre-fork server) may share the file.
+    A claimed job is leased to its queue instance (`owner`) until `lease_until`;
+    the lease is renewed while the job runs. Only jobs whose lease expired, i.e.
+    whose process died, are claimed again, so a running job is never run twice.
+    """
+
+    def __init__(self, db_path: str = settings.JOB_DB_PATH, workers: int = settings.JOB_WORKERS,
+                 lease_seconds: float = settings.JOB_LEASE_SECONDS):
+        self.db_path = db_path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handler: Optional[JobHandler] = None
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._init_db()
+
+    # --- Storage ---
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    image BLOB,
+                    location TEXT,
+                    user_query TEXT,
+                    webhook_url TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_until REAL
+                )
+            """)
+            # Files created before leases existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def submit(self, image: bytes, filename: str, location: str,
+               user_query: Optional[str] = None, webhook_url: Optional[str] = None) -> str:
+        """Persists a new job and wakes a worker. Returns the job id."""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, filename, image, location, user_query, webhook_url, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, image, location, user_query, webhook_url, now, now)
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns the job's public fields, or None if unknown."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim_next(self) -> Optional[dict]:
+        """
+        Atomically leases the oldest queued job (or running job with an expired
+        lease, left behind by a dead process) to this queue and returns it.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND (lease_until IS NULL OR lease_until < ?)) "
+                "ORDER BY created_at LIMIT 1", (QUEUED, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            if row["status"] == RUNNING:
+                print(f"Re-claiming job {row['id']} (lease of {row['owner']} expired)")
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, self.owner, now + self.lease_seconds, now, row["id"])
+            )
+            conn.commit()
+            return dict(row)
+        finally:
+            conn.close()
+
+    def _renew_lease(self, job_id: str) -> bool:
+        """Extends the lease on a job this queue runs. False if the lease was lost."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, self.owner, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    def _release(self, job_id: str):
+        """Puts a job this queue was running back in the queue (shutdown)."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (QUEUED, time.time(), job_id, self.owner, RUNNING)
+            )
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        """Stores the outcome; False (and nothing stored) if the job is no longer leased to this queue."""
+        # The image is only needed while the job runs; drop it to keep the file small.
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, image = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (status, result, error, time.time(), job_id, self.owner, RUNNING)
+            )
+        return cursor.rowcount > 0
+
+    # --- Workers ---
+
+    async def start(self, handler: JobHandler):
+        self._handler = handler
+        self._tasks = [asyncio.create_task(self._worker_loop(n)) for n in range(self.workers)]
+        # Pick up jobs left over from a previous run
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker_loop(self, worker_id: int):
+        while True:
+            job = await asyncio.to_thread(self._claim_next)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            print(f"[job worker {worker_id}] Running job {job['id']}")
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            try:
+                result = await self._handler(job)
+                finished = await asyncio.to_thread(self._finish, job["id"], COMPLETED, result.model_dump_json())
+            except asyncio.CancelledError:
+                # Shutting down: hand the job back instead of waiting for the lease to expire
+                await asyncio.shield(asyncio.to_thread(self._release, job["id"]))
+                raise
+            except Exception as e:
+                print(f"[job worker {worker_id}] Job {job['id']} failed: {e}")
+                finished = await asyncio.to_thread(self._finish, job["id"], FAILED, None, str(e))
+            finally:
+                heartbeat.cancel()
+
+            if not finished:
+                # Another worker took the job over; it reports the outcome
+                print(f"[job worker {worker_id}] Lost the lease on job {job['id']}, result discarded")
+            elif job["webhook_url"]:
+                await self._notify_webhook(job["id"], job["webhook_url"])
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self._renew_lease, job_id):
+                return
+
+    async def _notify_webhook(self, job_id: str, webhook_url: str):
+        """POSTs the final job status to the callback URL. Failures are only logged."""
+        payload = await asyncio.to_thread(self.get, job_id)
+        try:
+            async with httpx.AsyncClient(timeout=settings.JOB_WEBHOOK_TIMEOUT) as client:
+                response = await client.post(webhook_url, json=payload)
+                response.raise_for_status()
+        except Exception as e:
+            print(f"Webhook delivery failed for job {job_id}: {e}")
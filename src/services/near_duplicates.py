@@ -0,0 +1,171 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.core.config import settings
+from src.core.metrics import CACHE_REQUESTS, NEAR_DUPLICATE_DISTANCE
+
+
+# --- Perceptual hashes (64 bit) ---
+
+def _decode_gray(image_bytes: bytes) -> Optional[np.ndarray]:
+    # The hash only needs a thumbnail; let libjpeg decode at 1/4 scale
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+
+def dhash(image_bytes: bytes) -> Optional[int]:
+    """Difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    gray = _decode_gray(image_bytes)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+def phash(image_bytes: bytes) -> Optional[int]:
+    """DCT hash: low-frequency 8x8 DCT coefficients of a 32x32 thumbnail compared to their median."""
+    gray = _decode_gray(image_bytes)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # The DC term is the mean brightness, not structure
+    return _bits_to_int(low > np.median(low[1:]))
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+HASHES = {"phash": phash, "dhash": dhash}
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance: finds every stored hash within a
+    radius without scanning all of them. Each child edge is labelled with its
+    distance to the parent, and the triangle inequality prunes subtrees.
+    """
+
+    def __init__(self):
+        # node = (hash, value, {distance: child node})
+        self._root: Optional[tuple] = None
+        self.size = 0
+
+    def add(self, key: int, value: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = (key, value, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, value, {})
+                return
+            node = child
+
+    def search(self, key: int, radius: int) -> List[Tuple[int, Any]]:
+        """(distance, value) of all entries within `radius`, nearest first."""
+        if self._root is None:
+            return []
+        found, stack = [], [self._root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= radius:
+                found.append((distance, value))
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class NearDuplicateIndex:
+    """
+    Recent uploads by perceptual hash, so a photo of the same leaf taken again (or
+    re-encoded at another JPEG quality) can reuse the earlier PlantImageAnalysis
+    instead of a new Gemini vision call.
+
+    A lookup is a hit when the nearest recent hash is within `max_distance` bits.
+    The nearest distance up to twice that is recorded in a histogram to help tune
+    the threshold. Entries expire after `ttl` seconds; expired and oldest entries
+    are dropped (and the tree rebuilt) once it exceeds `max_entries`.
+    """
+
+    def __init__(self,
+                 max_distance: int = settings.NEAR_DUPLICATE_MAX_DISTANCE,
+                 ttl: float = settings.NEAR_DUPLICATE_TTL,
+                 max_entries: int = settings.NEAR_DUPLICATE_MAX_ENTRIES,
+                 hash_name: str = settings.NEAR_DUPLICATE_HASH):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hash_fn = HASHES[hash_name]
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, Tuple[float, Any]] = {} # hash -> (created_at, value)
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def image_hash(self, image_bytes: bytes) -> Optional[int]:
+        return self.hash_fn(image_bytes)
+
+    def lookup(self, image_hash: int) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            nearest = None
+            for distance, key in self._tree.search(image_hash, self.max_distance * 2):
+                created_at, value = self._entries.get(key, (0.0, None))
+                if created_at + self.ttl >= now:
+                    nearest = (distance, value)
+                    break
+            if nearest is not None:
+                NEAR_DUPLICATE_DISTANCE.observe(nearest[0])
+            if nearest is not None and nearest[0] <= self.max_distance:
+                self.hits += 1
+                CACHE_REQUESTS.labels(cache="near_duplicate", result="hit").inc()
+                return nearest[1]
+            self.misses += 1
+            CACHE_REQUESTS.labels(cache="near_duplicate", result="miss").inc()
+            return None
+
+    def add(self, image_hash: int, value: Any):
+        with self._lock:
+            is_new = image_hash not in self._entries
+            self._entries[image_hash] = (time.time(), value)
+            if is_new:
+                # The tree stores the hash; the current value is looked up in _entries
+                self._tree.add(image_hash, image_hash)
+            if len(self._entries) > self.max_entries:
+                self._rebuild()
+
+    def _rebuild(self):
+        # Drop expired entries, then the oldest, down to 90% of the cap so the
+        # rebuild does not repeat on every add
+        cutoff = time.time() - self.ttl
+        live = sorted(
+            ((created_at, key, value) for key, (created_at, value) in self._entries.items() if created_at >= cutoff),
+            key=lambda entry: entry[0], reverse=True
+        )[:int(self.max_entries * 0.9)]
+        self._entries = {key: (created_at, value) for created_at, key, value in live}
+        self._tree = BKTree()
+        for key in self._entries:
+            self._tree.add(key, key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "max_distance": self.max_distance,
+        }
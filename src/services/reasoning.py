@@ -1,8 +1,7 @@
 from src.llm.gemini_client import GeminiClient
 import os
-import io
-import PIL.Image
-from src.services.vision_enhancer import enhance_image_for_ai
+import mimetypes
+from src.services.vision_enhancer import prepare_image_for_ai
 
 async def analyze_plant(image_path: str):
     """
@@ -23,14 +22,14 @@ async def analyze_plant(image_path: str):
             
         # 2. Enhance
         try:
-             enhanced_bytes = enhance_image_for_ai(raw_bytes)
-             # Convert back to PIL for client
-             img = PIL.Image.open(io.BytesIO(enhanced_bytes))
+             enhanced_bytes, mime_type = prepare_image_for_ai(raw_bytes)
         except Exception as e:
              print(f"Benchmark Enhancement failed: {e}")
-             img = PIL.Image.open(image_path)
+             enhanced_bytes, mime_type = raw_bytes, None
 
-        analysis = client.analyze_image(img)
+        # Encoded bytes go to the client inline, no PIL decode/re-encode
+        mime_type = mime_type or mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        analysis = client.analyze_image(enhanced_bytes, mime_type=mime_type)
         
         # Deterministic Scoring Logic
         # 1. Trust Label
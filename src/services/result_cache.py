@@ -0,0 +1,138 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from src.core.cache import LRUCache
+from src.core.config import settings
+from src.core.metrics import CACHE_REQUESTS
+from src.models.schemas import DiagnosisReport
+
+
+class DiagnosisCache:
+    """
+    Content-addressed cache of finished DiagnosisReports.
+
+    Two tiers: an in-memory LRU (hot, per process) in front of a SQLite file
+    that survives restarts. Both tiers expire entries after `ttl` seconds, which
+    also bounds how stale the weather context in a cached report can get.
+    Reports are stored without their `timings`.
+    """
+
+    def __init__(self,
+                 db_path: str = settings.RESULT_CACHE_DB_PATH,
+                 memory_size: int = settings.RESULT_CACHE_MEMORY_SIZE,
+                 disk_max_entries: int = settings.RESULT_CACHE_DISK_MAX_ENTRIES,
+                 ttl: float = settings.RESULT_CACHE_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.memory = LRUCache(maxsize=memory_size, ttl=ttl, name="diagnosis_memory")
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    @staticmethod
+    def make_key(image_bytes: bytes, user_query: Optional[str], location: Optional[str],
+                 mode: str = "full") -> str:
+        """
+        Key = hash of the (enhanced) image bytes + normalized query + coarse location
+        + pipeline mode (full and lite reports are cached separately).
+        Casing and whitespace differences in query/location map to the same entry.
+        """
+        def normalize(text: Optional[str]) -> str:
+            return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+        # "London, UK" and "london,uk" are the same weather bucket
+        location_bucket = normalize(location).replace(" ", "")
+        digest = hashlib.sha256(image_bytes)
+        digest.update(b"\0" + normalize(user_query).encode("utf-8"))
+        digest.update(b"\0" + location_bucket.encode("utf-8"))
+        digest.update(b"\0" + mode.encode("utf-8"))
+        return digest.hexdigest()
+
+    # --- Disk tier ---
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30.0)
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS diagnosis_cache (
+                    key TEXT PRIMARY KEY,
+                    report TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON diagnosis_cache (accessed_at)")
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT report, created_at FROM diagnosis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                conn.execute("DELETE FROM diagnosis_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE diagnosis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _disk_set(self, key: str, report_json: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO diagnosis_cache (key, report, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, report_json, now, now)
+            )
+            # Expire by TTL, then trim least recently used entries over the cap
+            conn.execute("DELETE FROM diagnosis_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("""
+                DELETE FROM diagnosis_cache WHERE key IN (
+                    SELECT key FROM diagnosis_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.disk_max_entries,))
+
+    # --- Public API ---
+
+    def get(self, key: str) -> Optional[DiagnosisReport]:
+        report = self.memory.get(key)
+        if report is not None:
+            return report
+
+        report_json = self._disk_get(key)
+        with self._lock:
+            if report_json is None:
+                self.disk_misses += 1
+                CACHE_REQUESTS.labels(cache="diagnosis_disk", result="miss").inc()
+                return None
+            self.disk_hits += 1
+            CACHE_REQUESTS.labels(cache="diagnosis_disk", result="hit").inc()
+
+        report = DiagnosisReport.model_validate_json(report_json)
+        self.memory.set(key, report)
+        return report
+
+    def set(self, key: str, report: DiagnosisReport):
+        # Timings describe the run that produced the report, not the requests it is served to
+        report = report.model_copy(update={"timings": None})
+        self.memory.set(key, report)
+        self._disk_set(key, report.model_dump_json())
+
+    def stats(self) -> dict:
+        disk_lookups = self.disk_hits + self.disk_misses
+        return {
+            "memory": self.memory.stats(),
+            "disk": {
+                "hits": self.disk_hits,
+                "misses": self.disk_misses,
+                "hit_rate": round(self.disk_hits / disk_lookups, 4) if disk_lookups else 0.0,
+            },
+        }
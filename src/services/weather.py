@@ -2,6 +2,7 @@ import httpx
 from typing import Optional
 from pydantic import BaseModel
 from src.core.config import settings
+from src.core.metrics import WEATHER_FETCH_SECONDS, ERRORS
 
 class WeatherData(BaseModel):
     temperature: float
@@ -12,8 +13,20 @@ class WeatherData(BaseModel):
 class WeatherService:
     BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
 
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.api_key = settings.OPENWEATHER_API_KEY
+        # Shared by async fetches so connections are pooled; see open()/aclose()
+        self._client = client
+
+    def open(self):
+        """Creates the pooled AsyncClient used by get_current_weather_async. Pair with aclose()."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=5.0)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def get_current_weather(self, location: str) -> Optional[WeatherData]:
         """
@@ -25,23 +38,50 @@ class WeatherService:
             return None
 
         try:
-            params = {
-                "q": location,
-                "appid": self.api_key,
-                "units": "metric" # Celsius
-            }
             # Using synchronous request for simplicity in Phase 2 pipeline
-            with httpx.Client(timeout=5.0) as client:
-                response = client.get(self.BASE_URL, params=params)
+            with WEATHER_FETCH_SECONDS.time(), httpx.Client(timeout=5.0) as client:
+                response = client.get(self.BASE_URL, params=self._params(location))
+                response.raise_for_status()
+                return self._parse(response.json())
+        except Exception as e:
+            ERRORS.labels(stage="weather").inc()
+            print(f"Weather fetch failed for {location}: {e}")
+            return None
+
+    async def get_current_weather_async(self, location: str) -> Optional[WeatherData]:
+        """
+        Non-blocking variant of get_current_weather. Uses the client from open(),
+        or a one-off client if the service was never opened (e.g. in scripts).
+        """
+        if not self.api_key:
+            print("WARNING: OPENWEATHER_API_KEY not set.")
+            return None
+
+        try:
+            with WEATHER_FETCH_SECONDS.time():
+                if self._client is not None:
+                    response = await self._client.get(self.BASE_URL, params=self._params(location))
+                else:
+                    async with httpx.AsyncClient(timeout=5.0) as client:
+                        response = await client.get(self.BASE_URL, params=self._params(location))
                 response.raise_for_status()
-                data = response.json()
-
-                return WeatherData(
-                    temperature=data["main"]["temp"],
-                    humidity=data["main"]["humidity"],
-                    condition=data["weather"][0]["description"],
-                    location=data["name"]
-                )
+                return self._parse(response.json())
         except Exception as e:
+            ERRORS.labels(stage="weather").inc()
             print(f"Weather fetch failed for {location}: {e}")
             return None
+
+    def _params(self, location: str) -> dict:
+        return {
+            "q": location,
+            "appid": self.api_key,
+            "units": "metric" # Celsius
+        }
+
+    def _parse(self, data: dict) -> WeatherData:
+        return WeatherData(
+            temperature=data["main"]["temp"],
+            humidity=data["main"]["humidity"],
+            condition=data["weather"][0]["description"],
+            location=data["name"]
+        )
@@ -0,0 +1,178 @@
+import math
+import os
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.text import content_terms
+
+
+def _view(values) -> np.ndarray:
+    """int32 numpy view of a postings list (numpy slice or growable array('i')), without copying."""
+    if isinstance(values, np.ndarray):
+        return values
+    return np.frombuffer(values, dtype=np.int32) if len(values) else np.empty(0, dtype=np.int32)
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring over the knowledge chunks.
+
+    Exact terms such as disease and species names ("Gymnosporangium", "Septoria")
+    are matched literally, which the MiniLM embeddings do poorly, and a lookup
+    needs no embedding forward pass.
+
+    Chunks are numbered internally and postings are int32 arrays (doc numbers and
+    term frequencies), so the index is small, loads in one pass and, loaded in the
+    pre-fork master, is shared by all workers. Only chunk ids are kept: the text
+    stays in Chroma. Removed chunks are masked out until the next save compacts them.
+    """
+
+    VERSION = 2
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[Optional[str]] = [] # doc number -> chunk id (None once removed)
+        self.numbers: Dict[str, int] = {} # chunk id -> doc number
+        self.lengths = array("i") # doc number -> number of terms (0 once removed)
+        self.postings: Dict[str, Tuple] = {} # term -> (doc numbers, term frequencies)
+        self.total_length = 0
+        self.removed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return content_terms(text)
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def add(self, chunk_id: str, content: str):
+        """Indexes a chunk; an existing chunk with the same id is replaced."""
+        terms = Counter(self.tokenize(content))
+        with self._lock:
+            self._remove(chunk_id)
+            number = len(self.ids)
+            self.ids.append(chunk_id)
+            self.numbers[chunk_id] = number
+            length = sum(terms.values())
+            self.lengths.append(length)
+            self.total_length += length
+            for term, frequency in terms.items():
+                docs, frequencies = self.postings.get(term, ((), ()))
+                if not isinstance(docs, array):
+                    # Loaded postings are read-only numpy slices: copy the term's list on first write
+                    docs, frequencies = array("i", docs), array("i", frequencies)
+                    self.postings[term] = (docs, frequencies)
+                docs.append(number)
+                frequencies.append(frequency)
+
+    def remove(self, chunk_id: str):
+        with self._lock:
+            self._remove(chunk_id)
+
+    def _remove(self, chunk_id: str):
+        number = self.numbers.pop(chunk_id, None)
+        if number is None:
+            return
+        self.ids[number] = None
+        self.total_length -= self.lengths[number]
+        self.lengths[number] = 0
+        self.removed += 1
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """(chunk id, score) of the best `n_results` chunks sharing a term with `query`."""
+        terms = set(self.tokenize(query))
+        with self._lock:
+            count = len(self.numbers)
+            if not terms or not count:
+                return []
+            average_length = self.total_length / count or 1.0
+            lengths = _view(self.lengths)
+            scores = np.zeros(len(self.ids))
+            for term in terms:
+                entry = self.postings.get(term)
+                if entry is None or not len(entry[0]):
+                    continue
+                docs, frequencies = _view(entry[0]), _view(entry[1]).astype(np.float64)
+                doc_lengths = lengths[docs]
+                # Removed chunks (length 0) stay in the postings until the next compaction
+                frequency = np.count_nonzero(doc_lengths)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * doc_lengths / average_length)
+                scores[docs] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+            scores[lengths == 0] = 0.0
+            hits = np.flatnonzero(scores > 0)
+            top = hits[np.argsort(-scores[hits], kind="stable")[:n_results]]
+            return [(self.ids[number], float(scores[number])) for number in top]
+
+    def compact(self):
+        """Renumbers the chunks without the removed ones."""
+        with self._lock:
+            if not self.removed:
+                return
+            keep = np.array([number for number, chunk_id in enumerate(self.ids) if chunk_id is not None], dtype=np.int64)
+            renumber = np.full(len(self.ids), -1, dtype=np.int32)
+            renumber[keep] = np.arange(len(keep), dtype=np.int32)
+            postings = {}
+            for term, (docs, frequencies) in self.postings.items():
+                new_docs = renumber[_view(docs)]
+                live = new_docs >= 0
+                if live.any():
+                    postings[term] = (new_docs[live], _view(frequencies)[live])
+            self.postings = postings
+            self.ids = [self.ids[number] for number in keep]
+            self.numbers = {chunk_id: number for number, chunk_id in enumerate(self.ids)}
+            self.lengths = array("i", _view(self.lengths)[keep].tolist())
+            self.removed = 0
+
+    def save(self, path: str):
+        self.compact()
+        with self._lock:
+            terms = list(self.postings)
+            sizes = [len(self.postings[term][0]) for term in terms]
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=offsets[1:])
+            arrays = {
+                "meta": np.array([self.VERSION, self.k1, self.b]),
+                "ids": np.frombuffer("\n".join(self.ids).encode("utf-8"), dtype=np.uint8),
+                "terms": np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                "offsets": offsets,
+                "docs": np.concatenate([_view(self.postings[t][0]) for t in terms]) if terms else np.empty(0, np.int32),
+                "frequencies": np.concatenate([_view(self.postings[t][1]) for t in terms]) if terms else np.empty(0, np.int32),
+                "lengths": _view(self.lengths).copy(),
+            }
+            # Write-then-rename with a per-writer tmp file: several processes may save at once
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """The index saved at `path`, or None if there is none (or it has an older format)."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            meta = data["meta"]
+            if int(meta[0]) != cls.VERSION:
+                return None
+            arrays = {name: data[name] for name in ("ids", "terms", "offsets", "docs", "frequencies", "lengths")}
+        index = cls(k1=float(meta[1]), b=float(meta[2]))
+        ids = arrays["ids"].tobytes().decode("utf-8")
+        index.ids = ids.split("\n") if ids else []
+        index.numbers = {chunk_id: number for number, chunk_id in enumerate(index.ids)}
+        index.lengths = array("i", arrays["lengths"].tolist())
+        index.total_length = int(arrays["lengths"].sum())
+        terms = arrays["terms"].tobytes().decode("utf-8")
+        offsets, docs, frequencies = arrays["offsets"], arrays["docs"], arrays["frequencies"]
+        # Slices are views into the two big arrays
+        index.postings = {
+            term: (docs[offsets[i]:offsets[i + 1]], frequencies[offsets[i]:offsets[i + 1]])
+            for i, term in enumerate(terms.split("\n") if terms else [])
+        }
+        return index
@@ -1,63 +1,370 @@
 import chromadb
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import List, cast
+from typing import List, Optional, Tuple
+from src.core.cache import LRUCache
 from src.core.config import settings
+from src.core.metrics import EMBEDDING_SECONDS, CHROMA_QUERY_SECONDS, LEXICAL_QUERY_SECONDS
 from src.models.schemas import KnowledgeChunk
+from src.vector_store.bm25 import BM25Index
+from src.vector_store.fusion import reciprocal_rank_fusion
 from sentence_transformers import SentenceTransformer
 
+# CPU-bound encoding runs here instead of the default executor, so embedding
+# bursts can't starve other blocking work (and vice versa).
+_embedding_executor = ThreadPoolExecutor(
+    max_workers=settings.EMBEDDING_WORKERS, thread_name_prefix="embedding"
+)
+
+# One SentenceTransformer per process, shared by every BotanicalKnowledgeBase.
+# Loaded before forking (see preload_for_fork) it is shared copy-on-write.
+_embedding_model = None
+
+def load_embedding_model() -> SentenceTransformer:
+    global _embedding_model
+    if _embedding_model is None:
+        _embedding_model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+    return _embedding_model
+
+def open_collection():
+    """(client, collection) of the knowledge base."""
+    client = chromadb.PersistentClient(path=settings.CHROMA_DB_PATH)
+    collection = client.get_or_create_collection(
+        name="botanical_knowledge",
+        metadata={"hnsw:space": "cosine"}
+    )
+    return client, collection
+
+# BM25 index loaded in the pre-fork master, as (index, file mtime); every
+# BotanicalKnowledgeBase in the workers uses it instead of loading its own copy.
+_preloaded_lexical_index = None
+
+def build_lexical_index(collection, page_size: int = 5000) -> BM25Index:
+    print("Building BM25 index from the collection...")
+    start = time.perf_counter()
+    index = BM25Index()
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        for chunk_id, content in zip(page["ids"], page["documents"]):
+            index.add(chunk_id, content)
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+    print(f"Indexed {len(index)} chunks in {time.perf_counter() - start:.1f}s")
+    return index
+
+def build_lexical_index_file(path: str = settings.LEXICAL_INDEX_PATH):
+    _, collection = open_collection()
+    build_lexical_index(collection).save(path)
+
+def preload_for_fork():
+    """
+    Prepares the knowledge base in a pre-fork master process: loads the embedding
+    weights and the BM25 index, and reads the Chroma files into the OS page cache.
+
+    The Chroma client itself is opened per worker after the fork (its SQLite
+    connection and background threads do not survive fork), and no encoding
+    runs here since torch's OpenMP pool is not fork-safe once started.
+    """
+    global _preloaded_lexical_index
+    load_embedding_model()
+    for root, _, files in os.walk(settings.CHROMA_DB_PATH):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                while f.read(1 << 20):
+                    pass
+
+    path = settings.LEXICAL_INDEX_PATH
+    if not os.path.exists(path):
+        # Building needs Chroma, which must not be opened here: do it in a fresh process
+        builder = multiprocessing.get_context("spawn").Process(target=build_lexical_index_file, args=(path,))
+        builder.start()
+        builder.join()
+    index = BM25Index.load(path)
+    if index is not None:
+        _preloaded_lexical_index = (index, os.stat(path).st_mtime)
+
 class BotanicalKnowledgeBase:
+    # dense: embeddings + Chroma; lexical: BM25 only (no embedding pass);
+    # hybrid: both rankings fused with RRF
+    QUERY_MODES = ("dense", "lexical", "hybrid")
+    # Hybrid mode fuses this many times n_results candidates from each ranking
+    HYBRID_CANDIDATE_FACTOR = 3
+
     def __init__(self):
-        self.client = chromadb.PersistentClient(path=settings.CHROMA_DB_PATH)
-        self.embedding_fn = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
-        self.collection = self.client.get_or_create_collection(
-            name="botanical_knowledge",
-            metadata={"hnsw:space": "cosine"}
+        self.client, self.collection = open_collection()
+        self.embedding_fn = load_embedding_model()
+        # Traffic repeats a few dozen crop/symptom queries: cache their embeddings,
+        # and the search results per (generation, embedding, n_results).
+        # `generation` is bumped by every write, so stale results are never served.
+        self.generation = 0
+        self.embedding_cache = LRUCache(settings.RETRIEVAL_EMBEDDING_CACHE_SIZE, name="query_embedding")
+        self.result_cache = LRUCache(
+            settings.RETRIEVAL_RESULT_CACHE_SIZE, ttl=settings.RETRIEVAL_RESULT_CACHE_TTL, name="retrieval_results"
         )
+        # BM25 index over the same chunks, persisted next to chroma_db by ingestion;
+        # preloaded before fork or loaded on first use. Writes update it in memory
+        # until save_lexical_index().
+        self.lexical_index_path = settings.LEXICAL_INDEX_PATH
+        self._lexical_index: Optional[BM25Index] = None
+        self._lexical_mtime = None
+        self._lexical_dirty = False
+        self._lexical_lock = threading.Lock()
 
-    def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def _get_embeddings(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
         """
         Helper to get embeddings from local model.
         """
-        embeddings = self.embedding_fn.encode(texts)
+        with EMBEDDING_SECONDS.time():
+            embeddings = self.embedding_fn.encode(texts, batch_size=batch_size)
         return embeddings.tolist()
     
     def _get_query_embedding(self, text: str) -> List[float]:
-        embedding = self.embedding_fn.encode(text)
+        with EMBEDDING_SECONDS.time():
+            embedding = self.embedding_fn.encode(text)
         return embedding.tolist()
 
-    def add_documents(self, documents: List[str], metadatas: List[dict], ids: List[str]):
+    def _cached_query_embeddings(self, texts: List[str]) -> List[Tuple[float, ...]]:
+        """Query embeddings from the cache; the misses are encoded in one forward pass."""
+        embeddings = [self.embedding_cache.get(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self._get_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = tuple(embedding)
+                self.embedding_cache.set(texts[i], embeddings[i])
+        return embeddings
+
+    def _invalidate(self):
+        self.generation += 1
+        self.result_cache.clear()
+
+    def cache_stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+
+    def lexical_index(self) -> BM25Index:
+        """
+        The BM25 index: the preloaded one, else loaded from disk, else built from the
+        collection (also if the saved one does not match the collection's size).
+        Reloaded when another process (ingestion) rewrites the file.
+        """
+        mtime = self._index_file_mtime()
+        if self._lexical_index is not None and (mtime == self._lexical_mtime or self._lexical_dirty):
+            return self._lexical_index
+        with self._lexical_lock:
+            mtime = self._index_file_mtime()
+            if self._lexical_index is not None and (mtime == self._lexical_mtime or self._lexical_dirty):
+                return self._lexical_index
+            reloading = self._lexical_index is not None
+            index = None
+            if not reloading and _preloaded_lexical_index is not None and _preloaded_lexical_index[1] == mtime:
+                index = _preloaded_lexical_index[0]
+            elif mtime is not None:
+                index = BM25Index.load(self.lexical_index_path)
+            if index is None or len(index) != self.collection.count():
+                index = build_lexical_index(self.collection)
+                index.save(self.lexical_index_path)
+                mtime = self._index_file_mtime()
+            self._lexical_index, self._lexical_mtime = index, mtime
+            if reloading:
+                # The collection changed under us too
+                self._invalidate()
+        return self._lexical_index
+
+    def _index_file_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.lexical_index_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def save_lexical_index(self):
+        """Persists the in-memory BM25 index (bulk ingestion calls this once at the end)."""
+        with self._lexical_lock:
+            if self._lexical_index is not None and self._lexical_dirty:
+                self._lexical_index.save(self.lexical_index_path)
+                self._lexical_mtime = self._index_file_mtime()
+                self._lexical_dirty = False
+
+    def _index_documents(self, index: BM25Index, documents: List[str], ids: List[str]):
+        for chunk_id, content in zip(ids, documents):
+            index.add(chunk_id, content)
+        self._lexical_dirty = True
+
+    def warm_up(self):
+        """
+        Runs a dummy embedding and a Chroma query so the first real request does not
+        pay for lazy model initialisation or for paging in the HNSW index.
+        Also makes sure the BM25 index is loaded.
+        """
+        query_embedding = self._get_query_embedding("plant leaf warm-up")
+        if self.collection.count() > 0:
+            self.collection.query(query_embeddings=[query_embedding], n_results=1)
+        self.lexical_index()
+
+    def add_documents(self, documents: List[str], metadatas: List[dict], ids: List[str],
+                      embeddings: Optional[List[List[float]]] = None):
         """
-        Embeds and adds documents to the collection.
+        Embeds and adds documents to the collection (and the in-memory BM25 index).
+        Pass `embeddings` if they were computed already (bulk ingestion).
         """
         if not documents:
             return
 
-        embeddings = self._get_embeddings(documents)
+        if embeddings is None:
+            embeddings = self._get_embeddings(documents)
+        # Loaded before the write, so a saved index still matches the collection's size
+        index = self.lexical_index()
         self.collection.add(
             documents=documents,
             embeddings=embeddings,
             metadatas=metadatas,
             ids=ids
         )
+        self._index_documents(index, documents, ids)
+        self._invalidate()
+
+    def upsert_documents(self, documents: List[str], metadatas: List[dict], ids: List[str],
+                         embeddings: Optional[List[List[float]]] = None):
+        """Like add_documents, but existing ids are overwritten instead of rejected."""
+        if not documents:
+            return
+
+        if embeddings is None:
+            embeddings = self._get_embeddings(documents)
+        # Loaded before the write, so a saved index still matches the collection's size
+        index = self.lexical_index()
+        self.collection.upsert(
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=metadatas,
+            ids=ids
+        )
+        self._index_documents(index, documents, ids)
+        self._invalidate()
 
-    def query(self, query_text: str, n_results: int = 3) -> List[KnowledgeChunk]:
+    def delete_documents(self, ids: List[str]):
+        if not ids:
+            return
+        index = self.lexical_index()
+        self.collection.delete(ids=ids)
+        for chunk_id in ids:
+            index.remove(chunk_id)
+        self._lexical_dirty = True
+        self._invalidate()
+
+    def query(self, query_text: str, n_results: int = 3, mode: str = "dense") -> List[KnowledgeChunk]:
         """
-        Queries the knowledge base.
+        Queries the knowledge base (see QUERY_MODES).
         """
-        query_embedding = self._get_query_embedding(query_text)
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-        
+        return self.query_batch([query_text], n_results, mode)[0]
+
+    def query_lexical(self, query_text: str, n_results: int = 3) -> List[KnowledgeChunk]:
+        """
+        BM25-only lookup, for exact names ("Septoria", "Gymnosporangium"). Needs no
+        embedding pass; empty if no chunk shares a term with the query.
+        """
+        key = (self.generation, "lexical", query_text, n_results)
+        chunks = self.result_cache.get(key)
+        if chunks is None:
+            chunks = self._lexical_chunks(query_text, n_results)
+            self.result_cache.set(key, chunks)
+        return list(chunks)
+
+    def _lexical_chunks(self, query_text: str, n_results: int, known: Optional[dict] = None) -> List[KnowledgeChunk]:
+        index = self.lexical_index()
+        with LEXICAL_QUERY_SECONDS.time():
+            hits = index.search(query_text, n_results)
+        return self._fetch_chunks([chunk_id for chunk_id, _ in hits], known)
+
+    def _fetch_chunks(self, ids: List[str], known: Optional[dict] = None) -> List[KnowledgeChunk]:
+        """Chunks by id, in the given order; the text lives in Chroma only. `known`: id -> chunk at hand."""
+        known = dict(known or {})
+        missing = [chunk_id for chunk_id in ids if chunk_id not in known]
+        if missing:
+            with CHROMA_QUERY_SECONDS.time():
+                results = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+                metadata = metadata or {}
+                known[chunk_id] = KnowledgeChunk(
+                    id=chunk_id, content=content, source=metadata.get('source', 'unknown'), metadata=metadata
+                )
+        return [known[chunk_id] for chunk_id in ids if chunk_id in known]
+
+    def query_batch(self, query_texts: List[str], n_results: int = 3, mode: str = "dense") -> List[List[KnowledgeChunk]]:
+        """
+        Queries the knowledge base for several texts at once.
+        Dense cache misses are embedded in a single forward pass and sent to Chroma in one call.
+        """
+        if mode not in self.QUERY_MODES:
+            raise ValueError(f"Unknown query mode '{mode}', expected one of {self.QUERY_MODES}")
+        if not query_texts:
+            return []
+        if mode == "lexical":
+            return [self.query_lexical(text, n_results) for text in query_texts]
+        if mode == "dense":
+            return self._query_dense(query_texts, n_results)
+
+        candidates = n_results * self.HYBRID_CANDIDATE_FACTOR
+        dense = self._query_dense(query_texts, candidates)
+        return [
+            reciprocal_rank_fusion([
+                dense_chunks,
+                self._lexical_chunks(text, candidates, known={chunk.id: chunk for chunk in dense_chunks})
+            ], limit=n_results)
+            for text, dense_chunks in zip(query_texts, dense)
+        ]
+
+    def _query_dense(self, query_texts: List[str], n_results: int) -> List[List[KnowledgeChunk]]:
+        generation = self.generation
+        embeddings = self._cached_query_embeddings(query_texts)
+        keys = [(generation, embedding, n_results) for embedding in embeddings]
+        chunks: List[Optional[List[KnowledgeChunk]]] = [self.result_cache.get(key) for key in keys]
+
+        # Duplicate texts in one batch are searched once
+        missing = list(dict.fromkeys(key for key, found in zip(keys, chunks) if found is None))
+        if missing:
+            with CHROMA_QUERY_SECONDS.time():
+                results = self.collection.query(
+                    query_embeddings=[list(key[1]) for key in missing],
+                    n_results=n_results
+                )
+            fetched = {key: self._unpack_results(results, row) for row, key in enumerate(missing)}
+            for key, found in fetched.items():
+                self.result_cache.set(key, found)
+            chunks = [found if found is not None else fetched[key] for key, found in zip(keys, chunks)]
+
+        # Callers get their own lists; the chunks themselves are shared
+        return [list(found) for found in chunks]
+
+    async def query_async(self, query_text: str, n_results: int = 3, mode: str = "dense") -> List[KnowledgeChunk]:
+        """Non-blocking query; encoding and search run on the embedding executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_embedding_executor, self.query, query_text, n_results, mode)
+
+    async def query_batch_async(self, query_texts: List[str], n_results: int = 3,
+                                mode: str = "dense") -> List[List[KnowledgeChunk]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_embedding_executor, self.query_batch, query_texts, n_results, mode)
+
+    def _unpack_results(self, results: dict, row: int) -> List[KnowledgeChunk]:
         # Unpack results
         chunks = []
-        if results['ids']:
-            for i in range(len(results['ids'][0])):
+        if results['ids'] and len(results['ids']) > row:
+            for i in range(len(results['ids'][row])):
                 chunks.append(KnowledgeChunk(
-                    id=results['ids'][0][i],
-                    content=results['documents'][0][i],
-                    source=results['metadatas'][0][i].get('source', 'unknown'),
-                    metadata=results['metadatas'][0][i]
+                    id=results['ids'][row][i],
+                    content=results['documents'][row][i],
+                    source=results['metadatas'][row][i].get('source', 'unknown'),
+                    metadata=results['metadatas'][row][i]
                 ))
         return chunks
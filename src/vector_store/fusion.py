@@ -0,0 +1,28 @@
+from typing import Dict, List, Optional
+
+from src.models.schemas import KnowledgeChunk
+
+# Standard RRF damping constant: keeps the top few ranks from dominating the sum
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(result_lists: List[List[KnowledgeChunk]], k: int = RRF_K,
+                           limit: Optional[int] = None) -> List[KnowledgeChunk]:
+    """
+    Merges several ranked chunk lists into one.
+
+    Each chunk scores sum(1 / (k + rank)) over the lists it appears in (rank from 1),
+    so chunks found by several queries rise to the top. Scores are rank based only,
+    so lists whose distances are not comparable can be mixed. Ties keep first-seen order.
+    """
+    scores: Dict[str, float] = {}
+    chunks: Dict[str, KnowledgeChunk] = {}
+    for results in result_lists:
+        for rank, chunk in enumerate(results or [], start=1):
+            scores[chunk.id] = scores.get(chunk.id, 0.0) + 1.0 / (k + rank)
+            chunks.setdefault(chunk.id, chunk)
+
+    ranked = sorted(chunks, key=lambda chunk_id: scores[chunk_id], reverse=True)
+    if limit is not None:
+        ranked = ranked[:limit]
+    return [chunks[chunk_id] for chunk_id in ranked]
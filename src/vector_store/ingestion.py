@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from src.core.config import settings
+from src.vector_store.chroma_store import BotanicalKnowledgeBase
+
+SUPPORTED_EXTENSIONS = {".txt", ".pdf"}
+
+
+def read_document(path: Path) -> Optional[str]:
+    """Text of a .pdf or text file, or None if it cannot be read."""
+    if path.suffix.lower() == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print("Error: pypdf not installed. Please run: pip install pypdf")
+            return None
+        reader = PdfReader(path)
+        return "".join((page.extract_text() or "") + "\n\n" for page in reader.pages)
+    # Assume text
+    with open(path, "r") as f:
+        return f.read()
+
+def chunk_text(content: str) -> List[str]:
+    # Simple chunking by paragraph for Phase 1
+    return [c.strip() for c in content.split("\n\n") if c.strip()]
+
+def chunk_id(source: str, content: str) -> str:
+    """Deterministic chunk id: re-ingesting the same passage of the same file overwrites it."""
+    return hashlib.sha256(f"{source}\n{content}".encode("utf-8")).hexdigest()
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_key(path: Path, corpus_root: Union[str, Path] = settings.INGEST_CORPUS_ROOT) -> str:
+    """
+    Identifies a file in the manifest and in chunk ids: its resolved path relative to
+    `corpus_root` (e.g. "data/fungi/rust.pdf"), or its absolute path if it lies
+    outside. The same file gets the same key however it was passed (on its own, via
+    its directory, relative or absolute), and two files never share one.
+    """
+    resolved = path.resolve()
+    root = Path(corpus_root).resolve()
+    return resolved.relative_to(root).as_posix() if resolved.is_relative_to(root) else resolved.as_posix()
+
+def find_documents(input_path: Union[str, Path]) -> List[Path]:
+    """The supported files at `input_path` (a file, or a directory searched recursively)."""
+    path = Path(input_path)
+    if path.is_file():
+        return [path]
+    if path.is_dir():
+        return sorted(p for p in path.rglob("*") if p.suffix.lower() in SUPPORTED_EXTENSIONS)
+    return []
+
+
+class IngestionManifest:
+    """
+    What has been ingested, per source file (see source_key): content hash, mtime,
+    size and chunk ids. Stored as JSON next to chroma_db (INGEST_MANIFEST_PATH).
+
+    Version 1 keyed files by absolute path; such entries are re-keyed on load
+    (their chunk ids stay valid). Version 2 keys were relative to whichever
+    directory was ingested, and ambiguous; such manifests are ignored.
+    """
+
+    VERSION = 3
+
+    def __init__(self, path: str = settings.INGEST_MANIFEST_PATH,
+                 corpus_root: Union[str, Path] = settings.INGEST_CORPUS_ROOT):
+        self.path = path
+        self.corpus_root = Path(corpus_root).resolve()
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.files = data.get("files", {})
+            elif data.get("version") == 1:
+                self.files = {source_key(Path(key), self.corpus_root): entry
+                              for key, entry in data.get("files", {}).items()}
+            else:
+                print(f"Ignoring manifest {path}: unsupported version {data.get('version')}.")
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.files.get(key)
+
+    def set(self, key: str, sha256: str, mtime: float, size: int, ids: List[str]):
+        self.files[key] = {"sha256": sha256, "mtime": mtime, "size": size, "ids": ids}
+
+    def remove(self, key: str):
+        self.files.pop(key, None)
+
+    def keys_under(self, root: Path) -> List[str]:
+        """Keys of the files that lie under the directory `root` (compared as resolved paths)."""
+        root = root.resolve()
+        return [key for key in self.files if (self.corpus_root / key).is_relative_to(root)]
+
+    def save(self):
+        # Write-then-rename, so an interrupted run never leaves a truncated manifest
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.VERSION, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class ScannedFile:
+    path: Path
+    key: str
+    mtime: float
+    size: int
+    sha256: Optional[str] = None # None: unchanged since the manifest entry (mtime and size match)
+    content: Optional[str] = None
+
+
+@dataclass
+class IngestionStats:
+    files: int = 0
+    unchanged_files: int = 0
+    skipped_files: int = 0
+    removed_files: int = 0
+    chunks: int = 0
+    deleted_chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.chunks} chunks written from {self.files} files, {self.deleted_chunks} deleted "
+                f"({self.unchanged_files} unchanged, {self.skipped_files} skipped, {self.removed_files} removed) "
+                f"in {self.seconds:.1f}s, {self.chunks_per_second:.1f} chunks/s")
+
+
+class BulkIngestor:
+    """
+    Loads many documents into one BotanicalKnowledgeBase (one model load, one
+    Chroma client).
+
+    Chunks are accumulated across files and embedded `embed_batch_size` at a time,
+    so small files don't each pay for a separate forward pass; embedded chunks are
+    upserted to Chroma `write_batch_size` at a time, so a large PDF never turns into
+    one unbounded write. Reading and parsing the next file overlaps with embedding
+    the current batch. The BM25 index is updated along the way and saved at the end.
+
+    With a manifest, ingestion is incremental: unchanged files are skipped, a
+    changed file only has its new chunks embedded and its stale chunks deleted,
+    and files that disappeared from an ingested directory are purged.
+    Chunk ids are derived from file + content, so re-runs are idempotent.
+    """
+
+    def __init__(self,
+                 kb: Optional[BotanicalKnowledgeBase] = None,
+                 embed_batch_size: int = settings.INGEST_EMBED_BATCH_SIZE,
+                 write_batch_size: int = settings.INGEST_WRITE_BATCH_SIZE,
+                 manifest: Optional[IngestionManifest] = None,
+                 force: bool = False,
+                 corpus_root: Union[str, Path] = settings.INGEST_CORPUS_ROOT):
+        self.kb = kb or BotanicalKnowledgeBase()
+        self.embed_batch_size = embed_batch_size
+        # Chroma rejects batches above its own limit
+        max_batch_size = getattr(self.kb.client, "get_max_batch_size", None)
+        self.write_batch_size = min(write_batch_size, max_batch_size()) if max_batch_size else write_batch_size
+        self.manifest = manifest
+        self.force = force # re-read every file, even if the manifest says it is unchanged
+        self.corpus_root = manifest.corpus_root if manifest is not None else Path(corpus_root).resolve()
+        self.stats = IngestionStats()
+        self._pending = [] # (document, metadata, id) not embedded yet
+        self._embedded = [] # (document, embedding, metadata, id) not written yet
+
+    def add(self, documents: List[str], metadatas: List[dict], ids: List[str]):
+        self._pending.extend(zip(documents, metadatas, ids))
+        while len(self._pending) >= self.embed_batch_size:
+            self._embed(self._pending[:self.embed_batch_size])
+            self._pending = self._pending[self.embed_batch_size:]
+
+    def _embed(self, batch: list):
+        embeddings = self.kb._get_embeddings([document for document, _, _ in batch], batch_size=self.embed_batch_size)
+        self._embedded.extend(
+            (document, embedding, metadata, chunk_id)
+            for (document, metadata, chunk_id), embedding in zip(batch, embeddings)
+        )
+        while len(self._embedded) >= self.write_batch_size:
+            self._write(self._embedded[:self.write_batch_size])
+            self._embedded = self._embedded[self.write_batch_size:]
+
+    def _write(self, batch: list):
+        documents, embeddings, metadatas, ids = (list(column) for column in zip(*batch))
+        self.kb.upsert_documents(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+        self.stats.chunks += len(batch)
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.write_batch_size):
+            batch = ids[start:start + self.write_batch_size]
+            self.kb.delete_documents(batch)
+            self.stats.deleted_chunks += len(batch)
+
+    def flush(self):
+        if self._pending:
+            self._embed(self._pending)
+            self._pending = []
+        if self._embedded:
+            self._write(self._embedded)
+            self._embedded = []
+
+    def add_file(self, path: Path, content: Optional[str], skip_ids=frozenset(), key: Optional[str] = None) -> List[str]:
+        """
+        Queues the chunks of one file, except those in `skip_ids` (already stored).
+        `key` is its source_key (derived from `path` by default). Returns the ids of all its chunks.
+        """
+        chunks = chunk_text(content) if content else []
+        if not chunks:
+            print(f"Skipping {path.name}: No indexable content found.")
+            self.stats.skipped_files += 1
+            return []
+        self.stats.files += 1
+
+        key = key or source_key(path, self.corpus_root)
+        by_id = {}
+        for i, chunk in enumerate(chunks):
+            # A paragraph repeated within a file is stored once
+            by_id.setdefault(chunk_id(key, chunk), (i, chunk))
+        new = [(cid, i, chunk) for cid, (i, chunk) in by_id.items() if cid not in skip_ids]
+        self.add(
+            documents=[chunk for _, _, chunk in new],
+            metadatas=[{"source": path.name, "path": key, "chunk_index": i} for _, i, _ in new],
+            ids=[cid for cid, _, _ in new]
+        )
+        return list(by_id)
+
+    def _scan(self, path: Path) -> ScannedFile:
+        """Runs on the reader thread: stats, hashes and parses a file unless it is unchanged."""
+        stat = path.stat()
+        scanned = ScannedFile(path=path, key=source_key(path, self.corpus_root), mtime=stat.st_mtime, size=stat.st_size)
+        entry = self.manifest.get(scanned.key) if self.manifest is not None else None
+        if entry and not self.force and entry["mtime"] == scanned.mtime and entry["size"] == scanned.size:
+            return scanned
+        scanned.sha256 = file_digest(path)
+        if entry and not self.force and entry["sha256"] == scanned.sha256:
+            return scanned # touched, not changed
+        scanned.content = read_document(path)
+        return scanned
+
+    def _apply(self, scanned: ScannedFile):
+        entry = self.manifest.get(scanned.key) if self.manifest is not None else None
+        if entry and not self.force and scanned.sha256 in (None, entry["sha256"]):
+            self.stats.unchanged_files += 1
+            if scanned.sha256 is not None:
+                self.manifest.set(scanned.key, scanned.sha256, scanned.mtime, scanned.size, entry["ids"])
+            return
+
+        if scanned.content is None:
+            # Unreadable (e.g. pypdf missing): keep the old chunks, and no entry, so the next run retries
+            print(f"Skipping {scanned.path.name}: could not be read.")
+            self.stats.skipped_files += 1
+            return
+
+        old_ids = set(entry["ids"]) if entry else set()
+        ids = self.add_file(scanned.path, scanned.content, skip_ids=old_ids, key=scanned.key)
+        self.delete(sorted(old_ids - set(ids)))
+        if self.manifest is not None:
+            self.manifest.set(scanned.key, scanned.sha256, scanned.mtime, scanned.size, ids)
+
+    def purge_missing(self, roots: Iterable[Path], found: Iterable[Path]):
+        """Deletes the chunks of manifest files under `roots` that no longer exist."""
+        if self.manifest is None:
+            return
+        found_keys = {source_key(path, self.corpus_root) for path in found}
+        for root in roots:
+            if not root.exists():
+                # A mistyped path should not wipe anything
+                continue
+            for key in self.manifest.keys_under(root):
+                if key not in found_keys:
+                    print(f"Removing {key}: file no longer exists.")
+                    self.delete(self.manifest.get(key)["ids"])
+                    self.manifest.remove(key)
+                    self.stats.removed_files += 1
+
+    def ingest(self, paths: Iterable[Path], roots: Iterable[Path] = ()) -> IngestionStats:
+        """
+        Ingests `paths`; with a manifest, also purges files under `roots` that are gone.
+        The manifest is saved once everything has been written, so an interrupted run
+        simply redoes its (idempotent) delta next time.
+        """
+        paths = list(paths)
+        roots = [Path(root) for root in roots]
+        start = time.perf_counter()
+        written = self.stats.chunks
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-reader") as reader:
+            upcoming = reader.submit(self._scan, paths[0]) if paths else None
+            for i, path in enumerate(paths):
+                try:
+                    scanned = upcoming.result()
+                except Exception as e:
+                    print(f"Could not read {path}: {e}")
+                    scanned = None
+                upcoming = reader.submit(self._scan, paths[i + 1]) if i + 1 < len(paths) else None
+                if scanned is not None:
+                    self._apply(scanned)
+                if self.stats.chunks > written:
+                    written = self.stats.chunks
+                    elapsed = time.perf_counter() - start
+                    print(f"[{i + 1}/{len(paths)}] {written} chunks written, {written / elapsed:.1f} chunks/s")
+        self.flush()
+        self.purge_missing(roots, paths)
+        # The BM25 index is saved once, before the manifest that vouches for it
+        self.kb.save_lexical_index()
+        if self.manifest is not None:
+            self.manifest.save()
+        self.stats.seconds += time.perf_counter() - start
+        return self.stats
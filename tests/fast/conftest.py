@@ -0,0 +1,109 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import src.api.main as api_main
+from src.models.schemas import DiagnosisReport, PlantImageAnalysis
+from src.services.chat import ChatService, ChatSessionStore
+from src.services.checkpoints import CheckpointStore
+
+ANALYSIS = PlantImageAnalysis(plant_type="Tomato", visual_symptoms=["brown spots"], confidence=0.9,
+                              description="Concentric rings on the lower leaves.")
+
+
+def analyze(state):
+    if state.get("analysis") is not None:
+        return {}
+    return {"analysis": ANALYSIS}
+
+def diagnose(state):
+    return {"final_report": DiagnosisReport(analysis=state["analysis"], diagnosis="Early blight",
+                                            treatment_plan=["Remove infected leaves"], relevant_knowledge=[])}
+
+
+class FakeGraph:
+    """
+    Stands in for a compiled pipeline graph: runs `nodes`, (name, state -> update)
+    pairs, one after the other. `runs` records the state each run started from.
+    """
+
+    def __init__(self, nodes=(("analyze_image", analyze), ("generate_diagnosis", diagnose))):
+        self.nodes = list(nodes)
+        self.runs = []
+
+    async def astream(self, state, stream_mode="updates"):
+        state = dict(state)
+        self.runs.append(dict(state))
+        for name, node in self.nodes:
+            update = node(state)
+            state.update(update)
+            yield {name: update}
+
+    async def ainvoke(self, state):
+        result = dict(state)
+        async for update in self.astream(state):
+            for node_output in update.values():
+                result.update(node_output)
+        return result
+
+
+class FakePipeline:
+    """Stands in for the RAGPipeline where the API uses it directly (batch shortcuts, timings)."""
+
+    RETRIEVAL_RESULTS = 5
+
+    def __init__(self):
+        self.weather_service = MagicMock()
+        self.weather_service.get_current_weather_async = AsyncMock(return_value=None)
+        self.kb = MagicMock()
+        self.kb.query_async = AsyncMock(return_value=[])
+        self.kb.query_batch_async = AsyncMock(side_effect=lambda queries, n_results, mode: [[] for _ in queries])
+
+    async def analyze_node_async(self, state):
+        return analyze(state)
+
+    @staticmethod
+    def speculative_query(user_query):
+        return None
+
+    @staticmethod
+    def retrieval_query(analysis):
+        return analysis.plant_type
+
+    @staticmethod
+    def merge_context(symptom_context, speculative_context):
+        return symptom_context
+
+    @staticmethod
+    def timings(state, mode="full"):
+        return None
+
+
+def png_bytes(seed: int = 0) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    return cv2.imencode(".png", pixels)[1].tobytes()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    TestClient for the API with a FakeGraph per mode (api.graphs), a FakePipeline
+    (api.pipeline) and fresh stores under tmp_path. The lifespan (warm-up, job
+    workers) is not run.
+    """
+    graphs = {"full": FakeGraph(), "lite": FakeGraph()}
+    pipeline = FakePipeline()
+    monkeypatch.setattr(api_main, "pipeline_instances", graphs)
+    monkeypatch.setattr(api_main, "rag_pipeline_instance", pipeline)
+    monkeypatch.setattr(api_main, "checkpoints", CheckpointStore(str(tmp_path / "checkpoints.db")))
+    monkeypatch.setattr(api_main, "chat_service", ChatService(ChatSessionStore(str(tmp_path / "chat.db")), backend=MagicMock()))
+    monkeypatch.setattr(api_main, "result_cache", None)
+    monkeypatch.setattr(api_main, "near_duplicates", None)
+    monkeypatch.setattr(api_main.settings, "PERSIST_UPLOADS", False)
+    client = TestClient(api_main.app)
+    client.graphs = graphs
+    client.pipeline = pipeline
+    return client
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import src.api.main as api_main
+from src.services.admission import AdmissionController, OverloadedError
+from tests.fast.conftest import png_bytes
+
+
+def test_queue_is_bounded_and_drains():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+        order = []
+
+        async def request(name):
+            async with admission.admit():
+                order.append(name)
+                await release.wait()
+
+        first = asyncio.create_task(request("first"))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(request("queued"))
+        await asyncio.sleep(0.01)
+        assert (admission.in_flight, admission.waiting) == (1, 1)
+
+        # No room left in the queue: rejected at once
+        with pytest.raises(OverloadedError) as rejected:
+            async with admission.admit():
+                pass
+        assert rejected.value.reason == "queue_full" and rejected.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(first, queued)
+        assert order == ["first", "queued"]
+        assert (admission.in_flight, admission.waiting) == (0, 0)
+
+    asyncio.run(scenario())
+
+def test_queue_wait_times_out():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(OverloadedError) as rejected:
+            async with admission.admit():
+                pass
+        assert rejected.value.reason == "queue_timeout" and admission.waiting == 0
+        release.set()
+        await holder
+
+    asyncio.run(scenario())
+
+def test_overloaded_diagnose_returns_503_with_retry_after(api, monkeypatch):
+    admission = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1)
+    # The only slot is taken
+    asyncio.run(admission._semaphore.acquire())
+    monkeypatch.setattr(api_main, "admission", admission)
+
+    response = api.post("/diagnose", files={"file": ("leaf.png", png_bytes(), "image/png")})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert "queue_full" in response.json()["detail"]
+    assert api.graphs["full"].runs == []
@@ -0,0 +1,48 @@
+from src.vector_store.bm25 import BM25Index
+
+
+def build_index():
+    index = BM25Index()
+    index.add("rust", "Cedar apple rust (Gymnosporangium juniperi-virginianae) forms orange galls.")
+    index.add("septoria", "Septoria leaf spot starts as small circular spots on lower tomato leaves.")
+    index.add("blight", "Early blight causes concentric rings on tomato leaves; remove infected leaves.")
+    return index
+
+def test_exact_names_rank_first():
+    index = build_index()
+    assert index.search("Is this Septoria?", 3)[0][0] == "septoria"
+    assert [chunk_id for chunk_id, _ in index.search("gymnosporangium galls", 3)] == ["rust"]
+    assert index.search("zzz unrelated", 3) == []
+
+def test_remove_and_replace():
+    index = build_index()
+    index.add("septoria", "Powdery mildew on squash.")
+    index.remove("rust")
+    assert index.search("septoria", 3) == []
+    assert index.search("gymnosporangium", 3) == []
+    assert index.search("mildew", 3)[0][0] == "septoria"
+    assert len(index) == 2
+
+def test_replaced_chunk_scores_like_a_fresh_one():
+    index = BM25Index()
+    index.add("rust", "Gymnosporangium rust forms orange galls.")
+    index.add("rust", "Gymnosporangium rust forms orange galls.")
+    fresh = BM25Index()
+    fresh.add("rust", "Gymnosporangium rust forms orange galls.")
+    assert index.search("gymnosporangium", 3) == fresh.search("gymnosporangium", 3)
+
+def test_save_compacts_and_round_trips(tmp_path):
+    index = build_index()
+    index.remove("rust")
+    index.add("mildew", "Powdery mildew on squash leaves.")
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    assert index.removed == 0 and index.ids == ["septoria", "blight", "mildew"]
+
+    loaded = BM25Index.load(path)
+    assert loaded.search("tomato leaves", 3) == index.search("tomato leaves", 3)
+    assert loaded.search("gymnosporangium", 3) == []
+    # Loaded postings stay writable
+    loaded.add("rust", "Gymnosporangium rust.")
+    assert loaded.search("gymnosporangium", 3)[0][0] == "rust"
+    assert BM25Index.load(str(tmp_path / "missing.npz")) is None
@@ -0,0 +1,59 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from src.core.config import settings
+from src.models.schemas import ChatMessage
+from src.services.chat import ChatService, ChatSessionStore
+from tests.fast.conftest import ANALYSIS
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_HISTORY_TOKEN_BUDGET", 10)
+    monkeypatch.setattr(settings, "CHAT_KEEP_RECENT_TURNS", 2)
+    backend = AsyncMock()
+    backend.generate_async.return_value = "User asked about watering and spots."
+    return ChatService(ChatSessionStore(str(tmp_path / "chat.db")), backend=backend)
+
+def start(chat, turns=6):
+    history = [ChatMessage(role="user" if i % 2 == 0 else "assistant", content=f"message {i} about the leaves")
+               for i in range(turns)]
+    return chat.start_session({"analysis": ANALYSIS.model_dump(), "diagnosis": "Early blight"}, history)
+
+def test_turn_recorded_after_compaction_keeps_the_summary(chat):
+    diagnosis_id = start(chat)
+    # Loaded for a reply, then compacted before the reply is recorded
+    session = chat.store.get(diagnosis_id)
+    asyncio.run(chat.compact(diagnosis_id))
+    chat.record_turn(session, "Should I spray?", "Copper fungicide helps.")
+
+    stored = chat.store.get(diagnosis_id)
+    assert stored.summary == "User asked about watering and spots."
+    assert [t.content for t in stored.turns] == [
+        "message 4 about the leaves", "message 5 about the leaves", "Should I spray?", "Copper fungicide helps."
+    ]
+    assert session.turns == stored.turns and session.summary == stored.summary
+
+def test_turn_recorded_during_compaction_is_kept(chat):
+    diagnosis_id = start(chat)
+
+    async def summarize_while_a_turn_lands(*args):
+        chat.record_turn(chat.store.get(diagnosis_id), "Should I spray?", "Copper fungicide helps.")
+        return "Summary."
+    chat.backend.generate_async.side_effect = summarize_while_a_turn_lands
+    asyncio.run(chat.compact(diagnosis_id))
+
+    stored = chat.store.get(diagnosis_id)
+    assert stored.summary == "Summary."
+    assert [t.content for t in stored.turns][-2:] == ["Should I spray?", "Copper fungicide helps."]
+    assert len(stored.turns) == 4
+
+def test_concurrent_compactions_fold_once(chat):
+    diagnosis_id = start(chat)
+
+    async def both():
+        await asyncio.gather(chat.compact(diagnosis_id), chat.compact(diagnosis_id))
+    asyncio.run(both())
+    assert len(chat.store.get(diagnosis_id).turns) == 2
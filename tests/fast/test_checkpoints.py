@@ -0,0 +1,55 @@
+import src.api.main as api_main
+from src.models.schemas import KnowledgeChunk
+from src.services.checkpoints import CheckpointStore
+from tests.fast.conftest import ANALYSIS, analyze, diagnose, png_bytes
+
+
+def failed_state(**outputs):
+    return {"image_bytes": b"img", "image_mime": "image/png", "location": "Leeds,UK",
+            "user_query": "", "analysis": None, "retrieved_context": [], "speculative_context": None,
+            "weather": None, "final_report": None, **outputs}
+
+def test_store_round_trip_and_expiry(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"), ttl=60)
+    chunk = KnowledgeChunk(id="c1", content="Early blight.", source="guide.pdf", metadata={})
+    store.save("req1", failed_state(analysis=ANALYSIS, speculative_context=[chunk]), "full")
+
+    checkpoint = store.load("req1")
+    assert (checkpoint.image_bytes, checkpoint.location, checkpoint.mode) == (b"img", "Leeds,UK", "full")
+    # Only finished outputs are kept: None (not run) is left out
+    assert checkpoint.outputs == {"analysis": ANALYSIS, "retrieved_context": [], "speculative_context": [chunk]}
+
+    store.delete("req1")
+    assert store.load("req1") is None
+    store.save("req2", failed_state(), "lite")
+    store.ttl = -1
+    assert store.load("req2") is None
+    assert store.load("unknown") is None
+
+def test_failed_diagnosis_resumes_by_request_id(api):
+    graph = api.graphs["full"]
+    failures = []
+    def flaky_diagnose(state):
+        if failures:
+            raise failures.pop()
+        return diagnose(state)
+    graph.nodes = [("analyze_image", analyze), ("generate_diagnosis", flaky_diagnose)]
+
+    ok = api.post("/diagnose", files={"file": ("leaf.png", png_bytes(), "image/png")})
+    assert ok.status_code == 200
+    # Successful runs leave no checkpoint behind
+    assert api_main.checkpoints.load(ok.headers["X-Request-Id"]) is None
+
+    failures.append(RuntimeError("reasoning model timed out"))
+    failed = api.post("/diagnose", files={"file": ("leaf.png", png_bytes(1), "image/png")},
+                      data={"location": "Leeds,UK"})
+    assert failed.status_code == 500
+    request_id = failed.headers["X-Request-Id"]
+
+    resumed = api.post("/diagnose", data={"request_id": request_id})
+    assert resumed.status_code == 200 and resumed.json()["diagnosis"] == "Early blight"
+    # The retry started from the first attempt's inputs with the analysis pre-filled
+    retry_state = graph.runs[-1]
+    assert retry_state["analysis"] == ANALYSIS and retry_state["location"] == "Leeds,UK"
+    assert api_main.checkpoints.load(request_id) is None
+    assert api.post("/diagnose", data={"request_id": request_id}).status_code == 404
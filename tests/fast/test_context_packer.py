@@ -0,0 +1,32 @@
+from src.core.text import estimate_tokens
+from src.models.schemas import KnowledgeChunk
+from src.rag.context_packer import ContextPacker
+
+
+def chunk(chunk_id, content):
+    return KnowledgeChunk(id=chunk_id, content=content, source="guide.pdf", metadata={})
+
+LONG_CHUNK = (
+    "Tomatoes are grown in warm climates worldwide. "
+    "Early blight causes brown spots with concentric rings on lower leaves. "
+    "Harvest fruit when fully coloured. "
+    "Remove infected leaves and apply a copper fungicide to stop early blight spreading. "
+    "Store seeds in a cool dry place."
+)
+
+def test_pack_keeps_relevant_sentences_within_budget():
+    packer = ContextPacker(token_budget=40)
+    packed = packer.pack([chunk("a", LONG_CHUNK)], "Tomato with brown spots, early blight")
+    text = packed.chunks[0].text
+    assert "concentric rings" in text
+    assert "Store seeds" not in text
+    assert packed.tokens == estimate_tokens(text) <= 40
+    assert packed.raw_tokens == estimate_tokens(LONG_CHUNK)
+
+def test_pack_drops_overlapping_chunks():
+    packer = ContextPacker(token_budget=500)
+    first = chunk("a", LONG_CHUNK)
+    overlapping = chunk("b", "Early blight causes brown spots with concentric rings on lower leaves.")
+    other = chunk("c", "Powdery mildew shows as white powder on rose leaves.")
+    packed = packer.pack([first, overlapping, other], "blight")
+    assert [p.chunk.id for p in packed.chunks] == ["a", "c"]
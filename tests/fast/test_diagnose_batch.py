@@ -0,0 +1,64 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+import src.api.main as api_main
+from tests.fast.conftest import png_bytes
+
+
+def upload(i):
+    return ("files", (f"leaf{i}.png", png_bytes(i), "image/png"))
+
+def test_batch_shares_weather_and_reads_uploads_concurrently(api, monkeypatch):
+    in_flight, peak = 0, 0
+    read_upload = api_main._read_upload
+    async def slow_read_upload(file):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        try:
+            return await read_upload(file)
+        finally:
+            in_flight -= 1
+    monkeypatch.setattr(api_main, "_read_upload", slow_read_upload)
+    monkeypatch.setattr(api_main.settings, "BATCH_CONCURRENCY", 4)
+
+    response = api.post("/diagnose/batch", files=[upload(i) for i in range(3)],
+                        data={"locations": ["Leeds,UK", "Leeds,UK", "York,UK"], "concurrency": "2"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["filename"] for r in results] == ["leaf0.png", "leaf1.png", "leaf2.png"]
+    assert all(r["report"]["diagnosis"] == "Early blight" and r["error"] is None for r in results)
+    # Uploads are read in parallel, within the batch's concurrency
+    assert peak == 2
+    # One lookup per distinct location; a failed lookup (None) is not retried per image
+    assert api.pipeline.weather_service.get_current_weather_async.await_count == 2
+    assert all(run["weather_fetched"] and run["weather"] is None for run in api.graphs["full"].runs)
+    api.pipeline.kb.query_batch_async.assert_awaited_once()
+
+def test_failing_image_does_not_fail_the_batch(api):
+    graph = api.graphs["full"]
+    nodes = list(graph.nodes)
+    def diagnose_or_fail(state):
+        if state["location"] == "Nowhere":
+            raise ValueError("no report")
+        return nodes[-1][1](state)
+    graph.nodes = nodes[:-1] + [("generate_diagnosis", diagnose_or_fail)]
+
+    response = api.post("/diagnose/batch", files=[upload(0), upload(1)], data={"locations": ["Leeds,UK", "Nowhere"]})
+    results = response.json()["results"]
+    assert results[0]["report"] is not None and results[1] == {"filename": "leaf1.png", "report": None, "error": "no report"}
+
+    mismatched = api.post("/diagnose/batch", files=[upload(0), upload(1)], data={"locations": ["Leeds,UK"]})
+    assert mismatched.status_code == 422
+
+def test_fetched_weather_is_not_refetched():
+    pipeline_module = pytest.importorskip("src.rag.pipeline")
+    pipeline = pipeline_module.RAGPipeline.__new__(pipeline_module.RAGPipeline)
+    pipeline.weather_service = MagicMock()
+    state = {"location": "Leeds,UK", "weather": None, "weather_fetched": True}
+    assert asyncio.run(pipeline.fetch_context_node_async(state)) == {}
+    assert pipeline.fetch_context_node(state) == {}
+    assert not pipeline.weather_service.mock_calls
@@ -0,0 +1,52 @@
+import json
+
+import src.api.main as api_main
+from src.services.near_duplicates import NearDuplicateIndex
+from src.services.result_cache import DiagnosisCache
+from tests.fast.conftest import analyze, png_bytes
+
+
+def events(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+def stream(api, seed=0):
+    return api.post("/diagnose/stream", files={"file": ("leaf.png", png_bytes(seed), "image/png")})
+
+def test_node_events_precede_the_report(api):
+    response = stream(api)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    received = events(response)
+    assert [(e["event"], e.get("node")) for e in received] == [
+        ("node", "analyze_image"), ("node", "generate_diagnosis"), ("report", None)
+    ]
+    assert received[0]["data"]["analysis"]["plant_type"] == "Tomato"
+    # The report is only sent once, in the last event
+    assert received[1]["data"] == {}
+    assert received[2]["data"]["diagnosis"] == "Early blight" and received[2]["data"]["diagnosis_id"]
+
+def test_failure_after_start_is_an_error_event(api):
+    def fail(state):
+        raise RuntimeError("reasoning model timed out")
+    api.graphs["full"].nodes = [("analyze_image", analyze), ("generate_diagnosis", fail)]
+    received = events(stream(api))
+    assert [e["event"] for e in received] == ["node", "error"]
+    assert received[-1]["detail"] == "reasoning model timed out"
+
+def test_cache_hit_streams_the_report_only(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(api_main, "result_cache", DiagnosisCache(str(tmp_path / "cache.db")))
+    first = stream(api)
+    assert first.headers["X-Cache"] == "MISS"
+    second = stream(api)
+    assert second.headers["X-Cache"] == "HIT"
+    assert [e["event"] for e in events(second)] == ["report"]
+    assert len(api.graphs["full"].runs) == 1
+
+def test_reused_analysis_reaches_the_client(api, monkeypatch):
+    monkeypatch.setattr(api_main, "near_duplicates", NearDuplicateIndex())
+    stream(api)
+    received = events(stream(api))
+    # The second run started from the first run's analysis
+    assert api.graphs["full"].runs[1]["analysis"].plant_type == "Tomato"
+    assert received[0]["node"] == "analyze_image"
+    assert received[0]["data"]["analysis"]["plant_type"] == "Tomato"
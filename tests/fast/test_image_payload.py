@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+
+from src.services.image_payload import PayloadOptimizer
+from src.services.vision_enhancer import prepare_image_for_ai
+
+
+def noisy_photo(rows=3000, cols=4000):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (rows, cols, 3), dtype=np.uint8)
+
+def test_resize_keeps_aspect_ratio():
+    optimizer = PayloadOptimizer(max_edge=1000)
+    assert optimizer.resize(noisy_photo()).shape[:2] == (750, 1000)
+    small = noisy_photo(300, 400)
+    assert optimizer.resize(small) is small
+
+def test_quality_is_picked_for_the_byte_target():
+    img = cv2.GaussianBlur(noisy_photo(600, 800), (3, 3), 0)
+    optimizer = PayloadOptimizer(max_edge=0, target_bytes=120_000, min_quality=30, max_quality=95)
+    payload = optimizer.encode(img)
+    assert len(payload.data) <= 120_000
+    assert 30 <= payload.quality < 95
+    assert len(optimizer._encode(img, payload.quality + 1)) > 120_000
+
+def test_prepare_image_for_ai():
+    raw = cv2.imencode(".png", noisy_photo(400, 1200))[1].tobytes()
+    data, mime_type = prepare_image_for_ai(raw, PayloadOptimizer(max_edge=600, image_format="webp"))
+    assert mime_type == "image/webp"
+    assert cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (200, 600)
+    assert prepare_image_for_ai(b"not an image") == (b"not an image", None)
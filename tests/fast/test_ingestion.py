@@ -0,0 +1,149 @@
+import json
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from src.vector_store.ingestion import BulkIngestor, IngestionManifest, chunk_text, file_digest
+
+
+def test_chunk_text_splits_paragraphs():
+    assert chunk_text("Early blight.\n\n  \n\nLate blight.\n") == ["Early blight.", "Late blight."]
+
+def test_bulk_ingestor_batches_across_files():
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+    ingestor = BulkIngestor(kb, embed_batch_size=8, write_batch_size=500)
+
+    for i in range(5):
+        ingestor.add_file(Path(f"guide{i}.txt"), "\n\n".join(f"Paragraph {j}" for j in range(45)))
+    ingestor.flush()
+
+    embed_sizes = [len(call.args[0]) for call in kb._get_embeddings.call_args_list]
+    write_sizes = [len(call.kwargs["ids"]) for call in kb.upsert_documents.call_args_list]
+    assert max(embed_sizes) == 8 and sum(embed_sizes) == 225
+    # Capped by Chroma's max batch size
+    assert write_sizes == [100, 100, 25]
+    assert ingestor.stats.chunks == 225 and ingestor.stats.files == 5
+
+def test_manifest_sync_applies_only_the_delta(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("Early blight.\n\nLate blight.")
+    (docs / "b.txt").write_text("Powdery mildew.")
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+
+    def sync():
+        manifest = IngestionManifest(str(tmp_path / "manifest.json"))
+        ingestor = BulkIngestor(kb, embed_batch_size=8, write_batch_size=100, manifest=manifest)
+        return ingestor.ingest(sorted(docs.glob("*.txt")), roots=[docs])
+
+    first = sync()
+    first_ids = [call.kwargs["ids"] for call in kb.upsert_documents.call_args_list][0]
+    assert first.chunks == 3
+
+    kb.reset_mock()
+    assert sync().unchanged_files == 2
+    kb.upsert_documents.assert_not_called()
+
+    (docs / "a.txt").write_text("Early blight.\n\nSeptoria leaf spot.")
+    (docs / "b.txt").unlink()
+    stats = sync()
+    assert stats.chunks == 1 and stats.removed_files == 1
+    deleted = [i for call in kb.delete_documents.call_args_list for i in call.args[0]]
+    assert len(deleted) == 2 and set(deleted) <= set(first_ids)
+
+def test_unreadable_file_is_retried(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "guide.pdf").write_bytes(b"%PDF")
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+    manifest = IngestionManifest(str(tmp_path / "manifest.json"), corpus_root=tmp_path)
+
+    # e.g. pypdf not installed
+    monkeypatch.setattr("src.vector_store.ingestion.read_document", lambda path: None)
+    stats = BulkIngestor(kb, manifest=manifest).ingest([docs / "guide.pdf"], roots=[docs])
+    assert stats.skipped_files == 1 and manifest.get("docs/guide.pdf") is None
+
+    monkeypatch.setattr("src.vector_store.ingestion.read_document", lambda path: "Cedar apple rust.")
+    stats = BulkIngestor(kb, manifest=IngestionManifest(manifest.path, corpus_root=tmp_path)).ingest(
+        [docs / "guide.pdf"], roots=[docs])
+    assert stats.chunks == 1
+
+def test_manifest_keys_are_relative_to_the_corpus_root(tmp_path):
+    corpus = tmp_path / "corpus"
+    docs = corpus / "docs"
+    (docs / "fungi").mkdir(parents=True)
+    (docs / "fungi" / "rust.txt").write_text("Cedar apple rust.")
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+    manifest_path = str(tmp_path / "manifest.json")
+    # A manifest written with absolute keys
+    with open(manifest_path, "w") as f:
+        json.dump({"version": 1, "files": {(docs / "fungi" / "rust.txt").resolve().as_posix(): {
+            "sha256": file_digest(docs / "fungi" / "rust.txt"), "mtime": 0, "size": 0, "ids": ["old"]}}}, f)
+
+    manifest = IngestionManifest(manifest_path, corpus_root=corpus)
+    stats = BulkIngestor(kb, manifest=manifest).ingest([docs / "fungi" / "rust.txt"], roots=[docs])
+    assert stats.unchanged_files == 1 and list(IngestionManifest(manifest_path).files) == ["docs/fungi/rust.txt"]
+
+    # The same corpus somewhere else maps to the same keys and chunk ids
+    moved = tmp_path / "elsewhere"
+    corpus.rename(moved)
+    stats = BulkIngestor(kb, manifest=IngestionManifest(manifest_path, corpus_root=moved)).ingest(
+        [moved / "docs" / "fungi" / "rust.txt"], roots=[moved / "docs"])
+    assert stats.unchanged_files == 1 and stats.removed_files == 0
+
+def test_roots_with_the_same_name_do_not_collide(tmp_path):
+    for farm in ("farmA", "farmB"):
+        (tmp_path / farm / "docs").mkdir(parents=True)
+        (tmp_path / farm / "docs" / "notes.txt").write_text(f"Blight seen at {farm}.")
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    def sync(farm):
+        docs = tmp_path / farm / "docs"
+        manifest = IngestionManifest(manifest_path, corpus_root=tmp_path)
+        return BulkIngestor(kb, manifest=manifest).ingest([docs / "notes.txt"], roots=[docs])
+
+    assert sync("farmA").chunks == 1
+    # Syncing farmB's docs neither overwrites nor purges farmA's
+    stats = sync("farmB")
+    assert stats.chunks == 1 and stats.removed_files == 0
+    kb.delete_documents.assert_not_called()
+    assert sorted(IngestionManifest(manifest_path).files) == ["farmA/docs/notes.txt", "farmB/docs/notes.txt"]
+
+def test_file_then_directory_maps_to_the_same_key(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "rust.txt").write_text("Cedar apple rust.")
+    kb = MagicMock()
+    kb.client.get_max_batch_size.return_value = 100
+    kb._get_embeddings.side_effect = lambda texts, batch_size: [[0.0]] * len(texts)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    # Once on its own, by a relative path...
+    monkeypatch.chdir(docs)
+    stats = BulkIngestor(kb, manifest=IngestionManifest(manifest_path, corpus_root=tmp_path)).ingest([Path("rust.txt")])
+    assert stats.chunks == 1
+    ids = kb.upsert_documents.call_args.kwargs["ids"]
+
+    # ...then through its directory: same entry, same chunk ids, nothing re-embedded
+    kb.reset_mock()
+    stats = BulkIngestor(kb, manifest=IngestionManifest(manifest_path, corpus_root=tmp_path)).ingest(
+        [docs / "rust.txt"], roots=[docs])
+    assert stats.unchanged_files == 1 and stats.chunks == 0
+    kb.upsert_documents.assert_not_called()
+    assert list(IngestionManifest(manifest_path).files) == ["docs/rust.txt"]
+    assert IngestionManifest(manifest_path).get("docs/rust.txt")["ids"] == ids
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from pydantic import BaseModel
+
+from src.services.job_queue import COMPLETED, QUEUED, RUNNING, JobQueue
+
+
+class Result(BaseModel):
+    diagnosis: str
+
+
+def test_submit_claim_complete(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), workers=1)
+    job_id = queue.submit(b"image", "leaf.jpg", "London,UK", "spots?")
+    assert queue.get(job_id)["status"] == QUEUED
+
+    job = queue._claim_next()
+    assert job["id"] == job_id and job["image"] == b"image"
+    assert queue.get(job_id)["status"] == RUNNING
+    assert queue._claim_next() is None
+
+    assert queue._finish(job_id, COMPLETED, Result(diagnosis="Early blight").model_dump_json())
+    assert queue.get(job_id)["result"] == {"diagnosis": "Early blight"}
+
+def test_live_lease_is_not_stolen(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    first = JobQueue(db_path=db_path, lease_seconds=60)
+    job_id = first.submit(b"image", "leaf.jpg", "London,UK")
+    first._claim_next()
+
+    # A second process starting up must not re-run the job
+    second = JobQueue(db_path=db_path, lease_seconds=60)
+    async def restart():
+        await second.start(lambda job: None)
+        await asyncio.sleep(0.05)
+        await second.stop()
+    asyncio.run(restart())
+    assert second._claim_next() is None
+    assert first._renew_lease(job_id)
+
+def test_expired_lease_is_requeued(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    dead = JobQueue(db_path=db_path, lease_seconds=0.05)
+    job_id = dead.submit(b"image", "leaf.jpg", "London,UK")
+    dead._claim_next()
+    time.sleep(0.1)
+
+    survivor = JobQueue(db_path=db_path)
+    assert survivor._claim_next()["id"] == job_id
+    # The original owner lost the job: it can neither renew nor finish it
+    assert not dead._renew_lease(job_id)
+    assert not dead._finish(job_id, COMPLETED, "{}")
+    assert survivor._finish(job_id, COMPLETED, Result(diagnosis="ok").model_dump_json())
+    assert queue_status(survivor, job_id) == COMPLETED
+
+def test_worker_runs_job_and_renews_lease(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), workers=1, lease_seconds=0.15)
+
+    async def handler(job):
+        await asyncio.sleep(0.4) # longer than the lease: only the heartbeat keeps it
+        assert queue._claim_next() is None
+        return Result(diagnosis="Septoria leaf spot")
+
+    async def main():
+        job_id = queue.submit(b"image", "leaf.jpg", "London,UK")
+        await queue.start(handler)
+        for _ in range(100):
+            if queue_status(queue, job_id) == COMPLETED:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return job_id
+
+    job_id = asyncio.run(main())
+    assert queue.get(job_id)["result"] == {"diagnosis": "Septoria leaf spot"}
+
+def queue_status(queue, job_id):
+    return queue.get(job_id)["status"]
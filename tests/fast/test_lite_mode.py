@@ -0,0 +1,57 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import src.api.main as api_main
+from src.models.schemas import KnowledgeChunk, WeatherData
+from src.services.result_cache import DiagnosisCache
+from tests.fast.conftest import ANALYSIS, png_bytes
+
+
+def post(api, mode):
+    return api.post("/diagnose", files={"file": ("leaf.png", png_bytes(), "image/png")}, data={"mode": mode})
+
+def test_mode_selects_the_graph_and_cache_entry(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(api_main, "result_cache", DiagnosisCache(str(tmp_path / "cache.db")))
+    assert post(api, "lite").headers["X-Cache"] == "MISS"
+    assert len(api.graphs["lite"].runs) == 1 and api.graphs["full"].runs == []
+    # Full and lite reports of the same upload are cached separately
+    assert post(api, "full").headers["X-Cache"] == "MISS"
+    assert post(api, "lite").headers["X-Cache"] == "HIT"
+    assert post(api, "turbo").status_code == 400
+
+def test_lite_graph_makes_one_model_call():
+    pipeline_module = pytest.importorskip("src.rag.pipeline")
+    from src.rag.context_packer import ContextPacker
+
+    chunk = KnowledgeChunk(id="c1", content="Early blight causes concentric rings on tomato leaves.",
+                           source="guide.pdf", metadata={})
+    weather = WeatherData(temperature=21.0, humidity=80, condition="light rain", location="Leeds,UK")
+    pipeline = pipeline_module.RAGPipeline.__new__(pipeline_module.RAGPipeline)
+    pipeline.gemini = MagicMock()
+    pipeline.gemini.diagnose_image_async = AsyncMock(return_value={
+        "analysis": ANALYSIS.model_dump(), "diagnosis": "Early blight",
+        "treatment_plan": ["Remove infected leaves"], "relevant_knowledge": ["Rings (Source: guide.pdf)"],
+    })
+    pipeline.weather_service = MagicMock()
+    pipeline.weather_service.get_current_weather_async = AsyncMock(return_value=weather)
+    pipeline.kb = MagicMock()
+    pipeline.kb.query_async = AsyncMock(return_value=[chunk])
+    pipeline.lite_context_packer = ContextPacker(token_budget=300)
+
+    state = {"image_bytes": b"img", "image_mime": "image/png", "user_query": "Is this early blight on my tomato?",
+             "location": "Leeds,UK", "analysis": None, "retrieved_context": [], "speculative_context": None,
+             "weather": None}
+    result = asyncio.run(pipeline.build_graph("lite").ainvoke(state))
+
+    pipeline.gemini.diagnose_image_async.assert_awaited_once()
+    pipeline.gemini.analyze_image_async.assert_not_called()
+    image, prompt, mime_type = pipeline.gemini.diagnose_image_async.await_args.args
+    assert (image, mime_type) == (b"img", "image/png")
+    # Weather and the knowledge prefetched from the question go into the single prompt
+    assert "light rain" in prompt and "concentric rings" in prompt
+    report = result["final_report"]
+    assert report.diagnosis == "Early blight" and report.weather_context == weather
+    assert result["analysis"] == report.analysis and [c.id for c in result["retrieved_context"]] == ["c1"]
+    assert set(result["node_timings"]) == {"fetch_context", "prefetch_context", "lite_diagnosis"}
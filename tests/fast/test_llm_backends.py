@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src.llm.backends import CallPolicy, LLMBackend, ResilientBackend
+
+
+class FlakyBackend(LLMBackend):
+    """Fails or stalls on the first calls, then answers."""
+
+    def __init__(self, failures=0, first_delay=0.0):
+        self.calls = 0
+        self.failures = failures
+        self.first_delay = first_delay
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise google_exceptions.ServiceUnavailable("try again")
+        return f"answer {self.calls}"
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        self.calls += 1
+        call = self.calls
+        if call <= self.failures:
+            raise google_exceptions.ServiceUnavailable("try again")
+        if call == 1:
+            await asyncio.sleep(self.first_delay)
+        return f"answer {call}"
+
+FAST_RETRIES = CallPolicy(timeout=1.0, max_retries=2, backoff_base=0.01, backoff_max=0.01, hedge=False)
+
+def test_retries_transient_errors():
+    inner = FlakyBackend(failures=2)
+    backend = ResilientBackend(inner, default_policy=FAST_RETRIES, policies={})
+    assert backend.generate("m", "hi", "test") == "answer 3"
+
+def test_gives_up_after_max_retries():
+    backend = ResilientBackend(FlakyBackend(failures=5), default_policy=FAST_RETRIES, policies={})
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        backend.generate("m", "hi", "test")
+
+def test_hedge_answers_when_primary_is_slow():
+    policy = CallPolicy(timeout=5.0, max_retries=0, hedge=True, hedge_after=0.05)
+    backend = ResilientBackend(FlakyBackend(first_delay=1.0), default_policy=policy, policies={})
+    assert asyncio.run(backend.generate_async("m", "hi", "test")) == "answer 2"
+
+def test_timeout_is_retried():
+    policy = CallPolicy(timeout=0.05, max_retries=1, backoff_base=0.01, hedge=False)
+    backend = ResilientBackend(FlakyBackend(first_delay=1.0), default_policy=policy, policies={})
+    assert asyncio.run(backend.generate_async("m", "hi", "test")) == "answer 2"
+
+def test_cancelled_caller_cancels_the_hedged_call():
+    cancelled = []
+
+    class SlowBackend(LLMBackend):
+        async def generate_async(self, model_name, contents, operation, generation_config=None):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+    async def scenario():
+        policy = CallPolicy(timeout=10.0, max_retries=0, hedge=True, hedge_after=1.0)
+        backend = ResilientBackend(SlowBackend(), default_policy=policy, policies={})
+        caller = asyncio.ensure_future(backend.generate_async("m", "hi", "test"))
+        # Cancelled before the hedge fires
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # Checked before asyncio.run() would cancel leftover tasks itself
+        assert cancelled == [True]
+
+    asyncio.run(scenario())
+
+def test_hung_sync_attempts_do_not_block_later_calls():
+    release = threading.Event()
+
+    class HangingBackend(LLMBackend):
+        """The first 20 calls hang until released, later ones answer."""
+        def __init__(self):
+            self.calls = 0
+
+        def generate(self, model_name, contents, operation, generation_config=None):
+            self.calls += 1
+            if self.calls <= 20:
+                release.wait(5)
+            return "answer"
+
+    policy = CallPolicy(timeout=0.05, max_retries=0, hedge=False)
+    backend = ResilientBackend(HangingBackend(), default_policy=policy, policies={})
+    try:
+        # More hung attempts than a fixed pool of workers would have
+        for _ in range(20):
+            with pytest.raises(TimeoutError):
+                backend.generate("m", "hi", "test")
+        # Would queue behind the hung attempts, and time out, on a shared pool
+        assert backend.generate("m", "hi", "test") == "answer"
+    finally:
+        release.set()
@@ -0,0 +1,36 @@
+import random
+
+import cv2
+import numpy as np
+
+from src.services.near_duplicates import BKTree, NearDuplicateIndex, hamming, phash
+
+
+def leaf_photo(seed, quality=90):
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(0, 255, (240, 320, 3), dtype=np.uint8), (31, 31), 0)
+    cv2.circle(img, (160, 120), 60, (40, 160, 40), -1)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def test_phash_survives_reencoding():
+    same = hamming(phash(leaf_photo(1, quality=95)), phash(leaf_photo(1, quality=60)))
+    different = hamming(phash(leaf_photo(1)), phash(leaf_photo(2)))
+    assert same <= 4
+    assert different > same
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(0)
+    keys = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for key in keys:
+        tree.add(key, key)
+    query = keys[0] ^ 0b101 # two bits away from keys[0]
+    expected = sorted(hamming(query, k) for k in keys if hamming(query, k) <= 12)
+    assert [d for d, _ in tree.search(query, 12)] == expected
+
+def test_index_reuses_near_duplicate():
+    index = NearDuplicateIndex(max_distance=6, ttl=60, max_entries=10, hash_name="phash")
+    index.add(index.image_hash(leaf_photo(1, quality=95)), "analysis-1")
+    assert index.lookup(index.image_hash(leaf_photo(1, quality=60))) == "analysis-1"
+    assert index.lookup(index.image_hash(leaf_photo(2))) is None
+    assert index.stats()["hits"] == 1
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from src.rag.context_packer import ContextPacker
+from src.rag.pipeline import RAGPipeline, summarize_timings
+from tests.fast.conftest import ANALYSIS
+
+
+def test_critical_path_follows_the_slowest_branch():
+    timings = {
+        "analyze_image": (0.0, 4.0),
+        "fetch_context": (0.0, 0.3),
+        "prefetch_context": (0.0, 0.1),
+        "retrieve_context": (4.0, 4.1),
+        "generate_diagnosis": (4.1, 6.0),
+    }
+    summary = summarize_timings(timings, RAGPipeline.GRAPH_DEPENDENCIES)
+    assert summary.critical_path == ["analyze_image", "retrieve_context", "generate_diagnosis"]
+    assert summary.critical_path_seconds == pytest.approx(6.0)
+    assert summary.serial_seconds == pytest.approx(6.4)
+    assert summary.wall_seconds == pytest.approx(6.0)
+
+    # A slow weather lookup becomes the critical path
+    timings["fetch_context"] = (0.0, 5.0)
+    timings["generate_diagnosis"] = (5.0, 6.9)
+    summary = summarize_timings(timings, RAGPipeline.GRAPH_DEPENDENCIES)
+    assert summary.critical_path == ["fetch_context", "generate_diagnosis"]
+    assert summary.critical_path_seconds == pytest.approx(6.9)
+
+def test_skipped_nodes_and_empty_runs():
+    timings = {"fetch_context": (0.0, 0.2), "lite_diagnosis": (0.2, 2.2)}
+    summary = summarize_timings(timings, RAGPipeline.LITE_GRAPH_DEPENDENCIES)
+    assert summary.critical_path == ["fetch_context", "lite_diagnosis"]
+    assert summarize_timings({}, RAGPipeline.GRAPH_DEPENDENCIES) is None
+
+def test_weather_runs_alongside_image_analysis():
+    async def slow(result):
+        await asyncio.sleep(0.2)
+        return result
+
+    pipeline = RAGPipeline.__new__(RAGPipeline)
+    pipeline.gemini = MagicMock()
+    pipeline.gemini.analyze_image_async = lambda image, mime_type: slow(ANALYSIS)
+    pipeline.weather_service = MagicMock()
+    pipeline.weather_service.get_current_weather_async = lambda location: slow(None)
+    pipeline.kb = MagicMock()
+    pipeline.kb.query_async = lambda query, n_results, mode: slow([])
+    pipeline.llm = MagicMock()
+    pipeline.llm.generate_async = lambda *args: slow(json.dumps(
+        {"diagnosis": "Early blight", "treatment_plan": [], "relevant_knowledge": []}))
+    pipeline.context_packer = ContextPacker()
+
+    state = {"image_bytes": b"img", "image_mime": "image/png", "user_query": "", "location": "Leeds,UK",
+             "analysis": None, "retrieved_context": [], "speculative_context": None, "weather": None}
+    result = asyncio.run(pipeline.build_graph().ainvoke(state))
+    timings = pipeline.timings(result)
+    assert result["final_report"].diagnosis == "Early blight"
+    # analyze -> retrieve -> diagnose; the weather fetch overlaps the vision call
+    assert timings.critical_path == ["analyze_image", "retrieve_context", "generate_diagnosis"]
+    assert timings.wall_seconds < timings.serial_seconds - 0.15
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from src.llm.backends import Cassette, CassetteMissError, LatencyModel, LLMBackend, RecordingBackend, ReplayBackend
+
+
+class LiveStandIn(LLMBackend):
+    """Answers every call with a numbered response, as the live backend would."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, model_name, contents, operation, generation_config=None):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+    async def generate_async(self, model_name, contents, operation, generation_config=None):
+        return self.generate(model_name, contents, operation, generation_config)
+
+    async def stream_async(self, model_name, contents, operation, generation_config=None):
+        self.calls += 1
+        for text in ("Early ", "blight."):
+            yield text
+
+IMAGE = {"mime_type": "image/jpeg", "data": b"img"}
+
+def test_record_then_replay(tmp_path):
+    cassette = Cassette(str(tmp_path))
+    recorder = RecordingBackend(cassette, live=LiveStandIn())
+    assert recorder.generate("m", ["prompt", IMAGE], "test") == "answer 1"
+    replay = ReplayBackend(cassette)
+    # Whitespace differences in prompts still match the recording
+    assert replay.generate("m", ["  prompt ", IMAGE], "test") == "answer 1"
+    assert asyncio.run(replay.generate_async("m", ["prompt", IMAGE], "test")) == "answer 1"
+
+def test_unrecorded_requests_miss(tmp_path):
+    cassette = Cassette(str(tmp_path))
+    RecordingBackend(cassette, live=LiveStandIn()).generate("m", ["prompt", IMAGE], "test", {"temperature": 0.0})
+    replay = ReplayBackend(cassette)
+    for model, contents, config in [
+        ("other", ["prompt", IMAGE], {"temperature": 0.0}),
+        ("m", ["other prompt", IMAGE], {"temperature": 0.0}),
+        ("m", ["prompt", {"mime_type": "image/jpeg", "data": b"other image"}], {"temperature": 0.0}),
+        ("m", ["prompt", IMAGE], {"temperature": 1.0}),
+    ]:
+        with pytest.raises(CassetteMissError):
+            replay.generate(model, contents, "test", config)
+
+def test_streams_replay_chunk_by_chunk(tmp_path):
+    cassette = Cassette(str(tmp_path))
+    recorder = RecordingBackend(cassette, live=LiveStandIn())
+
+    async def collect(backend):
+        return [text async for text in backend.stream_async("m", "Is it blight?", "chat")]
+
+    assert asyncio.run(collect(recorder)) == ["Early ", "blight."]
+    assert asyncio.run(collect(ReplayBackend(cassette))) == ["Early ", "blight."]
+    # The full text is recorded too, for non-streaming replays of the same request
+    assert ReplayBackend(cassette).generate("m", "Is it blight?", "chat") == "Early blight."
+
+def test_latency_models():
+    assert LatencyModel("none").sample(2.0) == 0.0
+    assert LatencyModel("recorded").sample(2.0) == 2.0
+    assert LatencyModel("fixed:0.8").sample(2.0) == 0.8
+    assert 0.5 <= LatencyModel("uniform:0.5,1.5", seed=1).sample(2.0) <= 1.5
+    assert LatencyModel("normal:-5,0.1", seed=1).sample(2.0) == 0.0
+    # Seeded models replay the same latencies
+    samples = [LatencyModel("lognormal:0,0.5", seed=7).sample(0.0) for _ in range(2)]
+    assert samples[0] == samples[1] > 0
+    with pytest.raises(ValueError):
+        LatencyModel("uniform:1")
@@ -0,0 +1,59 @@
+import time
+
+from src.models.schemas import DiagnosisReport, PipelineTimings
+from src.services.result_cache import DiagnosisCache
+from tests.fast.conftest import ANALYSIS
+
+
+def report(diagnosis: str) -> DiagnosisReport:
+    return DiagnosisReport(analysis=ANALYSIS, diagnosis=diagnosis, treatment_plan=[], relevant_knowledge=[])
+
+def test_key_normalizes_query_and_location():
+    key = DiagnosisCache.make_key(b"img", "Is it  Blight?", "London, UK")
+    assert key == DiagnosisCache.make_key(b"img", " is it blight? ", "london,uk")
+    assert DiagnosisCache.make_key(b"img", None, "London,UK") == DiagnosisCache.make_key(b"img", "", "London,UK")
+    assert key != DiagnosisCache.make_key(b"img2", "Is it blight?", "London,UK")
+    assert key != DiagnosisCache.make_key(b"img", "Is it rust?", "London,UK")
+    assert key != DiagnosisCache.make_key(b"img", "Is it blight?", "Paris,FR")
+    assert key != DiagnosisCache.make_key(b"img", "Is it blight?", "London,UK", mode="lite")
+
+def test_memory_lru_falls_back_to_disk(tmp_path):
+    cache = DiagnosisCache(str(tmp_path / "cache.db"), memory_size=1, disk_max_entries=10, ttl=60)
+    cache.set("a", report("Early blight"))
+    cache.set("b", report("Rust"))
+    # "a" was pushed out of memory but is still on disk, and is promoted back
+    assert cache.get("a").diagnosis == "Early blight"
+    assert cache.stats()["disk"]["hits"] == 1
+    assert cache.get("a").diagnosis == "Early blight"
+    assert cache.stats()["memory"]["hits"] == 1
+    assert cache.get("missing") is None and cache.stats()["disk"]["misses"] == 1
+
+    # The disk tier survives a restart
+    assert DiagnosisCache(str(tmp_path / "cache.db"), ttl=60).get("b").diagnosis == "Rust"
+
+def test_timings_are_not_cached(tmp_path):
+    cache = DiagnosisCache(str(tmp_path / "cache.db"), ttl=60)
+    timings = PipelineTimings(nodes={"analyze_image": 4.0}, critical_path=["analyze_image"],
+                              critical_path_seconds=4.0, serial_seconds=4.0, wall_seconds=4.0)
+    cache.set("a", report("Early blight").model_copy(update={"timings": timings}))
+    assert cache.get("a").timings is None
+    assert DiagnosisCache(str(tmp_path / "cache.db"), ttl=60).get("a").timings is None
+
+def test_disk_tier_is_capped_least_recently_used_first(tmp_path):
+    cache = DiagnosisCache(str(tmp_path / "cache.db"), memory_size=0, disk_max_entries=2, ttl=60)
+    cache.set("a", report("A"))
+    time.sleep(0.01)
+    cache.set("b", report("B"))
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", report("C"))
+    assert [cache.get(key) is not None for key in "abc"] == [True, False, True]
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    cache = DiagnosisCache(str(tmp_path / "cache.db"), memory_size=4, ttl=60)
+    cache.set("a", report("Early blight"))
+    now_wall, now_monotonic = time.time(), time.monotonic()
+    monkeypatch.setattr(time, "time", lambda: now_wall + 61)
+    monkeypatch.setattr(time, "monotonic", lambda: now_monotonic + 61)
+    assert cache.get("a") is None
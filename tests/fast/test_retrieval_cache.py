@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from src.vector_store.bm25 import BM25Index
+from src.vector_store.chroma_store import BotanicalKnowledgeBase
+
+
+def chroma_results(query_embeddings, n_results):
+    rows = len(query_embeddings)
+    return {
+        "ids": [[f"doc{r}"] for r in range(rows)],
+        "documents": [["Early blight causes concentric rings."] for _ in range(rows)],
+        "metadatas": [[{"source": "guide.pdf"}] for _ in range(rows)],
+    }
+
+@pytest.fixture
+def kb(tmp_path):
+    model = MagicMock()
+    model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 4))
+    with patch("src.vector_store.chroma_store.chromadb.PersistentClient") as client, \
+         patch("src.vector_store.chroma_store.load_embedding_model", return_value=model):
+        client.return_value.get_or_create_collection.return_value.query.side_effect = chroma_results
+        kb = BotanicalKnowledgeBase()
+        kb.lexical_index_path = str(tmp_path / "bm25.npz")
+        stored = {}
+        kb.collection.add.side_effect = lambda documents, metadatas, ids, **kwargs: stored.update(
+            zip(ids, zip(documents, metadatas)))
+        kb.collection.count.side_effect = lambda: len(stored)
+        kb.collection.get.side_effect = lambda ids=None, **kwargs: {
+            "ids": [i for i in (ids or stored) if i in stored],
+            "documents": [stored[i][0] for i in (ids or stored) if i in stored],
+            "metadatas": [stored[i][1] for i in (ids or stored) if i in stored],
+        }
+        yield kb
+
+def test_repeated_queries_hit_both_caches(kb):
+    first = kb.query("Tomato early blight", 3)
+    second = kb.query("Tomato early blight", 3)
+    assert first == second and first is not second
+    assert kb.embedding_fn.encode.call_count == 1
+    assert kb.collection.query.call_count == 1
+    assert kb.cache_stats()["results"]["hits"] == 1
+
+def test_add_documents_invalidates_results(kb):
+    kb.query("Tomato early blight", 3)
+    kb.add_documents(["New guideline"], [{"source": "new.pdf"}], ["new1"])
+    kb.query("Tomato early blight", 3)
+    assert kb.collection.query.call_count == 2
+    assert kb.cache_stats()["generation"] == 1
+    # The embedding is still valid
+    assert kb.cache_stats()["embeddings"]["hits"] == 1
+
+def test_hybrid_query_fuses_lexical_hits(kb):
+    kb.add_documents(["Gymnosporangium rust forms orange galls on junipers."], [{"source": "rust.pdf"}], ["rust1"])
+    lexical = kb.query("Gymnosporangium", 3, mode="lexical")
+    # Only ids are indexed: the text comes back from Chroma
+    assert [(c.id, c.source) for c in lexical] == [("rust1", "rust.pdf")]
+    assert "orange galls" in lexical[0].content
+    # The dense ranking (doc0) and the lexical one (rust1) are fused
+    assert {c.id for c in kb.query("Gymnosporangium galls", 3, mode="hybrid")} == {"doc0", "rust1"}
+
+def test_writes_are_saved_explicitly(kb):
+    kb.lexical_index()
+    kb.add_documents(["Septoria leaf spot has dark-bordered lesions."], [{"source": "septoria.pdf"}], ["sept1"])
+    # The file is rewritten by save_lexical_index(), not by every write
+    assert len(BM25Index.load(kb.lexical_index_path)) == 0
+    kb.save_lexical_index()
+    assert len(BM25Index.load(kb.lexical_index_path)) == 1
@@ -0,0 +1,22 @@
+from src.core.text import content_terms
+from src.models.schemas import KnowledgeChunk
+from src.vector_store.fusion import reciprocal_rank_fusion
+
+
+def chunk(chunk_id):
+    return KnowledgeChunk(id=chunk_id, content=f"content {chunk_id}", source="test.pdf", metadata={})
+
+def test_rrf_prefers_chunks_found_by_both_queries():
+    symptom = [chunk("a"), chunk("b"), chunk("c")]
+    question = [chunk("c"), chunk("d")]
+    merged = reciprocal_rank_fusion([symptom, question])
+    assert [c.id for c in merged] == ["c", "a", "b", "d"]
+
+def test_rrf_limit_and_ties():
+    merged = reciprocal_rank_fusion([[chunk("a")], [chunk("b")]], limit=1)
+    # Equal scores keep the order of the first list
+    assert [c.id for c in merged] == ["a"]
+
+def test_content_terms_drop_filler():
+    assert content_terms("Is this tomato blight contagious?") == ["tomato", "blight", "contagious"]
+    assert content_terms("What is wrong?") == []
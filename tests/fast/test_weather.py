@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+from src.services.weather import WeatherService
+
+LONDON = {"main": {"temp": 20.5, "humidity": 60}, "weather": [{"description": "sunny"}], "name": "London"}
+
+
+def test_async_fetches_share_one_client():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=LONDON)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = WeatherService(client=client)
+    service.api_key = "test_key"
+
+    async def scenario():
+        first = await service.get_current_weather_async("London,UK")
+        second = await service.get_current_weather_async("London,UK")
+        await service.aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.temperature == 20.5 and second.condition == "sunny"
+    assert len(requests) == 2 and requests[0].url.params["q"] == "London,UK"
+    assert client.is_closed and service._client is None
+
+def test_open_is_idempotent():
+    service = WeatherService()
+    service.open()
+    client = service._client
+    service.open()
+    assert service._client is client
+    asyncio.run(service.aclose())
+    assert client.is_closed